@@ -0,0 +1,83 @@
+import os.path
+from aws_cdk import (
+    core,
+    aws_iam as iam,
+    aws_imagebuilder as imagebuilder
+    )
+from cdk_minecraft.image_layers import image_layers, recipe_hash
+from cdk_minecraft.instance_types import instance_spec
+
+dirname = os.path.dirname(__file__)
+
+# Amazon's own Image Builder images for Amazon Linux 2, x.x.x always means the newest one
+PARENT_IMAGES = {"x86_64": "arn:{partition}:imagebuilder:{region}:aws:image/amazon-linux-2-x86/x.x.x",
+                 "arm64": "arn:{partition}:imagebuilder:{region}:aws:image/amazon-linux-2-arm64/x.x.x"}
+BUILD_INSTANCE_TYPES = {"x86_64": "t3.small", "arm64": "t4g.small"}
+
+class CdkMinecraftImageStack(core.Stack):
+
+    def __init__(self, scope: core.Construct, construct_id: str, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # This stack bakes everything configure.sh used to install on every new server (OS updates, java, python modules, the tools repo and
+        #   the paper jar) into an AMI named minecraft-<arch>-<date>.  With useBakedImage the main stack starts from the newest one, and
+        #   configure.sh skips straight to the per-instance setup.  Each script in cdk_minecraft/image is a layer, see image_layers.py.
+
+        arch = instance_spec(self.node.try_get_context("InstanceType")).arch
+        parent_image = PARENT_IMAGES[arch].format(partition=self.partition, region=self.region)
+        layers = image_layers(os.path.join(dirname, "image"),
+                              {"MINECRAFT_VERSION": self.node.try_get_context("imageMinecraftVersion")})
+
+        # Components can't be changed once created, so each one is named after its content hash.  Any changed layer means a new recipe and a
+        #   full build, every layer runs again.
+        components = []
+        for layer in layers:
+            component = imagebuilder.CfnComponent(self, "Layer " + layer.name,
+                                                  name = f"minecraft-{layer.name}-{layer.hash}",
+                                                  platform = "Linux",
+                                                  version = "1.0.0",
+                                                  data = layer.document)
+            components.append(imagebuilder.CfnImageRecipe.ComponentConfigurationProperty(component_arn = component.attr_arn))
+
+        recipe = imagebuilder.CfnImageRecipe(self, "Minecraft Recipe",
+                                             name = f"minecraft-{arch}-{recipe_hash(layers, parent_image)}",
+                                             version = "1.0.0",
+                                             parent_image = parent_image,
+                                             components = components)
+
+        # The build instance needs to be managed by SSM, which is how Image Builder runs the layers on it
+        build_role = iam.Role(self, "ImageBuilderPermissions", assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"))
+        build_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("AmazonSSMManagedInstanceCore"))
+        build_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("EC2InstanceProfileForImageBuilder"))
+        build_profile = iam.CfnInstanceProfile(self, "ImageBuilderProfile", roles = [build_role.role_name])
+
+        # No subnet given, so the build runs in the account's default VPC
+        infrastructure = imagebuilder.CfnInfrastructureConfiguration(self, "Minecraft Image Infrastructure",
+                                                                     name = f"minecraft-{arch}",
+                                                                     instance_profile_name = build_profile.ref,
+                                                                     instance_types = [BUILD_INSTANCE_TYPES[arch]],
+                                                                     terminate_instance_on_failure = True)
+
+        distribution = imagebuilder.CfnDistributionConfiguration(self, "Minecraft Image Distribution",
+                                                                 name = f"minecraft-{arch}",
+                                                                 distributions = [imagebuilder.CfnDistributionConfiguration.DistributionProperty(
+                                                                    region = self.region,
+                                                                    ami_distribution_configuration = {
+                                                                        "Name": "minecraft-" + arch + "-{{ imagebuilder:buildDate }}",
+                                                                        "AmiTags": {"minecraft:layers": " ".join(f"{layer.name}={layer.hash}" for layer in layers)}})])
+
+        # Deploying builds the first image, and a new one whenever a deploy changes the recipe.  After that the pipeline checks weekly and only
+        #   builds a new image when the base Amazon Linux image has been updated, since the layers themselves only change through a deploy.
+        imagebuilder.CfnImage(self, "Minecraft Image",
+                              image_recipe_arn = recipe.attr_arn,
+                              infrastructure_configuration_arn = infrastructure.attr_arn,
+                              distribution_configuration_arn = distribution.attr_arn)
+
+        imagebuilder.CfnImagePipeline(self, "Minecraft Image Pipeline",
+                                      name = f"minecraft-{arch}",
+                                      image_recipe_arn = recipe.attr_arn,
+                                      infrastructure_configuration_arn = infrastructure.attr_arn,
+                                      distribution_configuration_arn = distribution.attr_arn,
+                                      schedule = imagebuilder.CfnImagePipeline.ScheduleProperty(
+                                          schedule_expression = "cron(0 6 ? * mon *)",
+                                          pipeline_execution_start_condition = "EXPRESSION_MATCH_AND_DEPENDENCY_UPDATES_AVAILABLE"))
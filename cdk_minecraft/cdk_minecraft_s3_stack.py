@@ -15,13 +15,31 @@ class CdkMinecraftS3Stack(core.Stack):
         ssm.StringParameter(self, "FileBucketURL", parameter_name = "s3_bucket_files", 
                                     string_value = minecraft_files.bucket_arn)
         
+        # Backups are stored as chunks shared between snapshots, so only the snapshot manifests expire.  Chunks are cleaned up
+        #   by running "world_backup.py prune" once their manifests are gone.
         if self.node.try_get_context("useS3Backup"):
             minecraft_backups = s3.Bucket(self, "MinecraftBackups",
                                             block_public_access = s3.BlockPublicAccess.BLOCK_ALL,
-                                            lifecycle_rules = [s3.LifecycleRule(expiration = core.Duration.days(365))])
+                                            lifecycle_rules = [s3.LifecycleRule(expiration = core.Duration.days(365),
+                                                                                tag_filters = {"expires": "true"})])
             ssm.StringParameter(self, "BackupBucketName", parameter_name = "s3_bucket_backups", 
                                     string_value = minecraft_backups.bucket_arn)                
                                     
 
         minecraft_log = logs.LogGroup(self, "MinecraftLog", log_group_name = "minecraft.log", retention = logs.RetentionDays.ONE_MONTH)
-        messages_log = logs.LogGroup(self, "MessagesLog", log_group_name = "/var/log/messages", retention = logs.RetentionDays.ONE_MONTH)
\ No newline at end of file
+
+        # minecraft.log holds the structured events from log_parser.py, these filters turn them into metrics in the Minecraft namespace
+        for name, event, value in [("player_joins", "join", "1"),
+                                   ("player_leaves", "leave", "1"),
+                                   ("lag_warnings", "lag", "1"),
+                                   ("ticks_behind", "lag", "$.ticks_behind"),
+                                   ("chunk_save_ms", "chunk_save", "$.duration_ms"),
+                                   ("crashes", "crash", "1")]:
+            logs.MetricFilter(self, "MinecraftLogMetric-" + name,
+                              log_group = minecraft_log,
+                              metric_namespace = "Minecraft",
+                              metric_name = name,
+                              filter_pattern = logs.FilterPattern.string_value("$.event", "=", event),
+                              metric_value = value)
+        messages_log = logs.LogGroup(self, "MessagesLog", log_group_name = "/var/log/messages", retention = logs.RetentionDays.ONE_MONTH)
+        metrics_log = logs.LogGroup(self, "MetricsLog", log_group_name = "minecraft.metrics", retention = logs.RetentionDays.ONE_WEEK)
\ No newline at end of file
@@ -1,6 +1,9 @@
 import os.path
 from math import ceil
 from aws_cdk.aws_s3_assets import Asset
+from cdk_minecraft.jvm_profiles import jvm_profile, environment_file, world_memory
+from cdk_minecraft.instance_types import instance_spec
+from cdk_minecraft.worlds import world_settings, resource_dropin, worlds_file
 from aws_cdk import (
     core,
     aws_ec2 as ec2,
@@ -13,7 +16,8 @@ from aws_cdk import (
     aws_cloudwatch_actions as cw_actions,
     aws_lambda as lambda_,
     aws_apigateway as api,
-    aws_budgets as budget
+    aws_budgets as budget,
+    aws_dlm as dlm
     )
 
 dirname = os.path.dirname(__file__)
@@ -42,11 +46,26 @@ class CdkMinecraftStack(core.Stack):
                         edition=ec2.AmazonLinuxEdition.STANDARD,
                         virtualization=ec2.AmazonLinuxVirt.HVM,
                         storage=ec2.AmazonLinuxStorage.GENERAL_PURPOSE )
+
+        # Or start from the newest image baked by the cdk-minecraft-image stack, which already has java, the python modules and paper installed.
+        #   The lookup is cached in cdk.context.json, run "cdk context --reset" on it to pick up a newer image.
+        if self.node.try_get_context("useBakedImage"):
+            amzn_linux = ec2.MachineImage.lookup(
+                        name=f"minecraft-{instance_spec(self.node.try_get_context('InstanceType')).arch}-*",
+                        owners=["self"])
  
         # Set up our security group, this will allow access on the minecraft port, and SSH depending on what was selected
         
         minecraft_security = ec2.SecurityGroup(self, "Minecraft Security", vpc = vpc)
         minecraft_security.add_ingress_rule(ec2.Peer.any_ipv4(), ec2.Port.tcp(25565), 'Allow Minecraft from Anywhere')
+
+        # Each world in the worlds list of cdk.json runs as its own minecraft@<name> on its own port (see worlds.py)
+        worlds = world_settings(self.node.try_get_context("worlds"),
+                                idle_minutes = self.node.try_get_context("shutdownWhenIdleMinutes"),
+                                min_players = self.node.try_get_context("shutdownWhenIdleMinimumPlayers"))
+        for world in worlds:
+            if world["port"] != 25565:
+                minecraft_security.add_ingress_rule(ec2.Peer.any_ipv4(), ec2.Port.tcp(world["port"]), f'Allow Minecraft world {world["name"]} from Anywhere')
         if self.node.try_get_context('myIpAddress'):      #Only create a rule if the personal IP is assigned
             minecraft_security.add_ingress_rule(ec2.Peer.ipv4(self.node.try_get_context('MyIPAddress')), ec2.Port.tcp(22), 'Allow SSH from my network')
         if self.node.try_get_context('useEc2InstanceConnect'):      #This can be turned on/off with the boolean in the context
@@ -68,6 +87,37 @@ class CdkMinecraftStack(core.Stack):
                             security_group = minecraft_security
                             )
         
+        # The worlds get their own gp3 volume, mounted at /opt/minecraft by world_volume.sh, so chunk loads and saves aren't queued up behind
+        #   the OS on the root disk.  CloudFormation only takes gp3 throughput for an instance through a launch template, so the volume goes there.
+        world_volume = ec2.CfnLaunchTemplate.BlockDeviceMappingProperty(
+                            device_name="/dev/sdf",
+                            ebs=ec2.CfnLaunchTemplate.EbsProperty(
+                                volume_size=self.node.try_get_context("worldVolumeSize"),
+                                volume_type="gp3",
+                                iops=self.node.try_get_context("worldVolumeIops"),
+                                throughput=self.node.try_get_context("worldVolumeThroughput"),
+                                delete_on_termination=True))
+
+        # With useSpot the instance is a persistent spot request that stops instead of terminating when AWS needs the capacity back.  The instance
+        #   id, world volume and everything pointing at them (startup URL, idle alarm, budget action) stay the same, and it starts again on its own
+        #   when there's capacity.  spot_watcher.py on the server saves the world when the two minute notice arrives.
+        spot_options = None
+        if self.node.try_get_context("useSpot"):
+            spot_options = ec2.CfnLaunchTemplate.InstanceMarketOptionsProperty(
+                            market_type="spot",
+                            spot_options=ec2.CfnLaunchTemplate.SpotOptionsProperty(
+                                spot_instance_type="persistent",
+                                instance_interruption_behavior="stop",
+                                max_price=str(self.node.try_get_context("spotMaxPrice")) if self.node.try_get_context("spotMaxPrice") else None))
+
+        launch_template = ec2.CfnLaunchTemplate(self, "Minecraft Launch Template",
+                            launch_template_data=ec2.CfnLaunchTemplate.LaunchTemplateDataProperty(
+                                block_device_mappings=[world_volume],
+                                instance_market_options=spot_options))
+        minecraft_server.instance.launch_template = ec2.CfnInstance.LaunchTemplateSpecificationProperty(
+                            launch_template_id=launch_template.ref,
+                            version=launch_template.attr_latest_version_number)
+        
         # We build out an ARN of the server so that we can plug it into the policy below
         minecraft_server_arn = core.Stack.of(self).format_arn(service="ec2", resource="instance", resource_name= minecraft_server.instance_id )
         
@@ -122,7 +172,10 @@ class CdkMinecraftStack(core.Stack):
                                                     actions=["ec2:*"]),
                                                     iam.PolicyStatement(effect=iam.Effect.ALLOW,
                                                     resources=["arn:aws:route53:::hostedzone/" + dns_zone.hosted_zone_id],
-                                                    actions=["route53:ChangeResourceRecordSets"]),
+                                                    actions=["route53:ChangeResourceRecordSets", "route53:ListResourceRecordSets"]),
+                                                    iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                    resources=["arn:aws:route53:::change/*"],
+                                                    actions=["route53:GetChange"]),
                                                     iam.PolicyStatement(effect=iam.Effect.ALLOW,
                                                     resources=["*"],
                                                     actions=["route53:ListHostedZones"])
@@ -147,18 +200,268 @@ class CdkMinecraftStack(core.Stack):
                                                namespace = 'Minecraft',
                                                dimensions_map = {"InstanceId": minecraft_server.instance_id} )
         max_players_metric.grant_put_metric_data(minecraft_server.role)
+
+        # When a new server restores its world from a backup, it reports how fast the restore went and how long it took until players could join
+        restore_throughput_metric = cloudwatch.Metric(metric_name = "restore_throughput",
+                                                      namespace = 'Minecraft',
+                                                      dimensions_map = {"InstanceId": minecraft_server.instance_id} )
+        restore_throughput_metric.grant_put_metric_data(minecraft_server.role)
+
+        restore_time_to_joinable_metric = cloudwatch.Metric(metric_name = "restore_time_to_joinable",
+                                                            namespace = 'Minecraft',
+                                                            dimensions_map = {"InstanceId": minecraft_server.instance_id} )
+        restore_time_to_joinable_metric.grant_put_metric_data(minecraft_server.role)
         
         #Set up an alarm on the playercount metric
         if self.node.try_get_context("shutdownWhenIdle"):
-            alarm = cloudwatch.Alarm(self, "Idle Server Alarm",
-                metric=active_players_metric,
-                threshold=self.node.try_get_context("shutdownWhenIdleMinimumPlayers"),
+            idle_periods = ceil(self.node.try_get_context("shutdownWhenIdleMinutes")/5)
+
+            # idle_watchdog.py on the server checks the player count every few seconds and saves, backs up and stops the server itself as soon as
+            #   it has been idle for shutdownWhenIdleMinutes.  The alarm below only sees 5 minute periods, so with the watchdog running it is just a
+            #   backstop, and waits two more periods to stay out of the watchdog's way.
+            if self.node.try_get_context("idleWatchdog"):
+                idle_periods += 2
+                watchdog_settings = {"IDLE_MINUTES": self.node.try_get_context("shutdownWhenIdleMinutes"),
+                                     "MIN_PLAYERS": self.node.try_get_context("shutdownWhenIdleMinimumPlayers"),
+                                     "POLL_SECONDS": self.node.try_get_context("idleWatchdogPollSeconds"),
+                                     "HYSTERESIS_SECONDS": self.node.try_get_context("idleWatchdogHysteresisSeconds")}
+                minecraft_server.user_data.add_commands("mkdir -p /etc/minecraft",
+                                                        "cat > /etc/minecraft/idle_watchdog.conf <<'EOF'\n" + environment_file(watchdog_settings) + "EOF")
+
+            # active_players only counts the server world, so with more than one world the alarm could stop the instance under someone playing
+            #   on another one.  Only the watchdog knows about every world.
+            if len(worlds) > 1 and not self.node.try_get_context("idleWatchdog"):
+                raise ValueError("shutdownWhenIdle with more than one world needs idleWatchdog")
+            if len(worlds) == 1:
+                # The name is fixed so pregen.py can find the alarm (through the idle_alarm_name tag) and hold it off while it generates chunks
+                alarm = cloudwatch.Alarm(self, "Idle Server Alarm",
+                    alarm_name=f"{self.stack_name}-idle-shutdown",
+                    metric=active_players_metric,
+                    threshold=self.node.try_get_context("shutdownWhenIdleMinimumPlayers"),
+                    comparison_operator = cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+                    evaluation_periods=idle_periods,
+                    datapoints_to_alarm=idle_periods,
+                    statistic="max")
+                alarm.add_alarm_action(cw_actions.Ec2Action(cw_actions.Ec2InstanceAction.STOP))
+                core.Tags.of(minecraft_server).add("idle_alarm_name", alarm.alarm_name)
+                minecraft_server.role.add_to_principal_policy(iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                                                  resources=[alarm.alarm_arn],
+                                                                                  actions=["cloudwatch:DisableAlarmActions", "cloudwatch:EnableAlarmActions",
+                                                                                           "cloudwatch:SetAlarmState"]))
+
+        # pregen.py generates the world out to pregenRadius blocks while nobody is playing, a bit at a time
+        if self.node.try_get_context("pregenRadius"):
+            pregen_settings = {"PREGEN_RADIUS": self.node.try_get_context("pregenRadius"),
+                               "PREGEN_CENTER_X": self.node.try_get_context("pregenCenterX"),
+                               "PREGEN_CENTER_Z": self.node.try_get_context("pregenCenterZ"),
+                               "PREGEN_HOURS": self.node.try_get_context("pregenHours") or "",
+                               "PREGEN_MAX_MINUTES": self.node.try_get_context("pregenMaxMinutes")}
+            minecraft_server.user_data.add_commands("mkdir -p /etc/minecraft",
+                                                    "cat > /etc/minecraft/pregen.conf <<'EOF'\n" + environment_file(pregen_settings) + "EOF")
+
+        # tick_metrics.py on the server reads tick performance over RCON and hands it to the cloudwatch agent as embedded metric format logs,
+        #   so these show up in the same namespace without the instance calling PutMetricData itself.
+        mspt_metric = cloudwatch.Metric(metric_name = "mspt",
+                                        namespace = 'Minecraft',
+                                        dimensions_map = {"InstanceId": minecraft_server.instance_id},
+                                        statistic = "avg",
+                                        period = core.Duration.minutes(1) )
+        tps_metric = cloudwatch.Metric(metric_name = "tps",
+                                       namespace = 'Minecraft',
+                                       dimensions_map = {"InstanceId": minecraft_server.instance_id},
+                                       statistic = "avg",
+                                       period = core.Duration.minutes(1) )
+        loaded_chunks_metric = cloudwatch.Metric(metric_name = "loaded_chunks",
+                                                 namespace = 'Minecraft',
+                                                 dimensions_map = {"InstanceId": minecraft_server.instance_id},
+                                                 statistic = "max",
+                                                 period = core.Duration.minutes(1) )
+        entities_metric = cloudwatch.Metric(metric_name = "entities",
+                                            namespace = 'Minecraft',
+                                            dimensions_map = {"InstanceId": minecraft_server.instance_id},
+                                            statistic = "max",
+                                            period = core.Duration.minutes(1) )
+
+        # Alarm when ticks take too long (over 50ms per tick means the server can't keep up), or TPS drops, for 3 minutes in a row
+        if self.node.try_get_context("tickAlarms"):
+            cloudwatch.Alarm(self, "Tick Time Alarm",
+                metric=mspt_metric,
+                threshold=self.node.try_get_context("tickAlarmMspt"),
+                comparison_operator = cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                evaluation_periods=3,
+                datapoints_to_alarm=3,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING)
+            cloudwatch.Alarm(self, "Low TPS Alarm",
+                metric=tps_metric,
+                threshold=self.node.try_get_context("tickAlarmTps"),
                 comparison_operator = cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
-                evaluation_periods=ceil(self.node.try_get_context("shutdownWhenIdleMinutes")/5),
-                datapoints_to_alarm=ceil(self.node.try_get_context("shutdownWhenIdleMinutes")/5),
-                statistic="max")
-            alarm.add_alarm_action(cw_actions.Ec2Action(cw_actions.Ec2InstanceAction.STOP))
+                evaluation_periods=3,
+                datapoints_to_alarm=3,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING)
+
+        # view_controller.py on the server steps the view distance down when ticks run long and back up when there's room again.  The distances
+        #   it settles on go on the dashboard next to the tick time.
+        if self.node.try_get_context("adaptiveViewDistance"):
+            commands = self.node.try_get_context("viewDistanceCommands") or {}
+            view_settings = {"VIEW_MAX": self.node.try_get_context("viewDistanceMax"),
+                             "VIEW_MIN": self.node.try_get_context("viewDistanceMin"),
+                             "HIGH_MSPT": self.node.try_get_context("viewDistanceHighMspt"),
+                             "LOW_MSPT": self.node.try_get_context("viewDistanceLowMspt"),
+                             "VIEW_COMMAND": commands.get("view", ""),
+                             "SIMULATION_COMMAND": commands.get("simulation", ""),
+                             "ENTITY_COMMAND": commands.get("entity", "")}
+            minecraft_server.user_data.add_commands("mkdir -p /etc/minecraft",
+                                                    "cat > /etc/minecraft/view_controller.conf <<'EOF'\n" + environment_file(view_settings) + "EOF")
+
+        # One place to see how the server is doing
+        dashboard = cloudwatch.Dashboard(self, "Minecraft Dashboard")
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Players", left=[active_players_metric, max_players_metric]),
+            cloudwatch.GraphWidget(title="Tick time (ms) / TPS", left=[mspt_metric], right=[tps_metric]),
+            cloudwatch.GraphWidget(title="Loaded chunks / entities", left=[loaded_chunks_metric], right=[entities_metric]))
+        if len(worlds) > 1:
+            # tick_metrics.py also publishes everything per world, so we can see which world is the busy one
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(title="Tick time (ms) by world",
+                                       left=[cloudwatch.Metric(metric_name = "mspt",
+                                                               namespace = 'Minecraft',
+                                                               dimensions_map = {"InstanceId": minecraft_server.instance_id, "World": world["name"]},
+                                                               statistic = "avg",
+                                                               label = world["name"],
+                                                               period = core.Duration.minutes(1)) for world in worlds]))
+        # boot_trace.py times every start from the startup URL (or power on) until players can join, and each phase along the way
+        time_to_joinable = {stat: cloudwatch.Metric(metric_name = "time_to_joinable",
+                                                    namespace = 'Minecraft',
+                                                    dimensions_map = {"InstanceId": minecraft_server.instance_id},
+                                                    statistic = stat,
+                                                    label = "time to joinable " + stat,
+                                                    period = core.Duration.days(1)) for stat in ("p50", "p95")}
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Time to joinable (s)", left=[time_to_joinable["p50"], time_to_joinable["p95"]]),
+            cloudwatch.GraphWidget(title="Boot phases (s, p50)",
+                                   stacked=True,
+                                   left=[cloudwatch.Metric(metric_name = "boot_phase_seconds",
+                                                           namespace = 'Minecraft',
+                                                           dimensions_map = {"InstanceId": minecraft_server.instance_id, "Phase": phase},
+                                                           statistic = "p50",
+                                                           label = phase,
+                                                           period = core.Duration.days(1))
+                                         for phase in ("ec2_start", "os_boot", "user_data", "fast_tier", "artifacts", "dns", "server_start", "world_load")]))
+        if self.node.try_get_context("adaptiveViewDistance"):
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(title="View distance",
+                                       left=[cloudwatch.Metric(metric_name = "view_distance",
+                                                               namespace = 'Minecraft',
+                                                               dimensions_map = {"InstanceId": minecraft_server.instance_id, "World": world["name"]},
+                                                               statistic = "avg",
+                                                               label = world["name"],
+                                                               period = core.Duration.minutes(1)) for world in worlds]))
        
+        ###########################
+        #                         #
+        #  WORLD VOLUME SECTION   #
+        #                         #
+        ###########################
+
+        # Optionally the worlds run from a faster tier (local NVMe instance store, or memory) and world_sync.py copies them back to the
+        #   volume every few minutes and when the server stops.  tmpfs comes out of the instance's memory, so the JVM gets that much less.
+        fast_tier = self.node.try_get_context("worldFastTier") or ""
+        if fast_tier not in ("", "instance-store", "tmpfs"):
+            raise ValueError(f"worldFastTier must be false, instance-store or tmpfs, not {fast_tier}")
+        if fast_tier == "instance-store" and not instance_spec(self.node.try_get_context("InstanceType")).instance_store:
+            raise ValueError(f"worldFastTier is instance-store, but {self.node.try_get_context('InstanceType')} has no instance store (try a d type like m5d)")
+        tmpfs_mib = self.node.try_get_context("worldTmpfsMiB") if fast_tier == "tmpfs" else 0
+        world_volume_settings = {"WORLD_FAST_TIER": fast_tier,
+                                 "WORLD_TMPFS_MIB": tmpfs_mib,
+                                 "WORLD_SYNC_MINUTES": self.node.try_get_context("worldSyncMinutes"),
+                                 "WORLD_SYNC_MBPS": self.node.try_get_context("worldSyncMBps")}
+        minecraft_server.user_data.add_commands("mkdir -p /etc/minecraft",
+                                                "cat > /etc/minecraft/world_volume.conf <<'EOF'\n" + environment_file(world_volume_settings) + "EOF")
+
+        ########################
+        #                      #
+        #    BACKUP SECTION    #
+        #                      #
+        ########################
+
+        # Backups go to the backup bucket (world_backup.py) by default.  With backupBackend "snapshot" the world volume gets an EBS snapshot
+        #   when the server stops instead (snapshot_backup.py), which takes seconds no matter how big the world is, and a new server starts
+        #   from a volume made from the newest snapshot.  A lifecycle policy also snapshots the volume on a schedule and expires the old ones.
+        backup_backend = self.node.try_get_context("backupBackend") or "s3"
+        if backup_backend not in ("s3", "snapshot"):
+            raise ValueError(f"backupBackend must be s3 or snapshot, not {backup_backend}")
+        backup_settings = {"BACKUP_BACKEND": backup_backend,
+                           "SNAPSHOT_NAME": self.stack_name,
+                           "SNAPSHOT_RETAIN": self.node.try_get_context("snapshotRetainCount"),
+                           "SNAPSHOT_FAST_RESTORE": "true" if self.node.try_get_context("snapshotFastRestore") else ""}
+        minecraft_server.user_data.add_commands("cat > /etc/minecraft/backup.conf <<'EOF'\n" + environment_file(backup_settings) + "EOF")
+        if backup_backend == "snapshot":
+            # snapshot_backup.py tags the world volume (and every snapshot of it) with minecraft_backup, which is what the policy goes by
+            dlm_role = iam.Role(self, "SnapshotLifecycleRole", assumed_by=iam.ServicePrincipal("dlm.amazonaws.com"))
+            dlm_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSDataLifecycleManagerServiceRole"))
+            dlm.CfnLifecyclePolicy(self, "World Snapshot Policy",
+                                   description=f"{self.stack_name} minecraft world volume",
+                                   execution_role_arn=dlm_role.role_arn,
+                                   state="ENABLED",
+                                   policy_details=dlm.CfnLifecyclePolicy.PolicyDetailsProperty(
+                                       resource_types=["VOLUME"],
+                                       target_tags=[core.CfnTag(key="minecraft_backup", value=self.stack_name)],
+                                       schedules=[dlm.CfnLifecyclePolicy.ScheduleProperty(
+                                           name="World snapshots",
+                                           copy_tags=True,
+                                           create_rule=dlm.CfnLifecyclePolicy.CreateRuleProperty(
+                                               interval=self.node.try_get_context("snapshotIntervalHours"),
+                                               interval_unit="HOURS"),
+                                           retain_rule=dlm.CfnLifecyclePolicy.RetainRuleProperty(
+                                               count=self.node.try_get_context("snapshotRetainCount")))]))
+
+            # Snapshot the world volume, and on a new server swap the blank volume for one made from a snapshot.  The volumes it can detach
+            #   and delete and the snapshots it can delete are only the ones tagged as this stack's (restore tags the blank volume first).
+            volume_arn = core.Stack.of(self).format_arn(service="ec2", resource="volume", resource_name="*")
+            snapshot_arn = core.Stack.of(self).format_arn(service="ec2", resource="snapshot", resource_name="*", account="")
+            role.attach_inline_policy(iam.Policy(self, "Snapshot Backup Access", statements = [iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                    resources=[volume_arn, snapshot_arn],
+                                                    actions=["ec2:CreateSnapshot", "ec2:CreateVolume", "ec2:CreateTags"]),
+                                                    iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                    resources=[volume_arn],
+                                                    actions=["ec2:AttachVolume"]),
+                                                    iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                    resources=[volume_arn],
+                                                    actions=["ec2:DetachVolume", "ec2:DeleteVolume"],
+                                                    conditions={"StringEquals": {"ec2:ResourceTag/minecraft_backup": self.stack_name}}),
+                                                    iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                    resources=[snapshot_arn],
+                                                    actions=["ec2:EnableFastSnapshotRestores", "ec2:DisableFastSnapshotRestores"]),
+                                                    iam.PolicyStatement(effect=iam.Effect.ALLOW,
+                                                    resources=[snapshot_arn],
+                                                    actions=["ec2:DeleteSnapshot"],
+                                                    conditions={"StringEquals": {"ec2:ResourceTag/minecraft_backup": self.stack_name}})]))
+
+        ########################
+        #                      #
+        #     JVM SECTION      #
+        #                      #
+        ########################
+
+        # The JVM settings depend on how many cores and how much memory the instance type has, so we work them out here rather than guessing
+        #   on the server at startup.  They get written to an environment file that minecraft@.service reads (see jvm_profiles.py for the profiles).
+        #   This has to happen before configure.sh runs, which is why it's above the asset section.
+        #   With more than one world, each gets its memoryShare of the instance: systemd holds the whole server to that share, and the heap
+        #   is what's left of it after the JVM's own overhead, so both come from the same number.  A share too small for the smallest heap
+        #   fails the synth rather than getting a server that systemd kills as it starts.
+        instance_type = self.node.try_get_context("InstanceType")
+        reserved_memory = int(self.node.try_get_context("tags").get("reserved_memory", 700)) + tmpfs_mib
+        for world, (memory_mib, heap) in zip(worlds, world_memory(instance_type, worlds, reserved_memory)):
+            jvm_settings = jvm_profile(instance_type, heap,
+                                       profile = self.node.try_get_context("jvmProfile") or "auto",
+                                       large_pages = bool(self.node.try_get_context("jvmLargePages")))
+            minecraft_server.user_data.add_commands(f"cat > /etc/minecraft/{world['name']}.jvm.conf <<'EOF'\n" + environment_file(jvm_settings) + "EOF")
+            if len(worlds) > 1:
+                minecraft_server.user_data.add_commands(f"mkdir -p /etc/systemd/system/minecraft@{world['name']}.service.d",
+                                                        f"cat > /etc/systemd/system/minecraft@{world['name']}.service.d/resources.conf <<'EOF'\n"
+                                                        + resource_dropin(world, memory_mib) + "EOF")
+        minecraft_server.user_data.add_commands("cat > /etc/minecraft/worlds.json <<'EOF'\n" + worlds_file(worlds) + "EOF")
+
         ########################
         #                      #
         #    ASSET SECTION     #
@@ -203,9 +506,6 @@ class CdkMinecraftStack(core.Stack):
         ########################
         if self.node.try_get_context("enableStartupUrl"):
             
-            with open("minecraft_start.py", encoding="utf8") as fp:
-                minecraft_start_code = fp.read()
-            
             # The startup password is optional.  If it's set to false or an empty string, we will skip assigning it.
             if self.node.try_get_context("startupPassword"):
                 my_lambda_env = {'INSTANCE_ID': minecraft_server.instance_id,
@@ -222,7 +522,7 @@ class CdkMinecraftStack(core.Stack):
             
             my_lambda_policy.add_statements(iam.PolicyStatement(
                                         effect=iam.Effect.ALLOW,
-                                        actions=["ec2:StartInstances"],
+                                        actions=["ec2:StartInstances", "ec2:CreateTags"],     # CreateTags for the boot_trace tag
                                         resources=[f'arn:{self.partition}:ec2:{self.region}:{self.account}:instance/{minecraft_server.instance_id}']
                                         ))
             my_lambda_policy.add_statements(iam.PolicyStatement(
@@ -236,8 +536,9 @@ class CdkMinecraftStack(core.Stack):
             my_lambda = lambda_.Function(self, "MinecraftStartup",
                                             runtime=lambda_.Runtime.PYTHON_3_8,
                                             handler="index.main",
-                                            code=lambda_.InlineCode(minecraft_start_code),
+                                            code=lambda_.Code.from_asset("minecraft_start"),
                                             environment=my_lambda_env,
+                                            timeout=core.Duration.seconds(30),      # Leaves room for the /wait long poll
                                             role=my_lambda_role)
 
             lambda_api = api.LambdaRestApi(self, "MinecraftStartupApi",
@@ -1,38 +1,71 @@
 #!/bin/bash
 
-# Create user
-groupadd minecraft
-useradd --system --shell /bin/nologin --home /opt/minecraft -g minecraft minecraft
+# Each phase of the setup gets timed, so a baked image can be compared with a stock one.  Lines look like
+#   {"phase": "packages", "seconds": 93.2, "image": "stock"}, and the first one is the time from power on until this script started.
+BOOT_PHASES=/var/log/minecraft-boot-phases.log
+IMAGE_KIND=$([ -d /etc/minecraft/image-layers ] && echo baked || echo stock)
+PHASE_START=$(date +%s%3N)
+phase() {
+    local now=$(date +%s%3N)
+    echo "{\"phase\": \"$1\", \"seconds\": $(( (now - PHASE_START) / 1000 )).$(( (now - PHASE_START) % 1000 / 100 )), \"image\": \"$IMAGE_KIND\"}" >> $BOOT_PHASES
+    PHASE_START=$now
+}
+echo "{\"phase\": \"boot\", \"seconds\": $(cut -d' ' -f1 /proc/uptime), \"image\": \"$IMAGE_KIND\"}" >> $BOOT_PHASES
 
-# Install packages
-yum update
-yum -y upgrade
+# Images baked by the cdk-minecraft-image stack already have the user, packages, java, python modules and the tools repo
+if [ "$IMAGE_KIND" = stock ]; then
+    # Create user
+    groupadd minecraft
+    useradd --system --shell /bin/nologin --home /opt/minecraft -g minecraft minecraft
 
-# Install java
-sudo rpm --import https://yum.corretto.aws/corretto.key 
-sudo curl -L -o /etc/yum.repos.d/corretto.repo https://yum.corretto.aws/corretto.repo
-sudo yum install -y java-16-amazon-corretto-devel
+    # Install packages
+    yum update
+    yum -y upgrade
 
-yum install -y python3 git amazon-cloudwatch-agent      # Python needed for mcstatus
-pip3 install requests mcstatus boto3                    # mcstatus let's us check the server stats easily
+    # Install java
+    sudo rpm --import https://yum.corretto.aws/corretto.key 
+    sudo curl -L -o /etc/yum.repos.d/corretto.repo https://yum.corretto.aws/corretto.repo
+    sudo yum install -y java-16-amazon-corretto-devel
+
+    yum install -y python3 git amazon-cloudwatch-agent      # Python needed for mcstatus
+    pip3 install requests mcstatus boto3                    # mcstatus let's us check the server stats easily
+
+    # Get the minecraft tools from github
+    git clone https://github.com/abnormalend/minecraft_aws_tools.git /opt/minecraft_aws_tools
+fi
+phase packages
 
 # Create minecraft directories
-mkdir -p /opt/{minecraft/server/plugins,resources,s3_resources}
+mkdir -p /opt/{minecraft/server/plugins,resources}
 
-# Unzip the resources, and get the S3 files
+# Unzip the resources
 unzip /tmp/resources.zip -d /opt/resources
-sudo aws s3 sync s3://cdk-minecraft-s3-minecraftfiles07db5e91-11whj41it782o/ /opt/s3_resources
+
+# With the snapshot backup backend, a new server's world volume is made from the newest snapshot before it's mounted, see snapshot_backup.py
+source /etc/minecraft/backup.conf
+if [ "$BACKUP_BACKEND" = snapshot ] && python3 /opt/resources/snapshot_backup.py restore --name "$SNAPSHOT_NAME" ${SNAPSHOT_FAST_RESTORE:+--fast-restore}; then
+    SNAPSHOT_RESTORED=true
+fi
+
+# Put /opt/minecraft on its own volume (and mount the fast tier, if there is one) before anything gets written there
+source /opt/resources/world_volume.sh
+# The restored volume can be bigger than the one the snapshot was taken of
+[ "$SNAPSHOT_RESTORED" = true ] && xfs_growfs /opt/minecraft
+mkdir -p /opt/minecraft/server/plugins
+phase volumes
+
+# The worlds list from cdk.json as name:port:rcon_port.  "server" is set up first and the other worlds are copies of it.
+WORLDS=$(python3 -c 'import json; print(" ".join("%s:%s:%s" % (w["name"], w["port"], w["rcon_port"]) for w in json.load(open("/etc/minecraft/worlds.json"))))' 2>/dev/null || echo server:25565:25575)
+WORLD_NAMES=$(for WORLD in $WORLDS; do echo -n "${WORLD%%:*} "; done)
+phase files
 
 source /opt/resources/export_instance_tags.sh
 echo $MINECRAFT_HOME
 
-# Get the minecraft tools from github
-git clone https://github.com/abnormalend/minecraft_aws_tools.git /opt/minecraft_aws_tools
 export MINECRAFT_TOOLS_HOME="/opt/minecraft_aws_tools"
 source /opt/minecraft_aws_tools/install.sh
 
 # Start putting things where they belong
-cp -r /opt/s3_resources/plugins/* /opt/minecraft/server/plugins
 cp /opt/resources/export_instance_tags.sh /etc/profile.d
 
 #Set EULA
@@ -43,20 +76,88 @@ cp /opt/resources/whitelist.json /opt/minecraft/server
 cp /opt/resources/ops.json /opt/minecraft/server
 cp /opt/resources/server.conf /opt/minecraft/server
 
-# Update DNS
-python3 /opt/minecraft_aws_tools/dns_updater/dns_updater.py
+# RCON is only reachable from the instance itself (the port isn't open in the security group), give it a random password
+sed -i "s/^rcon.password=.*/rcon.password=$(openssl rand -hex 16)/" /opt/minecraft/server/server.properties
+chmod 640 /opt/minecraft/server/server.properties
+
+# With a fast tier the world runs from instance store or tmpfs and gets copied back to the world volume, so there's no point
+#   waiting for every chunk write to hit the disk.  Hydrating now means anything restored below lands on the fast tier too.
+if [ -n "$WORLD_FAST_TIER" ]; then
+    sed -i "s/^sync-chunk-writes=.*/sync-chunk-writes=false/" /opt/minecraft/server/server.properties
+    python3 /opt/resources/world_sync.py hydrate --server-dir /opt/minecraft/server
+fi
+
+# Update DNS, on this boot and every one after it, with a short TTL while booting and a longer one later, see dns_updater.py.
+#   Not waited for here, the unit is only done once Route53 has the change everywhere.
+for UNIT in minecraft-dns.service minecraft-dns-stable.service minecraft-dns-stable.timer; do
+    cp /opt/resources/$UNIT /etc/systemd/system/$UNIT
+    chmod 755 /etc/systemd/system/$UNIT
+done
+systemctl daemon-reload
+systemctl enable minecraft-dns minecraft-dns-stable.timer
+systemctl start --no-block minecraft-dns minecraft-dns-stable.timer
+
+# The server jar, plugins and datapacks listed in the files bucket's manifest, see artifact_sync.py.  Without a jar in the manifest, paper
+#   updater gets one.  A baked image already has one, so the updater only downloads anything if there's a newer build.
+[ -d /opt/minecraft-image ] && cp /opt/minecraft-image/paper-*.jar /opt/minecraft/server
+ARTIFACTS=$(python3 /opt/resources/artifact_sync.py sync)
+echo "$ARTIFACTS"
+[[ "$ARTIFACTS" == *'"has_server_jar": true'* ]] || python3 /opt/minecraft_aws_tools/paper_updater/paper_updater.py
+
+# Every other world starts as a copy of the server directory (jar, plugins, settings, no world), then each gets its own ports and RCON password
+for WORLD in $WORLDS; do
+    IFS=: read WORLD_NAME WORLD_PORT WORLD_RCON_PORT <<< "$WORLD"
+    if [ "$WORLD_NAME" != server ]; then
+        mkdir -p /opt/minecraft/$WORLD_NAME
+        cp -r /opt/minecraft/server/plugins /opt/minecraft/server/*.jar /opt/minecraft/server/eula.txt /opt/minecraft/server/server.properties \
+              /opt/minecraft/server/whitelist.json /opt/minecraft/server/ops.json /opt/minecraft/server/server.conf /opt/minecraft/$WORLD_NAME
+        sed -i "s/^rcon.password=.*/rcon.password=$(openssl rand -hex 16)/" /opt/minecraft/$WORLD_NAME/server.properties
+        [ -n "$WORLD_FAST_TIER" ] && python3 /opt/resources/world_sync.py hydrate --server-dir /opt/minecraft/$WORLD_NAME
+    fi
+    sed -i -e "s/^server-port=.*/server-port=$WORLD_PORT/" -e "s/^query.port=.*/query.port=$WORLD_PORT/" \
+           -e "s/^rcon.port=.*/rcon.port=$WORLD_RCON_PORT/" /opt/minecraft/$WORLD_NAME/server.properties
+done
+
+phase server
 
-# Use paper updater to get the server jar
-python3 /opt/minecraft_aws_tools/paper_updater/paper_updater.py
+# Check for a backup of this hostname, unless the worlds already came back with an EBS snapshot.  Snapshots from world_backup.py are
+#   restored while the server starts (see the end of this file), if there's no snapshot yet fall back to the old full copy backups.
+if [ "$SNAPSHOT_RESTORED" != true ]; then
+    if python3 /opt/resources/world_backup.py exists; then
+        STREAM_RESTORE=true
+    else
+        source /opt/minecraft_aws_tools/s3_backup/s3_restore.sh
+    fi
+    # Other worlds only ever had snapshot backups, under <dns_hostname>/<world>
+    STREAM_RESTORE_WORLDS=$(for WORLD_NAME in $WORLD_NAMES; do
+        [ "$WORLD_NAME" != server ] && python3 /opt/resources/world_backup.py exists --server-dir /opt/minecraft/$WORLD_NAME && echo -n "$WORLD_NAME "
+    done)
+    [ "$STREAM_RESTORE" = true ] && STREAM_RESTORE_WORLDS="server $STREAM_RESTORE_WORLDS"
+fi
 
-# Try to restore a backup for this hostname
-source /opt/minecraft_aws_tools/s3_backup/s3_restore.sh
+phase restore
 
 # Set ownership
 chown minecraft:minecraft -R /opt/minecraft
+[ -n "$WORLD_FAST_TIER" ] && chown minecraft:minecraft -R /mnt/minecraft_fast
 
-# Run dynamic memory script
-source /opt/minecraft_aws_tools/dynamic_memory/dynamic_memory.sh
+# Memory and JVM flags come from /etc/minecraft/server.jvm.conf, written when the stack was deployed.  Only fall back to working
+#   out the memory here if that's missing.
+if [ ! -f /etc/minecraft/server.jvm.conf ]; then
+    source /opt/minecraft_aws_tools/dynamic_memory/dynamic_memory.sh
+fi
+
+# The log parser writes structured events here, and the cloudwatch agent ships them
+install -d -o minecraft -g minecraft /var/log/minecraft
+cat > /etc/logrotate.d/minecraft <<'EOF'
+/var/log/minecraft/*.log {
+    weekly
+    rotate 4
+    compress
+    missingok
+    copytruncate
+}
+EOF
 
 #Start up cloudwatch agent
 /opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:/opt/resources/cloudwatch.json
@@ -67,8 +168,99 @@ source /opt/minecraft_aws_tools/dynamic_memory/dynamic_memory.sh
 cp /opt/resources/minecraft@.service /etc/systemd/system/minecraft@.service
 chmod 755 /etc/systemd/system/minecraft@.service
 
+# Later boots bring the artifacts up to date before the servers start
+cp /opt/resources/minecraft-artifacts.service /etc/systemd/system/minecraft-artifacts.service
+chmod 755 /etc/systemd/system/minecraft-artifacts.service
+systemctl enable minecraft-artifacts
+
+cp /opt/resources/minecraft-tick-metrics@.service /etc/systemd/system/minecraft-tick-metrics@.service
+chmod 755 /etc/systemd/system/minecraft-tick-metrics@.service
+cp /opt/resources/minecraft-log-parser@.service /etc/systemd/system/minecraft-log-parser@.service
+chmod 755 /etc/systemd/system/minecraft-log-parser@.service
+cp /opt/resources/minecraft-backup-prune@.service /etc/systemd/system/minecraft-backup-prune@.service
+cp /opt/resources/minecraft-backup-prune@.timer /etc/systemd/system/minecraft-backup-prune@.timer
+chmod 755 /etc/systemd/system/minecraft-backup-prune@.service /etc/systemd/system/minecraft-backup-prune@.timer
+
+if [ -n "$WORLD_FAST_TIER" ]; then
+    cp /opt/resources/minecraft-fast-tier.service /etc/systemd/system/minecraft-fast-tier.service
+    cp /opt/resources/minecraft-world-sync@.service /etc/systemd/system/minecraft-world-sync@.service
+    cp /opt/resources/minecraft-world-sync@.timer /etc/systemd/system/minecraft-world-sync@.timer
+    sed -i "s/^OnUnitActiveSec=.*/OnUnitActiveSec=${WORLD_SYNC_MINUTES}min/" /etc/systemd/system/minecraft-world-sync@.timer
+    chmod 755 /etc/systemd/system/minecraft-fast-tier.service /etc/systemd/system/minecraft-world-sync@.*
+    # A server whose worlds didn't make it onto the fast tier mustn't start, or the next sync would copy the gaps back
+    for WORLD_NAME in $WORLD_NAMES; do
+        mkdir -p /etc/systemd/system/minecraft@$WORLD_NAME.service.d
+        printf '[Unit]\nRequires=minecraft-fast-tier.service\n' > /etc/systemd/system/minecraft@$WORLD_NAME.service.d/fast-tier.conf
+    done
+    systemctl daemon-reload
+    systemctl enable minecraft-fast-tier
+    for WORLD_NAME in $WORLD_NAMES; do
+        systemctl enable --now minecraft-world-sync@$WORLD_NAME.timer
+    done
+fi
+
+# The idle watchdog is set up by the stack when shutdownWhenIdle and idleWatchdog are on
+if [ -f /etc/minecraft/idle_watchdog.conf ]; then
+    cp /opt/resources/minecraft-idle-watchdog.service /etc/systemd/system/minecraft-idle-watchdog.service
+    chmod 755 /etc/systemd/system/minecraft-idle-watchdog.service
+    systemctl daemon-reload
+    systemctl enable --now minecraft-idle-watchdog
+fi
+
+# The view distance controller is set up by the stack when adaptiveViewDistance is on
+if [ -f /etc/minecraft/view_controller.conf ]; then
+    cp /opt/resources/minecraft-view-controller@.service /etc/systemd/system/minecraft-view-controller@.service
+    chmod 755 /etc/systemd/system/minecraft-view-controller@.service
+    systemctl daemon-reload
+    for WORLD_NAME in $WORLD_NAMES; do
+        systemctl enable --now minecraft-view-controller@$WORLD_NAME
+    done
+fi
+
+# World pre-generation is set up by the stack when pregenRadius is over 0
+if [ -f /etc/minecraft/pregen.conf ]; then
+    cp /opt/resources/minecraft-pregen@.service /etc/systemd/system/minecraft-pregen@.service
+    cp /opt/resources/minecraft-pregen@.timer /etc/systemd/system/minecraft-pregen@.timer
+    chmod 755 /etc/systemd/system/minecraft-pregen@.*
+    systemctl daemon-reload
+    for WORLD_NAME in $WORLD_NAMES; do
+        systemctl enable --now minecraft-pregen@$WORLD_NAME.timer
+    done
+fi
+
+# Every boot gets traced from the start request until players can join, see boot_trace.py.  Started last so this boot counts too.
+cp /opt/resources/minecraft-boot-trace.service /etc/systemd/system/minecraft-boot-trace.service
+chmod 755 /etc/systemd/system/minecraft-boot-trace.service
+
+# Spot instances can be taken back with two minutes notice, the watcher saves and backs up the world when that happens
+if [ "$(curl -s http://169.254.169.254/latest/meta-data/instance-life-cycle)" = "spot" ]; then
+    cp /opt/resources/minecraft-spot-watcher.service /etc/systemd/system/minecraft-spot-watcher.service
+    chmod 755 /etc/systemd/system/minecraft-spot-watcher.service
+    systemctl daemon-reload
+    systemctl enable --now minecraft-spot-watcher
+fi
+
 #Enable Service
-systemctl enable minecraft@server
+systemctl daemon-reload
+for WORLD_NAME in $WORLD_NAMES; do
+    systemctl enable minecraft@$WORLD_NAME
+    systemctl enable --now minecraft-tick-metrics@$WORLD_NAME
+    systemctl enable --now minecraft-log-parser@$WORLD_NAME
+    [ "$BACKUP_BACKEND" != snapshot ] && systemctl enable --now minecraft-backup-prune@$WORLD_NAME.timer
+done
+
+phase services
 
 #Start Service
-service minecraft@server start
\ No newline at end of file
+for WORLD_NAME in $WORLD_NAMES; do
+    if [[ " $STREAM_RESTORE_WORLDS " == *" $WORLD_NAME "* ]]; then
+        # The server is started as soon as level.dat, player data and the spawn area are back, the rest of the world streams in behind it
+        nohup python3 /opt/resources/world_backup.py restore --server-dir /opt/minecraft/$WORLD_NAME --owner minecraft --start-service minecraft@$WORLD_NAME \
+            --port $(grep '^server-port=' /opt/minecraft/$WORLD_NAME/server.properties | cut -d= -f2) --metrics >> /var/log/minecraft-restore.log 2>&1 &
+    else
+        service minecraft@$WORLD_NAME start
+    fi
+done
+phase start
+systemctl daemon-reload
+systemctl enable --now minecraft-boot-trace
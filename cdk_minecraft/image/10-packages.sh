@@ -0,0 +1,5 @@
+# OS updates, the packages configure.sh needs, and the minecraft user
+yum -y update
+yum install -y python3 git unzip jq amazon-cloudwatch-agent
+groupadd minecraft
+useradd --system --shell /bin/nologin --home /opt/minecraft -g minecraft minecraft
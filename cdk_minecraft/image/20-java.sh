@@ -0,0 +1,4 @@
+# Amazon Corretto
+rpm --import https://yum.corretto.aws/corretto.key
+curl -L -o /etc/yum.repos.d/corretto.repo https://yum.corretto.aws/corretto.repo
+yum install -y java-16-amazon-corretto-devel
@@ -0,0 +1,2 @@
+# Python modules used by the scripts in /opt/resources
+pip3 install requests mcstatus boto3
@@ -0,0 +1,3 @@
+# The minecraft tools from github (dns updater, paper updater, s3 backup/restore).  configure.sh still runs install.sh on the
+#   instance, since that needs the instance's tags.
+git clone https://github.com/abnormalend/minecraft_aws_tools.git /opt/minecraft_aws_tools
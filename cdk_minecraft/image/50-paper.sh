@@ -0,0 +1,7 @@
+# The newest paper build for MINECRAFT_VERSION.  /opt/minecraft is where the world volume gets mounted, so the jar waits in
+#   /opt/minecraft-image until configure.sh copies it over.
+mkdir -p /opt/minecraft-image
+PAPER_API=https://papermc.io/api/v2/projects/paper/versions/$MINECRAFT_VERSION
+PAPER_BUILD=$(curl -sf $PAPER_API | jq '.builds[-1]')
+curl -sf -o /opt/minecraft-image/paper-$MINECRAFT_VERSION-$PAPER_BUILD.jar \
+    $PAPER_API/builds/$PAPER_BUILD/downloads/paper-$MINECRAFT_VERSION-$PAPER_BUILD.jar
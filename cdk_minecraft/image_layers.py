@@ -0,0 +1,50 @@
+import glob
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+# The golden image is built in layers, one Image Builder component per script in cdk_minecraft/image.  Components can't be
+# changed once created, so each is named after a hash of its script (and the variables it uses).  Image Builder runs every
+# layer on every build, there's no reusing the output of an unchanged one; what the hashes buy is that a deploy where no
+# layer changed keeps the same recipe, and so builds nothing.  The baked image records the hashes in
+# /etc/minecraft/image-layers/, along with how long each layer took to build, which shows where a build spends its time.
+Layer = namedtuple("Layer", ["name", "hash", "document"])
+
+LAYER_RECORD_DIR = "/etc/minecraft/image-layers"
+
+
+def layer_script(path, variables):
+    # Variables go at the top of the script, so changing one changes the hash too
+    with open(path) as fp:
+        script = fp.read()
+    return "".join(f'{key}="{value}"\n' for key, value in sorted(variables.items())) + script
+
+
+def component_document(name, content_hash, script):
+    # Image Builder components are YAML, and JSON is valid YAML
+    record = (f"mkdir -p {LAYER_RECORD_DIR}\n"
+              f"echo '{{\"layer\": \"{name}\", \"hash\": \"{content_hash}\", \"seconds\": '$((SECONDS - LAYER_START))'}}'"
+              f" > {LAYER_RECORD_DIR}/{name}.json\n")
+    return json.dumps({"name": f"minecraft-{name}",
+                       "schemaVersion": 1.0,
+                       "phases": [{"name": "build",
+                                   "steps": [{"name": "Layer",
+                                              "action": "ExecuteBash",
+                                              "inputs": {"commands": ["set -e\nLAYER_START=$SECONDS\n" + script + record]}}]}]},
+                      indent=2)
+
+
+def image_layers(directory, variables=None):
+    layers = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.sh"))):
+        name = os.path.splitext(os.path.basename(path))[0].split("-", 1)[-1]
+        script = layer_script(path, variables or {})
+        content_hash = hashlib.sha256(script.encode()).hexdigest()[:12]
+        layers.append(Layer(name, content_hash, component_document(name, content_hash, script)))
+    return layers
+
+
+def recipe_hash(layers, parent_image):
+    # The recipe (and the image built from it) changes whenever any layer or the base image does
+    return hashlib.sha256((parent_image + "".join(layer.hash for layer in layers)).encode()).hexdigest()[:12]
@@ -0,0 +1,76 @@
+import re
+import warnings
+from collections import namedtuple
+
+# What we need to know about an instance type to tune for it.  This comes from the table below rather than from AWS, so
+# synth doesn't need to call AWS.  It covers the general purpose, compute, memory, storage and burstable families people
+# run minecraft on.
+InstanceSpec = namedtuple("InstanceSpec", ["vcpus", "memory_mib", "arch", "instance_store"])
+
+SIZE_VCPUS = {"medium": 1, "large": 2, "xlarge": 4, "2xlarge": 8, "3xlarge": 12, "4xlarge": 16, "6xlarge": 24,
+              "8xlarge": 32, "9xlarge": 36, "10xlarge": 40, "12xlarge": 48, "16xlarge": 64, "18xlarge": 72,
+              "24xlarge": 96, "32xlarge": 128}
+
+
+def family(names, sizes, gib_per_vcpu):
+    # {instance type: (vcpus, GiB)} for families where memory is the same multiple of the vCPUs at every size
+    return {f"{name}.{size}": (SIZE_VCPUS[size], SIZE_VCPUS[size] * gib_per_vcpu)
+            for name in names.split() for size in sizes.split()}
+
+
+# (vcpus, GiB of memory) as AWS lists them
+INSTANCE_TYPES = {
+    "t3.nano": (2, 0.5), "t3.micro": (2, 1), "t3.small": (2, 2), "t3.medium": (2, 4), "t3.large": (2, 8),
+    "t3.xlarge": (4, 16), "t3.2xlarge": (8, 32),
+    "t2.nano": (1, 0.5), "t2.micro": (1, 1), "t2.small": (1, 2), "t2.medium": (2, 4), "t2.large": (2, 8),
+    "t2.xlarge": (4, 16), "t2.2xlarge": (8, 32),
+    "m4.large": (2, 8), "m4.xlarge": (4, 16), "m4.2xlarge": (8, 32), "m4.4xlarge": (16, 64), "m4.10xlarge": (40, 160),
+    "m4.16xlarge": (64, 256),
+    **family("m5 m5d m5a m5ad", "large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge 24xlarge", 4),
+    **family("m6i m6id m6a", "large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge 24xlarge 32xlarge", 4),
+    **family("m6g m6gd", "medium large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge", 4),
+    "c4.large": (2, 3.75), "c4.xlarge": (4, 7.5), "c4.2xlarge": (8, 15), "c4.4xlarge": (16, 30),
+    "c4.8xlarge": (36, 60),
+    **family("c5 c5d", "large xlarge 2xlarge 4xlarge 9xlarge 12xlarge 18xlarge 24xlarge", 2),
+    **family("c5a c5ad", "large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge 24xlarge", 2),
+    "c5n.large": (2, 5.25), "c5n.xlarge": (4, 10.5), "c5n.2xlarge": (8, 21), "c5n.4xlarge": (16, 42),
+    "c5n.9xlarge": (36, 96), "c5n.18xlarge": (72, 192),
+    **family("c6i c6id c6a", "large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge 24xlarge 32xlarge", 2),
+    **family("c6g c6gd", "medium large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge", 2),
+    **family("r5 r5d r5a r5ad", "large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge 24xlarge", 8),
+    **family("r6i r6id", "large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge 24xlarge 32xlarge", 8),
+    **family("r6g r6gd", "medium large xlarge 2xlarge 4xlarge 8xlarge 12xlarge 16xlarge", 8),
+    **family("a1", "medium large xlarge 2xlarge 4xlarge", 2),
+    **family("z1d", "large xlarge 2xlarge 3xlarge 6xlarge 12xlarge", 8),
+    "i3.large": (2, 15.25), "i3.xlarge": (4, 30.5), "i3.2xlarge": (8, 61), "i3.4xlarge": (16, 122),
+    "i3.8xlarge": (32, 244), "i3.16xlarge": (64, 488),
+    **family("i3en", "large xlarge 2xlarge 3xlarge 6xlarge 12xlarge 24xlarge", 8),
+}
+# The burstable sizes don't follow a per-vCPU rule
+INSTANCE_TYPES.update({f"{name}.{size}": INSTANCE_TYPES[f"t3.{size}"] for name in ("t3a", "t4g")
+                       for size in ("nano", "micro", "small", "medium", "large", "xlarge", "2xlarge")})
+
+# For a type that isn't in the table: as little memory per vCPU as the compute families have, so the heap comes out too small rather
+# than too big, and 2 vCPUs when the size doesn't say (like .metal)
+FALLBACK_GIB_PER_VCPU = 2
+FALLBACK_VCPUS = 2
+
+INSTANCE_TYPE = re.compile(r"^([a-z]+)(\d+)([a-z-]*)\.(\w+)$")
+
+
+def instance_spec(instance_type):
+    match = INSTANCE_TYPE.match(instance_type)
+    if not match:
+        raise ValueError("Unrecognised instance type " + instance_type)
+    family_name, _, attributes, size = match.groups()
+    arch = "arm64" if "g" in attributes or family_name == "a" else "x86_64"
+    instance_store = "d" in attributes or family_name in ("i", "d", "h")
+
+    if instance_type in INSTANCE_TYPES:
+        vcpus, memory_gib = INSTANCE_TYPES[instance_type]
+    else:
+        vcpus = SIZE_VCPUS.get(size, FALLBACK_VCPUS)
+        memory_gib = vcpus * FALLBACK_GIB_PER_VCPU
+        warnings.warn(f"{instance_type} isn't in cdk_minecraft/instance_types.py, assuming {vcpus} vCPUs and "
+                      f"{memory_gib} GiB.  Add it to INSTANCE_TYPES for the JVM to use all of its memory.")
+    return InstanceSpec(vcpus, int(memory_gib * 1024), arch, instance_store)
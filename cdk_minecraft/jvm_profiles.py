@@ -0,0 +1,108 @@
+from cdk_minecraft.instance_types import instance_spec
+
+# JVM settings for the minecraft server, worked out at synth time from the instance type in cdk.json.  The result is
+# written to /etc/minecraft/<server>.jvm.conf, which minecraft@.service reads as an EnvironmentFile.
+#
+# Profiles (the jvmProfile key in cdk.json):
+#   auto      aikar for small heaps, zgc once the heap is 12GB or more and there are cores to spare
+#   aikar     G1 tuned the way Aikar's flags tune it for minecraft (short pauses, big young generation)
+#   zgc       ZGC, pauses stay around a millisecond no matter how big the heap gets
+#   minimal   what minecraft@.service used before profiles existed
+
+ZGC_MIN_HEAP_MIB = 12 * 1024
+MIN_HEAP_MIB = 512
+
+# The kernel keeps part of the nominal memory for itself, MemTotal on an EC2 instance comes out around 95% of it
+USABLE_MEMORY_RATIO = 0.95
+# Our python daemons next to the server, about 50MB each once boto3 is loaded.  The per-world ones run for every world.
+SIDECAR_MIB = 50
+INSTANCE_SIDECARS = ("idle_watchdog", "spot_watcher", "boot_trace", "artifact_sync", "dns_updater")
+WORLD_SIDECARS = ("tick_metrics", "log_parser", "view_controller", "pregen")
+# What the JVM uses besides the heap: metaspace, code cache and thread stacks, plus GC bookkeeping that grows with the heap
+JVM_OVERHEAD_MIB = 256
+JVM_OVERHEAD_RATIO = 0.1
+
+MINIMAL_FLAGS = ["-XX:+UseG1GC", "-XX:ParallelGCThreads=2", "-XX:MinHeapFreeRatio=5", "-XX:MaxHeapFreeRatio=10"]
+
+COMMON_FLAGS = ["-XX:+DisableExplicitGC", "-XX:+AlwaysPreTouch", "-XX:+PerfDisableSharedMem"]
+
+# https://aikar.co/2018/07/02/tuning-the-jvm-g1gc-garbage-collector-flags-for-minecraft/
+AIKAR_FLAGS = ["-XX:+UseG1GC", "-XX:+ParallelRefProcEnabled", "-XX:MaxGCPauseMillis=200",
+               "-XX:+UnlockExperimentalVMOptions", "-XX:G1HeapWastePercent=5", "-XX:G1MixedGCCountTarget=4",
+               "-XX:G1MixedGCLiveThresholdPercent=90", "-XX:G1RSetUpdatingPauseTimePercent=5",
+               "-XX:SurvivorRatio=32", "-XX:MaxTenuringThreshold=1"]
+AIKAR_SMALL_HEAP = ["-XX:G1NewSizePercent=30", "-XX:G1MaxNewSizePercent=40", "-XX:G1HeapRegionSize=8M",
+                    "-XX:G1ReservePercent=20", "-XX:InitiatingHeapOccupancyPercent=15"]
+AIKAR_LARGE_HEAP = ["-XX:G1NewSizePercent=40", "-XX:G1MaxNewSizePercent=50", "-XX:G1HeapRegionSize=16M",
+                    "-XX:G1ReservePercent=15", "-XX:InitiatingHeapOccupancyPercent=20"]
+
+# Pauses end up in logs/gc.log, gc_analyzer.py turns them into percentiles
+GC_LOG = "-Xlog:gc,gc+phases=info:file=logs/gc.log:uptime,level,tags:filecount=5,filesize=20M"
+
+PROFILES = ("auto", "aikar", "zgc", "minimal")
+
+
+def usable_memory_mib(instance_type, reserved_memory_mib=700, worlds=1):
+    # What's left for the minecraft servers once the kernel, reserved_memory and the sidecar daemons have theirs
+    sidecars = len(INSTANCE_SIDECARS) + len(WORLD_SIDECARS) * worlds
+    return int(instance_spec(instance_type).memory_mib * USABLE_MEMORY_RATIO) - reserved_memory_mib - SIDECAR_MIB * sidecars
+
+
+def heap_mib(memory_mib, limited=False):
+    # The heap for a server given memory_mib.  With a MemoryLimit (several worlds on one instance) the whole JVM has to
+    # fit in it, otherwise reserved_memory is its headroom and the heap gets all of it.  Can come out under MIN_HEAP_MIB.
+    if not limited:
+        return memory_mib
+    return int((memory_mib - JVM_OVERHEAD_MIB) / (1 + JVM_OVERHEAD_RATIO))
+
+
+def jvm_memory_mib(heap):
+    return int(heap * (1 + JVM_OVERHEAD_RATIO)) + JVM_OVERHEAD_MIB
+
+
+def world_memory(instance_type, worlds, reserved_memory_mib=700):
+    # (memory, heap) in MiB for each of the worlds from worlds.world_settings.  With more than one, memory is the world's
+    # MemoryLimit and its heap has to fit in it with the JVM around it, a world where it can't is an error.
+    usable = usable_memory_mib(instance_type, reserved_memory_mib, len(worlds))
+    sizes = []
+    for world in worlds:
+        memory_mib = int(usable * world["memory_share"])
+        heap = heap_mib(memory_mib, limited=len(worlds) > 1)
+        if len(worlds) > 1 and heap < MIN_HEAP_MIB:
+            raise ValueError(f"World {world['name']} gets {memory_mib}M on a {instance_type}, which doesn't fit a "
+                             f"{MIN_HEAP_MIB}M heap and the JVM around it ({jvm_memory_mib(MIN_HEAP_MIB)}M).  Use a bigger "
+                             "InstanceType, fewer worlds or a bigger memoryShare for this one.")
+        sizes.append((memory_mib, heap))
+    return sizes
+
+
+def jvm_profile(instance_type, heap, profile="auto", large_pages=False):
+    # Returns the environment for minecraft@.service: MCMINMEM, MCMAXMEM and JVM_OPTS, for a heap of heap MiB (see
+    # heap_mib).
+    if profile not in PROFILES:
+        raise ValueError(f"jvmProfile must be one of {', '.join(PROFILES)}, not {profile}")
+    spec = instance_spec(instance_type)
+    heap = max(MIN_HEAP_MIB, heap)
+
+    if profile == "auto":
+        profile = "zgc" if heap >= ZGC_MIN_HEAP_MIB and spec.vcpus >= 4 else "aikar"
+
+    if profile == "minimal":
+        return {"MCMINMEM": f"{MIN_HEAP_MIB}M", "MCMAXMEM": f"{heap}M", "JVM_OPTS": " ".join(MINIMAL_FLAGS)}
+
+    if profile == "zgc":
+        flags = ["-XX:+UseZGC", f"-XX:ConcGCThreads={max(1, spec.vcpus // 4)}"]
+    else:
+        flags = AIKAR_FLAGS + (AIKAR_LARGE_HEAP if heap >= ZGC_MIN_HEAP_MIB else AIKAR_SMALL_HEAP)
+        flags += [f"-XX:ParallelGCThreads={spec.vcpus}", f"-XX:ConcGCThreads={max(1, spec.vcpus // 4)}"]
+    flags += COMMON_FLAGS
+    if large_pages:
+        flags.append("-XX:+UseTransparentHugePages")
+    flags.append(GC_LOG)
+
+    # These profiles pre-touch the whole heap, so min and max are the same
+    return {"MCMINMEM": f"{heap}M", "MCMAXMEM": f"{heap}M", "JVM_OPTS": " ".join(flags)}
+
+
+def environment_file(settings):
+    return "".join(f'{key}="{value}"\n' for key, value in settings.items())
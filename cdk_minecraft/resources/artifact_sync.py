@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# Puts the server jar, plugins and datapacks from the files bucket into every world, without downloading what's
+# already here.
+#
+# The files bucket holds manifest.json, listing each artifact with its SHA-256:
+#   {"artifacts": [{"key": "artifacts/<sha256>/paper-1.17.1-411.jar", "sha256": "...", "size": 123,
+#                   "target": "paper-1.17.1-411.jar", "kind": "server"},
+#                  {"key": "artifacts/<sha256>/EssentialsX.jar", "sha256": "...", "size": 456,
+#                   "target": "plugins/EssentialsX.jar"}]}
+# publish builds that from a local folder laid out like a server directory and uploads whatever the bucket doesn't
+# have yet.  On the instance, sync:
+#   - keeps a cache in /opt/minecraft-cache named by SHA-256, so an artifact is only downloaded when it's new
+#   - downloads what's missing in parallel, and checks every download against its SHA-256 before it goes in the cache
+#   - puts each artifact in place under a temporary name and renames it over the old one, so a world never sees half a
+#     jar, and removes what an earlier manifest installed that this one doesn't have.  A "server" artifact replaces
+#     any other server jar, minecraft@.service starts whichever it finds first.
+#   - logs the cache hit rate and bytes downloaded to /var/log/minecraft-artifacts.log
+# A bucket without a manifest still works the old way: everything under plugins/ is installed, cached by ETag.
+#
+# Usage:
+#   artifact_sync.py sync [--worlds /etc/minecraft/worlds.json]
+#   artifact_sync.py publish ./files --bucket my-files-bucket
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+import mc_instance
+
+CACHE_DIR = "/opt/minecraft-cache"
+MANIFEST_KEY = "manifest.json"
+INSTALLED_FILE = ".artifacts.json"      # in each server directory, what the last sync put there
+LOG_FILE = "/var/log/minecraft-artifacts.log"
+DOWNLOAD_THREADS = 8
+BLOCK = 1024 * 1024
+SERVER_JAR = re.compile(r"^(FTBServer|craftbukkit|spigot|paper|forge|minecraft_server).*\.jar$", re.IGNORECASE)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(s3, bucket):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)["Body"].read())["artifacts"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+    # No manifest, so the plugins folder as the old aws s3 sync had it.  The ETag stands in for the digest.
+    artifacts = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix="plugins/"):
+        for item in page.get("Contents", []):
+            if not item["Key"].endswith("/"):
+                artifacts.append({"key": item["Key"], "etag": item["ETag"].strip('"'), "size": item["Size"],
+                                  "target": item["Key"]})
+    return artifacts
+
+
+def cache_path(artifact, cache_dir=CACHE_DIR):
+    if "sha256" in artifact:
+        return os.path.join(cache_dir, "sha256", artifact["sha256"])
+    return os.path.join(cache_dir, "etag", artifact["etag"])
+
+
+def fetch(s3, bucket, artifact, cache_dir=CACHE_DIR):
+    # Returns the bytes downloaded, 0 for a cache hit
+    path = cache_path(artifact, cache_dir)
+    if os.path.exists(path):
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A name of its own, so another sync fetching the same artifact can't rename this one half written
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    os.close(fd)
+    try:
+        s3.download_file(bucket, artifact["key"], partial)
+        if "sha256" in artifact and sha256_file(partial) != artifact["sha256"]:
+            raise ValueError(f"{artifact['key']} doesn't match its SHA-256 in the manifest")
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return os.path.getsize(path)
+
+
+def place(source, target):
+    # A copy rather than a link, plugins rewrite their own config files and that mustn't change the cache
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staged = target + ".artifact"
+    shutil.copyfile(source, staged)
+    os.replace(staged, target)
+
+
+def install(server_dir, artifacts, cache_dir=CACHE_DIR, owner=None):
+    installed_file = os.path.join(server_dir, INSTALLED_FILE)
+    try:
+        with open(installed_file) as fp:
+            previous = set(json.load(fp))
+    except (OSError, ValueError):
+        previous = set()
+    targets = {artifact["target"] for artifact in artifacts}
+    for artifact in artifacts:
+        target = os.path.join(server_dir, artifact["target"])
+        place(cache_path(artifact, cache_dir), target)
+        if owner:
+            shutil.chown(target, *owner)
+    # Gone from the manifest, and other server jars once the manifest has one
+    stale = previous - targets
+    if any(artifact.get("kind") == "server" for artifact in artifacts):
+        stale |= {name for name in os.listdir(server_dir) if SERVER_JAR.match(name) and name not in targets}
+    for name in stale:
+        path = os.path.join(server_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    with open(installed_file, "w") as fp:
+        json.dump(sorted(targets), fp)
+    return len(stale)
+
+
+def sync(bucket, server_dirs, cache_dir=CACHE_DIR, threads=DOWNLOAD_THREADS):
+    started = time.monotonic()
+    s3 = boto3.client('s3')
+    artifacts = load_manifest(s3, bucket)
+    # Artifacts with the same digest (a library jar in every plugin folder, say) share a cache entry, fetch it once
+    unique = list({cache_path(artifact, cache_dir): artifact for artifact in artifacts}.values())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        downloaded = list(pool.map(lambda artifact: fetch(s3, bucket, artifact, cache_dir), unique))
+    removed = 0
+    for server_dir in filter(os.path.isdir, server_dirs):
+        stat = os.stat(server_dir)
+        removed += install(server_dir, artifacts, cache_dir, (stat.st_uid, stat.st_gid))
+    misses = sum(1 for size in downloaded if size)
+    return {"time": int(time.time()),
+            "artifacts": len(artifacts),
+            "cache_hits": len(artifacts) - misses,
+            "cache_misses": misses,
+            "hit_rate": round((len(artifacts) - misses) / len(artifacts), 3) if artifacts else 1,
+            "bytes_downloaded": sum(downloaded),
+            "bytes_total": sum(artifact.get("size", 0) for artifact in artifacts),
+            "removed": removed,
+            "has_server_jar": any(artifact.get("kind") == "server" for artifact in artifacts),
+            "seconds": round(time.monotonic() - started, 2)}
+
+
+def publish(directory, bucket, threads=DOWNLOAD_THREADS):
+    # Every file under directory becomes an artifact with the same path in the server directory
+    artifacts = []
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            target = os.path.relpath(path, directory)
+            digest = sha256_file(path)
+            artifact = {"key": f"artifacts/{digest}/{name}", "sha256": digest, "size": os.path.getsize(path),
+                        "target": target}
+            if os.sep not in target and SERVER_JAR.match(name):
+                artifact["kind"] = "server"
+            artifacts.append((path, artifact))
+    s3 = boto3.client('s3')
+
+    def upload(item):
+        path, artifact = item
+        try:
+            s3.head_object(Bucket=bucket, Key=artifact["key"])
+            return 0
+        except ClientError:
+            s3.upload_file(path, bucket, artifact["key"])
+            return artifact["size"]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        uploaded = sum(pool.map(upload, artifacts))
+    manifest = {"artifacts": [artifact for path, artifact in artifacts]}
+    s3.put_object(Bucket=bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest, indent=2).encode())
+    return {"artifacts": len(artifacts), "bytes_uploaded": uploaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install the server jar, plugins and datapacks from the files bucket")
+    parser.add_argument("command", choices=["sync", "publish"])
+    parser.add_argument("directory", nargs="?", help="publish: folder laid out like a server directory")
+    parser.add_argument("--bucket", help="default: the s3_file_url tag")
+    parser.add_argument("--worlds", default=mc_instance.WORLDS_FILE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        if not args.directory or not args.bucket:
+            parser.error("publish needs a directory and --bucket")
+        print(json.dumps(publish(args.directory, args.bucket)))
+        return
+    bucket = args.bucket or mc_instance.bucket_from_url(mc_instance.tag("s3_file_url"))
+    result = sync(bucket, [mc_instance.server_dir(world) for world in mc_instance.worlds(args.worlds)], args.cache_dir)
+    line = json.dumps(result)
+    print(line)
+    with open(LOG_FILE, "a") as fp:
+        fp.write(line + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# Follows a server start from the startup URL to the first moment players can join, and says where the time went.
+#
+# The startup Lambda tags the instance with boot_trace ({"id": ..., "requested": epoch}) as it starts it, and on every
+# boot minecraft-boot-trace.service picks that up and turns the boot into spans:
+#   ec2_start       start requested (the Lambda) until the kernel started
+#   os_boot         kernel until systemd reached the network
+#   user_data       cloud-init running configure.sh, first boot only.  Its own phases (see configure.sh) come along as
+#                   configure_<phase> spans
+#   fast_tier, artifacts, dns
+#                   the oneshot units that run before the servers, when they're set up
+#   server_start    minecraft@server from being started until java was running
+#   world_load      java running until a server list ping is answered
+# plus time_to_joinable from the request (or the kernel, when the start didn't come through the Lambda) to joinable.
+# Every span is published as boot_phase_seconds with a Phase dimension, the total as time_to_joinable, and the whole
+# trace is appended to /var/log/minecraft-boot-trace.log with the trace id, one JSON line per boot.
+#
+# Usage:
+#   boot_trace.py [record]
+#   boot_trace.py replay trace.log [--baseline baseline.log] [--tolerance 0.2]
+#                               p50/p95 per span from recorded traces, and with a baseline, exit 1 on a regression
+import argparse
+import json
+import subprocess
+import sys
+import time
+import uuid
+
+TRACE_LOG = "/var/log/minecraft-boot-trace.log"
+BOOT_PHASES = "/var/log/minecraft-boot-phases.log"
+TRACE_TAG = "boot_trace"
+JOINABLE_TIMEOUT = 1800
+REQUEST_MAX_AGE = 900           # a boot_trace tag older than this at boot is from an earlier start
+# Units that get a span when they exist, in the order they run
+UNIT_SPANS = [("user_data", "cloud-final.service"),
+              ("fast_tier", "minecraft-fast-tier.service"),
+              ("artifacts", "minecraft-artifacts.service"),
+              ("dns", "minecraft-dns.service")]
+
+
+def boot_epoch():
+    with open("/proc/uptime") as fp:
+        return time.time() - float(fp.read().split()[0])
+
+
+def unit_times(unit):
+    # (started, active) as epoch seconds, None when the unit didn't run this boot.  systemd counts from boot.
+    output = subprocess.run(["systemctl", "show", unit, "-p", "InactiveExitTimestampMonotonic",
+                             "-p", "ActiveEnterTimestampMonotonic", "-p", "ExecMainStartTimestampMonotonic",
+                             "-p", "LoadState"], capture_output=True, text=True).stdout
+    values = dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+    if values.get("LoadState") != "loaded" or not int(values.get("InactiveExitTimestampMonotonic") or 0):
+        return None
+    boot = boot_epoch()
+    return {key: boot + int(values.get(key) or 0) / 1e6 if int(values.get(key) or 0) else None
+            for key in ("InactiveExitTimestampMonotonic", "ActiveEnterTimestampMonotonic", "ExecMainStartTimestampMonotonic")}
+
+
+def configure_spans(boot, path=BOOT_PHASES):
+    # configure.sh's phases from this boot, each line is how long since the one before
+    spans, start = [], None
+    try:
+        with open(path) as fp:
+            lines = [json.loads(line) for line in fp if line.strip()]
+    except (OSError, ValueError):
+        return []
+    # The phases of this boot start at the last "boot" line, which has the uptime configure.sh started at
+    for index in range(len(lines) - 1, -1, -1):
+        if lines[index]["phase"] == "boot":
+            start = boot + lines[index]["seconds"]
+            lines = lines[index + 1:]
+            break
+    if start is None or time.time() - start > JOINABLE_TIMEOUT * 2:
+        return []
+    for line in lines:
+        spans.append({"span": "configure_" + line["phase"], "start": round(start, 3),
+                      "seconds": line["seconds"]})
+        start += line["seconds"]
+    return spans
+
+
+def wait_until_joinable(port, timeout=JOINABLE_TIMEOUT):
+    import mc_instance
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            mc_instance.server_status(port)
+            return time.time()
+        except Exception:           # mcstatus raises all sorts while the server is coming up
+            time.sleep(1)
+    return None
+
+
+def request(instance_tags, boot):
+    # The Lambda's tag if it belongs to this boot, otherwise a fresh id starting at the kernel
+    try:
+        tagged = json.loads(instance_tags.get(TRACE_TAG, ""))
+        if 0 <= boot - tagged["requested"] <= REQUEST_MAX_AGE:
+            return tagged["id"], tagged["requested"]
+    except (ValueError, KeyError, TypeError):
+        pass
+    return "boot-" + uuid.uuid4().hex[:12], None
+
+
+def record(port=25565):
+    import emf
+    import mc_instance
+    boot = boot_epoch()
+    trace_id, requested = request(mc_instance.tags(), boot)
+    # Everything below has finished by the time the server can be joined (apart from configure.sh's last few lines)
+    joinable = wait_until_joinable(port)
+    spans = []
+    if requested:
+        spans.append({"span": "ec2_start", "start": requested, "seconds": boot - requested})
+    network = unit_times("network-online.target")
+    if network and network["ActiveEnterTimestampMonotonic"]:
+        spans.append({"span": "os_boot", "start": boot, "seconds": network["ActiveEnterTimestampMonotonic"] - boot})
+    for name, unit in UNIT_SPANS:
+        times = unit_times(unit)
+        if times and times["ActiveEnterTimestampMonotonic"]:
+            started = times["InactiveExitTimestampMonotonic"]
+            spans.append({"span": name, "start": started, "seconds": times["ActiveEnterTimestampMonotonic"] - started})
+            if name == "user_data":
+                spans.extend(configure_spans(boot))
+
+    server = unit_times("minecraft@server.service")
+    if server and server["ExecMainStartTimestampMonotonic"]:
+        spans.append({"span": "server_start", "start": server["InactiveExitTimestampMonotonic"],
+                      "seconds": server["ExecMainStartTimestampMonotonic"] - server["InactiveExitTimestampMonotonic"]})
+        if joinable:
+            spans.append({"span": "world_load", "start": server["ExecMainStartTimestampMonotonic"],
+                          "seconds": joinable - server["ExecMainStartTimestampMonotonic"]})
+    for span in spans:
+        span["start"], span["seconds"] = round(span["start"], 3), round(span["seconds"], 3)
+
+    trace = {"trace": trace_id, "instance_id": mc_instance.instance_id(), "boot": round(boot, 3),
+             "requested": requested, "joinable": round(joinable, 3) if joinable else None,
+             "time_to_joinable": round(joinable - (requested or boot), 3) if joinable else None, "spans": spans}
+    with open(TRACE_LOG, "a") as fp:
+        fp.write(json.dumps(trace) + "\n")
+
+    dimensions = {"InstanceId": trace["instance_id"]}
+    for span in spans:
+        emf.emit({"boot_phase_seconds": (span["seconds"], "Seconds")}, dict(dimensions, Phase=span["span"]),
+                 properties={"trace": trace_id})
+    if trace["time_to_joinable"] is not None:
+        emf.emit({"time_to_joinable": (trace["time_to_joinable"], "Seconds")}, dimensions, properties={"trace": trace_id})
+    return trace
+
+
+###############
+# Replay
+###############
+
+def read_traces(path):
+    with open(path) as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))] if values else None
+
+
+def summarize(traces):
+    by_span = {}
+    for trace in traces:
+        for span in trace["spans"]:
+            by_span.setdefault(span["span"], []).append(span["seconds"])
+        if trace.get("time_to_joinable") is not None:
+            by_span.setdefault("time_to_joinable", []).append(trace["time_to_joinable"])
+    return {name: {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+            for name, values in sorted(by_span.items())}
+
+
+def regressions(summary, baseline, tolerance, slack_seconds=2):
+    # Spans whose p50 grew by more than tolerance (and a couple of seconds, so tiny spans don't count)
+    found = {}
+    for name, now in summary.items():
+        before = baseline.get(name)
+        if before and now["p50"] > before["p50"] * (1 + tolerance) + slack_seconds:
+            found[name] = {"baseline_p50": before["p50"], "p50": now["p50"]}
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace where the time goes between starting the server and joining it")
+    parser.add_argument("command", nargs="?", choices=["record", "replay"], default="record")
+    parser.add_argument("traces", nargs="?", default=TRACE_LOG, help="replay: recorded traces")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("--baseline", help="replay: traces to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="replay: how much slower a span may get")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(json.dumps(record(args.port)))
+        return 0
+    result = {"summary": summarize(read_traces(args.traces))}
+    if args.baseline:
+        result["regressions"] = regressions(result["summary"], summarize(read_traces(args.baseline)), args.tolerance)
+    print(json.dumps(result, indent=2))
+    return 1 if result.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,58 +1,151 @@
 #!/usr/bin/python3
+# Points <dns_hostname>.<dns_zone> at this instance's public IP in Route53.
+#
+# minecraft-dns.service runs it on every boot, before anyone can know the new IP:
+#   - the hosted zone id is looked up once (every page of ListHostedZones) and cached in the dns_zone_id tag as
+#     {"zone", "id"}.  It's looked up again when dns_zone changes, and when Route53 says the zone is gone (it was
+#     deleted and made again, so it has a new id)
+#   - nothing is written when the record already has this IP and TTL
+#   - during boot the record gets a short TTL, so resolvers that cached the last IP let go of it quickly.  Once the
+#     server has been up for a while minecraft-dns-stable.timer raises it (stable), and stopping the instance lowers it
+#     again (stopping) so the next boot starts from a short TTL
+#   - it waits until Route53 says the change is INSYNC, then records that in the dns_record tag
+#     ({"name", "ip", "ttl", "insync"}), which is how the startup URL knows when the name resolves to the new IP
+#
+# Usage:
+#   dns_updater.py [boot]               short TTL, wait for INSYNC
+#   dns_updater.py stable               long TTL
+#   dns_updater.py stopping             short TTL, without waiting
+import argparse
+import json
+import sys
+import time
+
 import boto3
-import requests
-
-
-instance = requests.get("http://169.254.169.254/latest/meta-data/instance-id").text
-ec2 = boto3.resource('ec2', region_name='us-east-1')
-myinstance = ec2.Instance(instance)
-
-# Look up the Hostname tag
-try:
-    myMachine = next(t["Value"] for t in instance.tags if t["Key"] == "dns_hostname")
-except StopIteration:
-    print("Unable to locate tag 'dns_hostname', cannot continue")
-    exit(1)
-    
-# Look up the Hosted Zone tag
-try:
-    myZone = next(t["Value"] for t in instance.tags if t["Key"] == "dns_zone")
-except StopIteration:
-    print("Unable to locate tag 'dns_zone', cannot continue")
-    exit(1)
-
-myCurrIP = requests.get("http://169.254.169.254/latest/meta-data/public-ipv4").text
-
-# Make a connection to Route53 to update the record
-conn53 = boto3.client('route53')
-myzone = conn53.list_hosted_zones()
-
-try:
-    myzoneid = next(z["Id"] for z in myzone['HostedZones'] if z["Name"] == myZone)
-except StopIteration:
-    print("Unable to find hosted zone in route53, unable to update DNS")
-    exit(1)
-
-response = conn53.change_resource_record_sets(
-    HostedZoneId=myzoneid,
-    ChangeBatch={
-        "Comment": "Automatic DNS update",
-        "Changes": [
-            {
-                "Action": "UPSERT",
-                "ResourceRecordSet": {
-                    "Name": myMachine + "." + myZone,
-                    "Type": "A",
-                    "TTL": 180,
-                    "ResourceRecords": [
-                        {
-                            "Value": myCurrIP
-                        },
-                    ],
-                }
-            },
-        ]
-    }
-)
-
-print("DNSLOG: " + myMachine + "." + myZone + " updated to " + myCurrIP)
\ No newline at end of file
+from botocore.exceptions import ClientError
+
+import mc_instance
+
+BOOT_TTL = 60
+STABLE_TTL = 900
+ZONE_ID_TAG = "dns_zone_id"
+RECORD_TAG = "dns_record"
+INSYNC_TIMEOUT = 300
+POLL_SECONDS = 5
+MODES = {"boot": (BOOT_TTL, True), "stable": (STABLE_TTL, True), "stopping": (BOOT_TTL, False)}
+
+
+def find_zone_id(route53, zone):
+    # Public zones win over private ones with the same name, those can't be resolved by players anyway
+    zone = zone.rstrip(".") + "."
+    found = [z for page in route53.get_paginator("list_hosted_zones").paginate() for z in page["HostedZones"]
+             if z["Name"] == zone]
+    found.sort(key=lambda z: z.get("Config", {}).get("PrivateZone", False))
+    return found[0]["Id"].split("/")[-1] if found else None
+
+
+def cached_zone_id(instance_tags, zone):
+    # The id in the dns_zone_id tag when it was cached for this zone, None when it's for another one or a bare id
+    try:
+        cached = json.loads(instance_tags.get(ZONE_ID_TAG) or "null")
+    except ValueError:
+        return None
+    if isinstance(cached, dict) and cached.get("zone") == zone.rstrip(".") + "." and cached.get("id"):
+        return cached["id"]
+    return None
+
+
+def zone_id(route53, zone, instance_tags, save_tag, refresh=False):
+    # The cached id when there is one, otherwise looked up and cached for next time
+    cached = None if refresh else cached_zone_id(instance_tags, zone)
+    if cached:
+        return cached
+    found = find_zone_id(route53, zone)
+    if found:
+        save_tag(ZONE_ID_TAG, json.dumps({"zone": zone.rstrip(".") + ".", "id": found}))
+    return found
+
+
+def current_record(route53, zone_id, name):
+    # (ip, ttl) of the A record, or None when there isn't one
+    response = route53.list_resource_record_sets(HostedZoneId=zone_id, StartRecordName=name, StartRecordType="A",
+                                                 MaxItems="1")
+    for record in response["ResourceRecordSets"]:
+        if record["Name"] == name and record["Type"] == "A" and record.get("ResourceRecords"):
+            return record["ResourceRecords"][0]["Value"], record["TTL"]
+    return None
+
+
+def wait_insync(route53, change_id, timeout=INSYNC_TIMEOUT, poll=POLL_SECONDS):
+    deadline = time.monotonic() + timeout
+    while route53.get_change(Id=change_id)["ChangeInfo"]["Status"] != "INSYNC":
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(poll)
+    return True
+
+
+def update(route53, zone_id, name, ip, ttl, wait=True, comment="Automatic DNS update", poll=POLL_SECONDS):
+    started = time.monotonic()
+    if current_record(route53, zone_id, name) == (ip, ttl):
+        return {"name": name, "ip": ip, "ttl": ttl, "changed": False, "insync": True, "seconds": 0}
+    change = route53.change_resource_record_sets(
+        HostedZoneId=zone_id,
+        ChangeBatch={"Comment": comment,
+                     "Changes": [{"Action": "UPSERT",
+                                  "ResourceRecordSet": {"Name": name, "Type": "A", "TTL": ttl,
+                                                        "ResourceRecords": [{"Value": ip}]}}]})
+    insync = wait and wait_insync(route53, change["ChangeInfo"]["Id"], poll=poll)
+    return {"name": name, "ip": ip, "ttl": ttl, "changed": True, "insync": insync,
+            "seconds": round(time.monotonic() - started, 1)}
+
+
+def point(mode="boot", route53=None, instance_tags=None, ip=None, save_tag=None, poll=POLL_SECONDS):
+    # Updates the record the way mode says, returns what happened (None without dns_hostname/dns_zone tags)
+    ttl, wait = MODES[mode]
+    if instance_tags is None:
+        instance_tags = mc_instance.tags()
+    hostname, zone = instance_tags.get("dns_hostname"), instance_tags.get("dns_zone")
+    if not hostname or not zone:
+        print("No dns_hostname/dns_zone tags, not updating DNS")
+        return None
+    route53 = route53 or boto3.client('route53')
+    save_tag = save_tag or tag_instance
+    name, ip = hostname + "." + zone.rstrip(".") + ".", ip or mc_instance.metadata("public-ipv4")
+    for refresh in (False, True):
+        found = zone_id(route53, zone, instance_tags, save_tag, refresh)
+        if not found:
+            print("Unable to find hosted zone " + zone + " in route53")
+            return None
+        try:
+            result = update(route53, found, name, ip, ttl, wait, comment=f"Automatic DNS update ({mode})", poll=poll)
+            break
+        except ClientError as e:
+            # A stale cached id, look the zone up again
+            if refresh or e.response["Error"]["Code"] != "NoSuchHostedZone":
+                raise
+    if result["insync"]:
+        save_tag(RECORD_TAG, json.dumps({"name": result["name"], "ip": result["ip"], "ttl": result["ttl"],
+                                         "insync": int(time.time())}))
+    return result
+
+
+def tag_instance(key, value):
+    boto3.client('ec2', region_name=mc_instance.region()).create_tags(
+        Resources=[mc_instance.instance_id()], Tags=[{"Key": key, "Value": value}])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Point the dns_hostname tag's name at this instance")
+    parser.add_argument("command", nargs="?", choices=sorted(MODES), default="boot")
+    args = parser.parse_args()
+
+    result = point(args.command)
+    if result:
+        print("DNSLOG: " + result["name"] + (" updated to " if result["changed"] else " already points at ")
+              + result["ip"] + f" (TTL {result['ttl']}, {result['seconds']}s)")
+    return 1 if result and not result["insync"] and MODES[args.command][1] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# Sends metrics to the cloudwatch agent in Embedded Metric Format.  The agent (see the emf section of cloudwatch.json)
+# listens on port 25888 and turns these log lines into metrics, batching them up instead of one PutMetricData per value.
+import json
+import socket
+import sys
+import time
+
+AGENT_ADDRESS = ("127.0.0.1", 25888)
+NAMESPACE = "Minecraft"
+LOG_GROUP = "minecraft.metrics"
+
+_sock = None
+
+
+def document(metrics, dimensions, namespace=NAMESPACE, resolution=60, timestamp=None, dimension_sets=None,
+             properties=None):
+    # metrics is {name: (value, unit)}, dimensions is {name: value}.  dimension_sets lists which combinations of the
+    # dimensions to publish under, by default all of them together.  properties end up in the log line but aren't
+    # metrics or dimensions, for things like ids that would be too many dimensions.
+    doc = {"_aws": {"Timestamp": int((timestamp or time.time()) * 1000),
+                    "LogGroupName": LOG_GROUP,
+                    "CloudWatchMetrics": [{"Namespace": namespace,
+                                           "Dimensions": [sorted(names) for names in dimension_sets or [dimensions]],
+                                           "Metrics": [{"Name": name, "Unit": unit, "StorageResolution": resolution}
+                                                       for name, (value, unit) in sorted(metrics.items())]}]}}
+    doc.update(properties or {})
+    doc.update(dimensions)
+    doc.update({name: value for name, (value, unit) in metrics.items()})
+    return doc
+
+
+def emit(metrics, dimensions, **kwargs):
+    global _sock
+    if not metrics:
+        return
+    line = (json.dumps(document(metrics, dimensions, **kwargs)) + "\n").encode()
+    for attempt in range(2):
+        try:
+            if _sock is None:
+                _sock = socket.create_connection(AGENT_ADDRESS, timeout=2)
+            _sock.sendall(line)
+            return
+        except OSError:
+            if _sock:
+                _sock.close()
+            _sock = None
+    # No agent running (like when testing on a laptop), the line is still useful on stdout
+    sys.stdout.write(line.decode())
+    sys.stdout.flush()
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# Reads the GC log the JVM profiles turn on (logs/gc.log) and reports how long the server spent paused, so different
+# jvmProfile settings can be compared after a play session.  Works with both G1 and ZGC logs.
+#
+# Usage:
+#   gc_analyzer.py [/opt/minecraft/server/logs/gc.log*]
+import argparse
+import glob
+import json
+import re
+
+GC_LOGS = "/opt/minecraft/server/logs/gc.log*"
+
+# "[12.345s][info][gc] GC(7) Pause Young (Normal) (G1 Evacuation Pause) 120M->40M(512M) 3.456ms"
+# "[12.345s][info][gc,phases] GC(7) Pause Mark Start 0.012ms"
+UPTIME = re.compile(r"^\[(\d+(?:\.\d+)?)s\]")
+PAUSE = re.compile(r"GC\(\d+\) (Pause [A-Za-z ]+?)(?= \(| \d|$)")
+DURATION = re.compile(r"(\d+(?:\.\d+)?)ms\s*$")
+
+
+def percentile(ordered, share):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def analyze(paths):
+    pauses = []
+    by_type = {}
+    first = last = None
+    for path in paths:
+        with open(path, errors="replace") as fp:
+            for line in fp:
+                uptime = UPTIME.match(line)
+                if uptime:
+                    seconds = float(uptime.group(1))
+                    first = seconds if first is None else min(first, seconds)
+                    last = seconds if last is None else max(last, seconds)
+                pause = PAUSE.search(line)
+                duration = DURATION.search(line) if pause else None
+                if duration:
+                    duration = float(duration.group(1))
+                    pauses.append(duration)
+                    by_type.setdefault(pause.group(1), []).append(duration)
+
+    pauses.sort()
+    window = (last - first) if first is not None else 0
+    total = sum(pauses)
+    return {"pauses": len(pauses),
+            "log_seconds": round(window, 1),
+            "total_pause_ms": round(total, 1),
+            "pause_percent": round(total / 10 / window, 3) if window else 0,
+            "p50_ms": percentile(pauses, 0.5),
+            "p90_ms": percentile(pauses, 0.9),
+            "p99_ms": percentile(pauses, 0.99),
+            "max_ms": pauses[-1] if pauses else 0,
+            "by_type": {name: {"count": len(values), "max_ms": max(values), "total_ms": round(sum(values), 1)}
+                        for name, values in sorted(by_type.items())}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise GC pauses from a minecraft server's gc.log")
+    parser.add_argument("logs", nargs="*")
+    args = parser.parse_args()
+    # Rotated logs are gc.log.0, gc.log.1 ... and together they cover the session
+    paths = args.logs or sorted(glob.glob(GC_LOGS))
+    print(json.dumps(analyze(paths), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# Stops the instance when nobody has been playing for a while, from inside the instance.
+#
+# The cloudwatch idle alarm only sees 5 minute periods of active_players, and only fires a few minutes after the last one
+# ends, so a server typically keeps running (and billing) well past shutdownWhenIdleMinutes.  This checks the player
+# count over RCON every few seconds instead:
+#   - the idle timer starts as soon as there are fewer than --min-players online
+#   - a player has to stay for --hysteresis seconds to reset it, someone popping in to check on their farm doesn't
+#     keep the server up for another full grace period
+#   - after --idle-minutes of idle the server is stopped through systemd (which saves, backs up and syncs the world,
+#     see minecraft@.service) and then the instance is stopped
+# With several worlds on the instance (worlds in cdk.json) each world has its own idle minutes and minimum players, and
+# the instance is only stopped once all of them are idle.
+# While pregen.py is generating a world (minecraft-pregen@<world>) that world counts as busy.
+# The cloudwatch alarm stays as a backstop in case this isn't running.
+#
+# Usage:
+#   idle_watchdog.py [--worlds /etc/minecraft/worlds.json] [--idle-minutes 15] [--min-players 1]
+#   idle_watchdog.py simulate [trace.csv ...]       replay player count traces (seconds,players per line, or generated
+#                                                   ones without any files) and compare billed idle minutes against the
+#                                                   cloudwatch alarm
+import argparse
+import csv
+import json
+import math
+import random
+import re
+import subprocess
+import sys
+import time
+
+import mc_instance
+import rcon
+
+POLL_SECONDS = 10
+HYSTERESIS_SECONDS = 60
+STARTUP_GRACE_MINUTES = 10      # how long the server gets to come up before "not answering" counts as idle
+STOP_SECONDS = 60               # roughly how long the save, backup and stop take
+
+# "There are 2 of a max of 20 players online: Steve, Alex" (older versions say "2/20 players")
+PLAYERS = re.compile(r"There are (\d+)(?: of a max of |/)")
+COLOR_CODE = re.compile("\u00a7.")
+
+
+def player_count(console):
+    match = PLAYERS.search(COLOR_CODE.sub("", console.command("list") or ""))
+    return int(match.group(1)) if match else None
+
+
+class IdleTimer:
+    # The decision part of the watchdog, fed one player count at a time so the simulation can drive it too
+
+    def __init__(self, idle_seconds, min_players=1, hysteresis=HYSTERESIS_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.min_players = min_players
+        self.hysteresis = hysteresis
+        self.idle_since = None
+        self.busy_since = None
+
+    def update(self, now, players):
+        # Returns True once the server has been idle long enough to stop
+        if players is not None and players >= self.min_players:
+            if self.busy_since is None:
+                self.busy_since = now
+            if self.idle_since is None or now - self.busy_since >= self.hysteresis:
+                self.idle_since = None
+            return False
+        self.busy_since = None
+        if self.idle_since is None:
+            self.idle_since = now
+        return now - self.idle_since >= self.idle_seconds
+
+
+def stop_server(services, dry_run=False):
+    import boto3
+    for service in services:
+        print("Stopping " + service)
+        if not dry_run:
+            subprocess.run(["systemctl", "stop", service], check=False)
+    print("Stopping the instance")
+    if not dry_run:
+        boto3.client('ec2', region_name=mc_instance.region()).stop_instances(InstanceIds=[mc_instance.instance_id()])
+
+
+class WorldWatch:
+    # One minecraft@<world> on this instance, with its own idle policy
+
+    def __init__(self, name, server_dir, timer):
+        self.name = name
+        self.server_dir = server_dir
+        self.timer = timer
+        self.console = None
+        self.idle = False
+
+    def pregen_running(self):
+        return subprocess.run(["systemctl", "is-active", "--quiet", "minecraft-pregen@" + self.name]).returncode == 0
+
+    def players(self):
+        try:
+            self.console = self.console or rcon.from_server_dir(self.server_dir)
+            return player_count(self.console)
+        except (OSError, ConnectionError, rcon.RconError):
+            if self.console:
+                self.console.close()
+            self.console = None
+            return None
+
+
+def watch(worlds, poll=POLL_SECONDS, startup_grace=STARTUP_GRACE_MINUTES * 60, dry_run=False):
+    # The instance only stops once every world has been idle for its own idle_minutes
+    started = time.monotonic()
+    while True:
+        now = time.monotonic()
+        for world in worlds:
+            players = world.players()
+            if players is None and now - started < startup_grace:
+                players = world.timer.min_players       # Still starting up, don't count that as idle
+            elif world.pregen_running():
+                players = world.timer.min_players       # Generating chunks, see pregen.py
+            world.idle = world.timer.update(now, players)
+        if all(world.idle for world in worlds):
+            for world in worlds:
+                if world.console:
+                    world.console.command("say Nobody has been playing for a while, the server is shutting down.")
+            stop_server(["minecraft@" + world.name for world in worlds], dry_run)
+            return
+        time.sleep(poll)
+
+
+###############
+# Simulation
+###############
+
+def read_trace(path):
+    # CSV of seconds,players, each row holds until the next one
+    with open(path) as fp:
+        return [(float(row[0]), int(row[1])) for row in csv.reader(fp) if row and not row[0].startswith("#")]
+
+
+def synthetic_trace(rng, hours=4):
+    # A play session: a few players coming and going, the odd quick visit, and then everyone leaving at a random time
+    trace, now, players = [(0, 0)], 0, 0
+    end = rng.uniform(0.5, hours) * 3600
+    while now < end:
+        now += rng.expovariate(1 / 600)
+        players = max(0, players + rng.choice([-1, 1, 1]))
+        trace.append((now, players))
+        if players == 0 and rng.random() < 0.3:
+            # Someone pops in for a minute to check something
+            trace.append((now + rng.uniform(120, 900), 1))
+            trace.append((now + rng.uniform(960, 1020), 0))
+            now += 1020
+    trace.append((now + 1, 0))
+    return sorted(trace)
+
+
+def players_at(trace, when):
+    count = 0
+    for at, players in trace:
+        if at > when:
+            break
+        count = players
+    return count
+
+
+def last_left(trace, when, min_players):
+    # When the player count last dropped below min_players before `when`
+    left = previous = 0
+    for at, players in trace:
+        if at > when:
+            break
+        if players < min_players <= previous:
+            left = at
+        previous = players
+    return left
+
+
+def simulate_alarm(trace, idle_minutes, min_players, push_seconds=60, period=300, alarm_delay=60):
+    # The cloudwatch alarm: active_players pushed every push_seconds, max per 5 minute period, stop after
+    # ceil(idle_minutes / 5) periods in a row below min_players.  Returns when the instance stops.
+    periods = math.ceil(idle_minutes / 5)
+    breaching = 0
+    period_end = period
+    while period_end < trace[-1][0] + 24 * 3600:
+        samples = [players_at(trace, t) for t in range(int(period_end - period), int(period_end), push_seconds)]
+        breaching = breaching + 1 if max(samples) < min_players else 0
+        if breaching >= periods:
+            return period_end + alarm_delay + STOP_SECONDS
+        period_end += period
+    return None
+
+
+def simulate_watchdog(trace, idle_minutes, min_players, poll=POLL_SECONDS, hysteresis=HYSTERESIS_SECONDS):
+    timer = IdleTimer(idle_minutes * 60, min_players, hysteresis)
+    now = 0
+    while now < trace[-1][0] + 24 * 3600:
+        if timer.update(now, players_at(trace, now)):
+            return now + STOP_SECONDS
+        now += poll
+    return None
+
+
+def simulate(traces, idle_minutes, min_players, poll, hysteresis):
+    results = []
+    for name, trace in traces:
+        row = {"trace": name}
+        for method, stopped in (("alarm", simulate_alarm(trace, idle_minutes, min_players)),
+                                ("watchdog", simulate_watchdog(trace, idle_minutes, min_players, poll, hysteresis))):
+            # Billed idle time is everything after the players left for good, instances bill by the second
+            row[method + "_idle_minutes"] = round((stopped - last_left(trace, stopped, min_players)) / 60, 1)
+            row[method + "_cut_off_players"] = players_at(trace, stopped - STOP_SECONDS)
+        results.append(row)
+    totals = {key: round(sum(row[key] for row in results), 1) for key in results[0] if key != "trace"}
+    return {"traces": len(results), "idle_minutes_setting": idle_minutes, "totals": totals,
+            "saved_minutes_per_session": round((totals["alarm_idle_minutes"] - totals["watchdog_idle_minutes"])
+                                               / len(results), 1),
+            "sessions": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stop the instance when nobody is playing")
+    parser.add_argument("command", nargs="?", choices=["watch", "simulate"], default="watch")
+    parser.add_argument("traces", nargs="*", help="simulate: player count traces, generated ones if none are given")
+    parser.add_argument("--worlds", default=mc_instance.WORLDS_FILE, help="worlds.json written by the stack")
+    parser.add_argument("--idle-minutes", type=float, default=15, help="for worlds without their own idle_minutes")
+    parser.add_argument("--min-players", type=int, default=1, help="for worlds without their own min_players")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between player count checks")
+    parser.add_argument("--hysteresis", type=float, default=HYSTERESIS_SECONDS,
+                        help="seconds a player has to stay to reset the idle timer")
+    parser.add_argument("--sessions", type=int, default=200, help="simulate: generated sessions")
+    parser.add_argument("--dry-run", action="store_true", help="watch: say what would be stopped, don't stop it")
+    args = parser.parse_args()
+
+    if args.command == "simulate":
+        if args.traces:
+            traces = [(path, read_trace(path)) for path in args.traces]
+        else:
+            rng = random.Random(1)
+            traces = [(f"generated-{n}", synthetic_trace(rng)) for n in range(args.sessions)]
+        result = simulate(traces, args.idle_minutes, args.min_players, args.poll, args.hysteresis)
+        if not args.traces:
+            result.pop("sessions")
+        print(json.dumps(result, indent=2))
+        return
+    worlds = [WorldWatch(world["name"], mc_instance.server_dir(world),
+                         IdleTimer(world.get("idle_minutes", args.idle_minutes) * 60,
+                                   world.get("min_players", args.min_players), args.hysteresis))
+              for world in mc_instance.worlds(args.worlds)]
+    watch(worlds, poll=args.poll, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+# Follows the minecraft server log and turns the lines we care about into JSON events for cloudwatch, instead of
+# shipping the whole log.  Events (one JSON object per line in /var/log/minecraft/events.log):
+#   join / leave     a player joined or left                                  {"player": "Steve"}
+#   chat             a chat message                                           {"player": "Steve", "message": "hi"}
+#   lag              "Can't keep up! Is the server overloaded?"               {"behind_ms": 2010, "ticks_behind": 40}
+#   chunk_save       chunks were saved                                        {"duration_ms": 1200}
+#   crash            crash report, unexpected exception or watchdog hang      {"message": "..."}
+#   log              any other WARN/ERROR line, and a sample of the rest     {"level": "WARN", "message": "..."}
+#   summary          every minute: lines read, events written and dropped
+# The stack turns these into metrics with metric filters on the minecraft.log group.
+#
+# Usage:
+#   log_parser.py [--log /opt/minecraft/server/logs/latest.log] [--world server] [--sample 0.01]
+#   log_parser.py --benchmark 2     parse 2GB of generated log lines and report throughput
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+LOG_FILE = "/opt/minecraft/server/logs/latest.log"
+EVENTS_FILE = "/var/log/minecraft/events.log"
+SUMMARY_SECONDS = 60
+
+# Paper writes "[12:34:56 INFO]: message", vanilla writes "[12:34:56] [Server thread/INFO]: message"
+HEADER = re.compile(r"\[(\d\d):(\d\d):(\d\d)(?: (\w+)\]|\] \[[^\]]*/(\w+)\]):? (.*)")
+JOIN = re.compile(r"^(\w+) joined the game")
+LEAVE = re.compile(r"^(\w+) left the game")
+CHAT = re.compile(r"^<(\w+)> (.*)")
+LAG = re.compile(r"Running (\d+)ms or (\d+) ticks behind")
+SAVED_IN = re.compile(r"[Ss]aved (\d+) chunks.*? in (\d+(?:\.\d+)?) ?ms")
+
+
+class Parser:
+
+    def __init__(self, world, sample=0.01):
+        self.world = world
+        self.sample = sample
+        self.save_started = None
+        self.counters = {"lines": 0, "events": 0, "dropped": 0}
+
+    def parse(self, line):
+        # Returns an event dict, or None for lines that get dropped
+        self.counters["lines"] += 1
+        header = HEADER.match(line)
+        if not header:
+            # Stack trace lines and other continuations, only worth keeping right after an error
+            self.counters["dropped"] += 1
+            return None
+        hours, minutes, seconds, paper_level, vanilla_level, message = header.groups()
+        level = paper_level or vanilla_level
+        clock = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+        event = self.classify(level, message, clock)
+        if event is None:
+            self.counters["dropped"] += 1
+            return None
+        event["world"] = self.world
+        self.counters["events"] += 1
+        return event
+
+    def classify(self, level, message, clock):
+        # Cheap substring checks first, the regexes only run on lines that can match
+        if "the game" in message:
+            match = JOIN.match(message) or LEAVE.match(message)
+            if match:
+                return {"event": "join" if "joined" in message else "leave", "player": match.group(1)}
+        if message.startswith("<"):
+            match = CHAT.match(message)
+            if match:
+                return {"event": "chat", "player": match.group(1), "message": match.group(2)}
+        if "Can't keep up" in message:
+            match = LAG.search(message)
+            return {"event": "lag",
+                    "behind_ms": int(match.group(1)) if match else 0,
+                    "ticks_behind": int(match.group(2)) if match else 0}
+        if "aving" in message or "aved" in message:
+            event = self.chunk_save(message, clock)
+            if event:
+                return event
+        if ("crash report" in message or "Encountered an unexpected exception" in message
+                or "has stopped responding" in message):
+            return {"event": "crash", "message": message}
+        if level in ("WARN", "ERROR", "FATAL"):
+            return {"event": "log", "level": level, "message": message}
+        if self.sample and random.random() < self.sample:
+            return {"event": "log", "level": level, "message": message, "sampled": True}
+        return None
+
+    def chunk_save(self, message, clock):
+        match = SAVED_IN.search(message)
+        if match:
+            return {"event": "chunk_save", "chunks": int(match.group(1)), "duration_ms": float(match.group(2))}
+        # Vanilla only logs the start and the end of a save, with one second resolution
+        if message.startswith("Saving chunks for level") and self.save_started is None:
+            self.save_started = clock
+        elif "All chunks are saved" in message or message.startswith("Saved the game"):
+            if self.save_started is not None:
+                duration = ((clock - self.save_started) % 86400) * 1000
+                self.save_started = None
+                return {"event": "chunk_save", "duration_ms": duration}
+        return None
+
+
+def follow(path, poll=1.0, from_end=True):
+    # Yields lines as they get written.  The server rotates latest.log on startup, so when the file is replaced or
+    # truncated we finish what's left of the old one and start at the top of the new one.  The file that's there when
+    # we start was already parsed by the last run (systemd restarts us), so that one is followed from its end.
+    fp = None
+    partial = b""
+    while True:
+        if fp is None:
+            try:
+                fp = open(path, "rb")
+            except FileNotFoundError:
+                from_end = False        # whatever shows up next is new
+                time.sleep(poll)
+                continue
+            if from_end:
+                fp.seek(0, os.SEEK_END)
+                from_end = False
+        line = fp.readline()
+        if line.endswith(b"\n"):
+            yield (partial + line).decode("utf8", "replace")
+            partial = b""
+            continue
+        partial += line         # Half written line, the rest comes later
+        try:
+            stat = os.stat(path)
+            if stat.st_ino != os.fstat(fp.fileno()).st_ino or stat.st_size < fp.tell():
+                for line in (partial + fp.read()).splitlines(True):
+                    yield line.decode("utf8", "replace")
+                fp.close()
+                fp = None
+                partial = b""
+                continue
+        except FileNotFoundError:
+            pass
+        yield None      # Nothing new, lets the caller do its periodic work
+        time.sleep(poll)
+
+
+def run(parser, lines, out, summary_seconds=SUMMARY_SECONDS):
+    last_summary = time.monotonic()
+    for line in lines:
+        if line is not None:
+            event = parser.parse(line)
+            if event:
+                out.write(json.dumps(event) + "\n")
+        if time.monotonic() - last_summary >= summary_seconds:
+            out.write(json.dumps(dict(event="summary", world=parser.world, **parser.counters)) + "\n")
+            parser.counters = dict.fromkeys(parser.counters, 0)
+            last_summary = time.monotonic()
+        if line is None:
+            out.flush()
+
+
+def synthetic_log(path, size):
+    # Roughly what a busy server logs: mostly noise, some players, the odd lag warning and save
+    templates = ["[12:00:{s:02d} INFO]: Steve{n} joined the game\n",
+                 "[12:00:{s:02d} INFO]: Steve{n} left the game\n",
+                 "[12:00:{s:02d} INFO]: <Steve{n}> anyone want to go mining?\n",
+                 "[12:00:{s:02d} WARN]: Can't keep up! Is the server overloaded? Running 2{n:03d}ms or 4{n} ticks behind\n",
+                 "[12:00:{s:02d}] [Server thread/INFO]: Saving chunks for level 'ServerLevel[world]'/minecraft:overworld\n",
+                 "[12:00:{s:02d}] [Server thread/INFO]: ThreadedAnvilChunkStorage (world): All chunks are saved\n"]
+    noise = ["[12:00:{s:02d} INFO]: [dynmap] Loaded 4{n} pending tile renders for world 'world'\n",
+             "[12:00:{s:02d} INFO]: Steve{n} lost connection: Disconnected\n",
+             "[12:00:{s:02d} INFO]: UUID of player Steve{n} is 069a79f4-44e9-4726-a5be-fca90e38aaf5\n",
+             "\tat net.minecraft.server.MinecraftServer.run(MinecraftServer.java:1{n})\n"]
+    block = "".join((templates[n // 20 % len(templates)] if n % 20 == 0 else noise[n % len(noise)]).format(s=n % 60, n=n)
+                    for n in range(20000)).encode()
+    with open(path, "wb") as fp:
+        for _ in range(max(1, size // len(block))):
+            fp.write(block)
+
+
+def benchmark(gigabytes):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "latest.log")
+        synthetic_log(path, int(gigabytes * 1024 ** 3))
+        size = os.path.getsize(path)
+        parser = Parser("benchmark")
+        started = time.monotonic()
+        with open(path, encoding="utf8") as lines, open(os.devnull, "w") as out:
+            run(parser, lines, out, summary_seconds=float("inf"))
+        seconds = time.monotonic() - started
+        lines_read = parser.counters["lines"]
+    return {"bytes": size, "lines": lines_read, "seconds": round(seconds, 2),
+            "mb_per_second": round(size / 1024 ** 2 / seconds, 1), "lines_per_second": round(lines_read / seconds),
+            "events": parser.counters["events"], "dropped": parser.counters["dropped"]}
+
+
+def main():
+    args = argparse.ArgumentParser(description="Turn the minecraft log into structured events")
+    args.add_argument("--log", default=LOG_FILE)
+    args.add_argument("--events", default=EVENTS_FILE)
+    args.add_argument("--world", default="server")
+    args.add_argument("--sample", type=float, default=0.01, help="share of unremarkable INFO lines to keep")
+    args.add_argument("--benchmark", type=float, metavar="GB", help="parse this many GB of generated log and exit")
+    args = args.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.benchmark), indent=2))
+        return
+
+    os.makedirs(os.path.dirname(args.events), exist_ok=True)
+    # Line buffered appends, so the parsers for several worlds can share one events file
+    with open(args.events, "a", buffering=1) as out:
+        run(Parser(args.world, args.sample), follow(args.log), out)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# Small helpers shared by the python scripts in /opt/resources.  They answer the questions every script ends up asking:
+#   who am I (instance id / region), what tags did CDK put on me, and where are my buckets.
+import json
+import os
+from urllib.parse import urlparse
+
+import boto3
+import requests
+
+METADATA_URL = "http://169.254.169.254/latest/meta-data/"
+MINECRAFT_HOME = "/opt/minecraft"
+WORLDS_FILE = "/etc/minecraft/worlds.json"
+
+
+def metadata(path, url=METADATA_URL):
+    return requests.get(url + path, timeout=2).text
+
+
+def instance_id():
+    return metadata("instance-id")
+
+
+def region():
+    return metadata("placement/region")
+
+
+def tags(instance=None, region_name=None):
+    # The tags from cdk.json (plus the bucket tags added by the stack) as a plain dict
+    ec2 = boto3.client('ec2', region_name=region_name or region())
+    response = ec2.describe_tags(Filters=[{"Name": "resource-id", "Values": [instance or instance_id()]}])
+    return {t["Key"]: t["Value"] for t in response["Tags"]}
+
+
+def tag(name, default=None):
+    return tags().get(name, default)
+
+
+def server_status(port=25565, host="localhost"):
+    # Server list ping through mcstatus, raises if nothing answers yet
+    try:
+        from mcstatus import JavaServer
+    except ImportError:
+        from mcstatus import MinecraftServer as JavaServer
+    return JavaServer(host, port).status()
+
+
+def bucket_from_url(s3_url):
+    # The stack stores buckets as s3://bucket-name/ tags, we just want the bucket name part
+    return urlparse(s3_url).netloc
+
+
+def worlds(path=WORLDS_FILE):
+    # The worlds on this instance as written by the stack (name, port, idle policy...), just "server" on older stacks
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return [{"name": "server", "port": 25565}]
+
+
+def server_dir(world):
+    return os.path.join(MINECRAFT_HOME, world["name"])
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+# Generates the world ahead of the players, while nobody is playing.
+#
+# Generating new chunks is the slowest thing a server does in its tick loop, and players exploring make it do that all
+# the time.  This walks out from --center in squares of BATCH x BATCH chunks, has the server load (and so generate) each
+# square with forceload, and lets go of it again, until everything within --radius blocks exists:
+#   - it stops as soon as anyone joins, or it runs out of --max-minutes, or --hours is over, and carries on from the
+#     same square next time (minecraft-pregen@.timer starts it again)
+#   - a run that used up --max-minutes with nobody online, or found the world finished, leaves pregen-<dimension>.hold
+#     in the server directory.  minecraft-pregen@.service doesn't start while that's there and minecraft@.service
+#     removes it when the server starts, so pregen gets --max-minutes of an idle server per start and no more, and an
+#     idle server still gets shut down
+#   - progress is kept in the files bucket (pregen/<dns_hostname>/<world>-<dimension>.json), so it also carries on after
+#     the instance was stopped or replaced
+#   - while it runs the idle shutdown alarm is disabled (idle_watchdog.py waits for it by itself), otherwise the
+#     server would be stopped for having nobody on it
+#   - pregen_rate (chunks/s), pregen_remaining_chunks and pregen_progress are published per World
+#
+# Usage:
+#   pregen.py [run] --radius 3000 [--server-dir /opt/minecraft/server] [--dimension overworld] [--hours 2-8]
+#   pregen.py plan --radius 3000                  how many chunks are left and how long they should take
+import argparse
+import datetime
+import json
+import math
+import os
+import sys
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+import emf
+import mc_instance
+import rcon
+from idle_watchdog import player_count
+from tick_metrics import clean
+
+BATCH = 8                   # chunks per side of a square, forceload takes at most 256 chunks at a time
+BATCH_TIMEOUT = 60          # seconds to wait for a square to generate
+POLL_SECONDS = 1
+DIMENSIONS = {"overworld": "", "the_nether": "_nether", "the_end": "_the_end"}    # world folder suffix of each
+ASSUMED_RATE = 20           # chunks/s for plan, before anything has been measured
+
+
+def squares(radius_blocks, batch=BATCH):
+    # Every square of batch x batch chunks within the radius, nearest first, as (x, z) in squares from the center.
+    # The order only depends on the arguments, so a checkpoint's index means the same square every time.
+    rings = math.ceil(radius_blocks / 16 / batch)
+    found = [(x, z) for x in range(-rings, rings + 1) for z in range(-rings, rings + 1)]
+    return sorted(found, key=lambda square: (max(abs(square[0]), abs(square[1])), math.atan2(square[1], square[0])))
+
+
+def square_blocks(square, center, batch=BATCH):
+    # The block corners of a square for forceload
+    x1 = center[0] // 16 * 16 + square[0] * batch * 16
+    z1 = center[1] // 16 * 16 + square[1] * batch * 16
+    return x1, z1, x1 + batch * 16 - 1, z1 + batch * 16 - 1
+
+
+def in_hours(hours, now=None):
+    # "2-8" is 02:00 to 07:59 (instance time, which is UTC), "22-6" wraps past midnight, empty is any time
+    if not hours:
+        return True
+    start, end = (int(hour) for hour in hours.split("-"))
+    hour = (now or datetime.datetime.now()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+class Checkpoint:
+    # How far along a pregen is, in the files bucket and next to the world
+
+    def __init__(self, server_dir, dimension, settings, instance_tags=None):
+        self.settings = settings
+        self.local = os.path.join(server_dir, f"pregen-{dimension}.json")
+        self.bucket = self.key = None
+        if instance_tags and "s3_file_url" in instance_tags:
+            self.bucket = mc_instance.bucket_from_url(instance_tags["s3_file_url"])
+            self.key = (f"pregen/{instance_tags.get('dns_hostname', 'minecraft')}/"
+                        f"{os.path.basename(os.path.normpath(server_dir))}-{dimension}.json")
+
+    def load(self):
+        # The index of the next square, starting over when the settings changed
+        saved = None
+        if self.bucket:
+            try:
+                saved = json.loads(boto3.client('s3').get_object(Bucket=self.bucket, Key=self.key)["Body"].read())
+            except ClientError:
+                pass
+        if saved is None and os.path.exists(self.local):
+            with open(self.local) as fp:
+                saved = json.load(fp)
+        if not saved or saved.get("settings") != self.settings:
+            return 0
+        return saved["done"]
+
+    def save(self, done):
+        body = json.dumps({"settings": self.settings, "done": done, "updated": int(time.time())})
+        with open(self.local + ".tmp", "w") as fp:
+            fp.write(body)
+        os.replace(self.local + ".tmp", self.local)
+        if self.bucket:
+            boto3.client('s3').put_object(Bucket=self.bucket, Key=self.key, Body=body.encode())
+
+
+class IdleAlarm:
+    # Disables the idle shutdown alarm's actions for as long as the pregen runs
+
+    def __init__(self, alarm_name, region_name=None):
+        self.alarm_name = alarm_name
+        self.client = boto3.client('cloudwatch', region_name=region_name) if alarm_name else None
+
+    def __enter__(self):
+        if self.client:
+            self.client.disable_alarm_actions(AlarmNames=[self.alarm_name])
+        return self
+
+    def __exit__(self, *exc):
+        if self.client:
+            self.client.enable_alarm_actions(AlarmNames=[self.alarm_name])
+            # Actions only fire when the state changes, so an alarm that went off while its actions were disabled would
+            # sit in ALARM for good.  From OK, the next evaluation of an idle server goes to ALARM and stops it.
+            self.client.set_alarm_state(AlarmName=self.alarm_name, StateValue="OK",
+                                        StateReason="World pre-generation finished, watching for idle again")
+
+
+def loaded_chunks(console, world):
+    # Paper only, "Chunks in world: Total: 625 Inactive: 0 ..."
+    text = clean(console.command("paper chunkinfo " + world))
+    marker = "Total: "
+    return int(text.split(marker, 1)[1].split()[0]) if marker in text else None
+
+
+class Generator:
+
+    def __init__(self, console, world, dimension, center):
+        self.console = console
+        self.world = world + DIMENSIONS[dimension]
+        self.prefix = "" if dimension == "overworld" else f"execute in minecraft:{dimension} run "
+        self.center = center
+
+    def players(self):
+        return player_count(self.console) or 0
+
+    def generate(self, square):
+        # Loads one square and waits until the server has it, returns False if a player joined in the meantime
+        corners = " ".join(str(value) for value in square_blocks(square, self.center))
+        before = loaded_chunks(self.console, self.world)
+        self.console.command(f"{self.prefix}forceload add {corners}")
+        try:
+            waited = 0
+            while waited < BATCH_TIMEOUT:
+                time.sleep(POLL_SECONDS)
+                waited += POLL_SECONDS
+                if self.players():
+                    return False
+                now = loaded_chunks(self.console, self.world)
+                if before is not None and now is not None and now - before >= BATCH * BATCH:
+                    return True
+            # Vanilla can't tell us, so every square just gets the whole timeout
+            return True
+        finally:
+            self.console.command(f"{self.prefix}forceload remove {corners}")
+
+
+def run(generator, checkpoint, todo, max_minutes, hours, dimensions):
+    # Returns (why it stopped, a message): "done", "out_of_time" (max_minutes), "hours" or "playing"
+    done = checkpoint.load()
+    started = time.monotonic()
+    while done < len(todo):
+        if generator.players():
+            return "playing", f"paused at {done}/{len(todo)}, someone is playing"
+        if not in_hours(hours):
+            return "hours", f"stopped at {done}/{len(todo)}, outside {hours}"
+        if time.monotonic() - started > max_minutes * 60:
+            return "out_of_time", f"stopped at {done}/{len(todo)}, out of time"
+        square_started = time.monotonic()
+        if not generator.generate(todo[done]):
+            return "playing", f"paused at {done}/{len(todo)}, someone is playing"
+        done += 1
+        checkpoint.save(done)
+        remaining = (len(todo) - done) * BATCH * BATCH
+        emf.emit({"pregen_rate": (BATCH * BATCH / (time.monotonic() - square_started), "Count/Second"),
+                  "pregen_remaining_chunks": (remaining, "Count"),
+                  "pregen_progress": (100 * done / len(todo), "Percent")}, dimensions)
+    return "done", f"done, {len(todo) * BATCH * BATCH} chunks within the radius exist"
+
+
+def hold(server_dir, dimension, reason):
+    # Keeps minecraft-pregen@.service from starting again until the server restarts
+    with open(os.path.join(server_dir, f"pregen-{dimension}.hold"), "w") as fp:
+        fp.write(reason + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the world ahead of the players")
+    parser.add_argument("command", nargs="?", choices=["run", "plan"], default="run")
+    parser.add_argument("--server-dir", default=rcon.SERVER_DIR)
+    parser.add_argument("--dimension", choices=sorted(DIMENSIONS), default="overworld")
+    parser.add_argument("--radius", type=int, required=True, help="blocks from the center to generate out to")
+    parser.add_argument("--center-x", type=int, default=0)
+    parser.add_argument("--center-z", type=int, default=0)
+    parser.add_argument("--hours", default="", help="only run between these hours, like 2-8")
+    parser.add_argument("--max-minutes", type=float, default=60, help="stop after this long, the next run carries on")
+    args = parser.parse_args()
+
+    settings = {"dimension": args.dimension, "radius": args.radius, "center": [args.center_x, args.center_z], "batch": BATCH}
+    todo = squares(args.radius)
+    instance_tags = mc_instance.tags() if args.command == "run" else None
+    checkpoint = Checkpoint(args.server_dir, args.dimension, settings, instance_tags)
+
+    if args.command == "plan":
+        remaining = (len(todo) - checkpoint.load()) * BATCH * BATCH
+        print(json.dumps({"chunks": len(todo) * BATCH * BATCH, "remaining_chunks": remaining,
+                          "estimated_hours": round(remaining / ASSUMED_RATE / 3600, 1)}, indent=2))
+        return
+
+    if args.radius <= 0 or not in_hours(args.hours):
+        return
+    if checkpoint.load() >= len(todo):
+        # Nothing left, without touching the idle alarm
+        hold(args.server_dir, args.dimension, "done")
+        print(f"done, {len(todo) * BATCH * BATCH} chunks within the radius exist")
+        return
+    world = rcon.server_properties(args.server_dir).get("level-name", "world")
+    dimensions = {"InstanceId": mc_instance.instance_id(), "World": os.path.basename(os.path.normpath(args.server_dir))}
+    with rcon.from_server_dir(args.server_dir) as console, \
+            IdleAlarm(instance_tags.get("idle_alarm_name"), mc_instance.region()):
+        generator = Generator(console, world, args.dimension, (args.center_x, args.center_z))
+        reason, message = run(generator, checkpoint, todo, args.max_minutes, args.hours, dimensions)
+    print(message)
+    if reason in ("done", "out_of_time"):
+        hold(args.server_dir, args.dimension, reason)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
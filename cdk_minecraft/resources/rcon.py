@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# Minimal RCON client for talking to the minecraft console without screen.  configure.sh turns RCON on with a random
+# password, and the port/password are read straight from server.properties so nothing else needs to know them.
+#
+# Usage:
+#   rcon.py [--server-dir /opt/minecraft/server] save-all
+import argparse
+import os
+import socket
+import struct
+
+SERVER_DIR = "/opt/minecraft/server"
+LOGIN = 3
+COMMAND = 2
+
+
+class RconError(Exception):
+    pass
+
+
+class Rcon:
+
+    def __init__(self, host, port, password, timeout=10):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+        self.request_id = 0
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self._request(LOGIN, self.password) == -1:
+            self.close()
+            raise RconError("RCON password was rejected")
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def command(self, text):
+        # Reconnects once if the server restarted since we last talked to it
+        for attempt in range(2):
+            try:
+                if not self.sock:
+                    self.connect()
+                self._request(COMMAND, text)
+                return self.last_response
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def _request(self, kind, payload):
+        self.request_id += 1
+        body = struct.pack("<ii", self.request_id, kind) + payload.encode("utf8") + b"\x00\x00"
+        self.sock.sendall(struct.pack("<i", len(body)) + body)
+        length, = struct.unpack("<i", self._read(4))
+        response_id, _ = struct.unpack("<ii", self._read(8))
+        self.last_response = self._read(length - 8)[:-2].decode("utf8", "replace")
+        return response_id
+
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("RCON connection closed")
+            data += chunk
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def server_properties(server_dir=SERVER_DIR):
+    properties = {}
+    with open(os.path.join(server_dir, "server.properties")) as fp:
+        for line in fp:
+            if "=" in line and not line.startswith("#"):
+                key, value = line.rstrip("\n").split("=", 1)
+                properties[key] = value
+    return properties
+
+
+def from_server_dir(server_dir=SERVER_DIR):
+    properties = server_properties(server_dir)
+    if properties.get("enable-rcon") != "true":
+        raise RconError("RCON is not enabled in " + os.path.join(server_dir, "server.properties"))
+    return Rcon("127.0.0.1", int(properties.get("rcon.port", 25575)), properties.get("rcon.password", ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a command to the minecraft console")
+    parser.add_argument("--server-dir", default=SERVER_DIR)
+    parser.add_argument("command", nargs="+")
+    args = parser.parse_args()
+    with from_server_dir(args.server_dir) as rcon:
+        print(rcon.command(" ".join(args.command)))
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# World backups as EBS snapshots of the world volume, for backupBackend "snapshot" in cdk.json.
+#
+# world_backup.py reads and uploads the world when the server stops, so the bigger the world the longer a stop takes.
+# A snapshot is started in a second or two whatever the size, and EBS copies the changed blocks in the background, even
+# after the instance has stopped:
+#   snapshot  every running world does save-off and save-all flush (with a fast tier, the worlds are copied back to the
+#             volume first), the world volume is snapshotted, and saving is turned back on.  That's crash consistent, like
+#             pulling the plug right after a save.  The worlds all share the volume, so when several stop together only
+#             the first one takes a snapshot.  Only the newest --retain of these are kept.
+#   restore   on a new instance, before the volume is mounted: the blank volume from the launch template is tagged and
+#             swapped for one made from the newest snapshot.  With --fast-restore the snapshot gets fast snapshot restore in this
+#             availability zone until the volume exists, so the world doesn't load lazily from S3 block by block (that
+#             costs by the hour, so it's turned off again straight away)
+#   list      the snapshots there are to restore from
+# The stack's lifecycle policy also snapshots the volume every snapshotIntervalHours and keeps snapshotRetainCount of
+# those.  Both kinds carry the minecraft_backup tag.  restore takes the newest one taken on a stop, since the worlds were
+# flushed and saving was off for those, and only falls back to the newest lifecycle one when there are none.
+#
+# Usage:
+#   snapshot_backup.py snapshot [--server-dir /opt/minecraft/server]
+#   snapshot_backup.py restore [--fast-restore]       exit status 1 when there's no snapshot to restore
+#   snapshot_backup.py list
+# --name and --retain default to SNAPSHOT_NAME and SNAPSHOT_RETAIN from /etc/minecraft/backup.conf, written by the stack.
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+
+import boto3
+
+import mc_instance
+import rcon
+
+WORLD_DEVICE = "/dev/sdf"
+BACKUP_TAG = "minecraft_backup"             # on the world volume and its snapshots, the value is the stack name
+SOURCE_TAG = "minecraft_backup_source"      # "stop" on the snapshots taken here, the lifecycle policy's have none
+LOCK_FILE = "/opt/minecraft/.snapshot.lock"  # minecraft@.service runs as minecraft, which can't create files in /run
+RECENT_SECONDS = 60                         # a snapshot this recent already covers a world that stops now
+FAST_RESTORE_TIMEOUT = 1800
+DEVICE_TIMEOUT = 120
+
+
+def world_volume(ec2, instance_id, device=WORLD_DEVICE):
+    # (volume id, availability zone) of the world volume
+    instance = ec2.describe_instances(InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]
+    volume_id = next((mapping["Ebs"]["VolumeId"] for mapping in instance.get("BlockDeviceMappings", [])
+                      if mapping["DeviceName"] == device), None)
+    return volume_id, instance["Placement"]["AvailabilityZone"]
+
+
+def snapshots(ec2, name, source=None):
+    # Snapshots of this stack's world volume, newest first
+    filters = [{"Name": f"tag:{BACKUP_TAG}", "Values": [name]}]
+    if source:
+        filters.append({"Name": f"tag:{SOURCE_TAG}", "Values": [source]})
+    found = [snapshot for page in ec2.get_paginator("describe_snapshots").paginate(OwnerIds=["self"], Filters=filters)
+             for snapshot in page["Snapshots"]]
+    return sorted(found, key=lambda snapshot: snapshot["StartTime"], reverse=True)
+
+
+def hold_saves(server_dirs):
+    # save-off and a flush on every world that's running, what's on disk is all there is for the others
+    consoles = []
+    for server_dir in server_dirs:
+        try:
+            console = rcon.from_server_dir(server_dir)
+        except (OSError, ConnectionError, rcon.RconError):
+            continue
+        try:
+            console.command("save-off")
+            console.command("save-all flush")
+        except (OSError, ConnectionError, rcon.RconError):
+            # Enabled but not running
+            console.close()
+            continue
+        consoles.append(console)
+    return consoles
+
+
+def resume_saves(consoles):
+    for console in consoles:
+        try:
+            console.command("save-on")
+            console.close()
+        except (OSError, ConnectionError, rcon.RconError):
+            pass
+
+
+def prune(ec2, name, retain):
+    # Only the snapshots taken here, the lifecycle policy looks after its own
+    old = [snapshot for snapshot in snapshots(ec2, name, source="stop") if snapshot["State"] == "completed"][retain:]
+    for snapshot in old:
+        ec2.delete_snapshot(SnapshotId=snapshot["SnapshotId"])
+    return len(old)
+
+
+def snapshot(ec2, server_dirs, name, retain):
+    started = time.monotonic()
+    volume_id, _ = world_volume(ec2, mc_instance.instance_id())
+    if not volume_id:
+        raise RuntimeError(f"No world volume attached at {WORLD_DEVICE}")
+    # Read only, so it doesn't matter whether root (the spot watcher) or minecraft made the file
+    with os.fdopen(os.open(LOCK_FILE, os.O_RDONLY | os.O_CREAT, 0o644)) as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        recent = [found for found in snapshots(ec2, name, source="stop")
+                  if found["VolumeId"] == volume_id and time.time() - found["StartTime"].timestamp() < RECENT_SECONDS]
+        if recent:
+            return {"snapshot": recent[0]["SnapshotId"], "taken": False, "seconds": round(time.monotonic() - started, 1)}
+        import world_sync
+        if os.path.ismount(world_sync.FAST_DIR):
+            for server_dir in server_dirs:
+                # A world that never finished hydrating has only ever run from what's on the volume
+                if world_sync.hydrated(server_dir):
+                    world_sync.sync(server_dir, 0)
+        consoles = hold_saves(server_dirs)
+        try:
+            os.sync()
+            created = ec2.create_snapshot(
+                VolumeId=volume_id,
+                Description=f"{name} minecraft worlds",
+                TagSpecifications=[{"ResourceType": "snapshot",
+                                    "Tags": [{"Key": BACKUP_TAG, "Value": name}, {"Key": SOURCE_TAG, "Value": "stop"},
+                                             {"Key": "Name", "Value": f"{name} worlds"}]}])
+        finally:
+            resume_saves(consoles)
+    return {"snapshot": created["SnapshotId"], "taken": True, "pruned": prune(ec2, name, retain),
+            "seconds": round(time.monotonic() - started, 1)}
+
+
+def enable_fast_restore(ec2, snapshot_id, zone, timeout=FAST_RESTORE_TIMEOUT):
+    # True once the snapshot can be restored at full speed in zone, False if that took too long (the restore goes ahead)
+    ec2.enable_fast_snapshot_restores(AvailabilityZones=[zone], SourceSnapshotIds=[snapshot_id])
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        states = ec2.describe_fast_snapshot_restores(Filters=[{"Name": "snapshot-id", "Values": [snapshot_id]},
+                                                              {"Name": "availability-zone", "Values": [zone]}])
+        if any(state["State"] == "enabled" for state in states["FastSnapshotRestores"]):
+            return True
+        time.sleep(15)
+    return False
+
+
+def wait_for_device(device, timeout=DEVICE_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(device):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{device} didn't show up after attaching the restored volume")
+        time.sleep(1)
+
+
+def restore(ec2, name, fast_restore=False):
+    # Swaps the blank world volume for one made from the newest snapshot, None when there's no snapshot yet
+    started = time.monotonic()
+    instance_id = mc_instance.instance_id()
+    blank_id, zone = world_volume(ec2, instance_id)
+    # Either it's the volume the lifecycle policy snapshots from now on, or the tag is what lets it be detached and deleted
+    ec2.create_tags(Resources=[blank_id], Tags=[{"Key": BACKUP_TAG, "Value": name}])
+    found = ([snapshot for snapshot in snapshots(ec2, name, source="stop") if snapshot["State"] == "completed"]
+             or [snapshot for snapshot in snapshots(ec2, name) if snapshot["State"] == "completed"])
+    if not found:
+        return None
+    latest = found[0]
+    blank = ec2.describe_volumes(VolumeIds=[blank_id])["Volumes"][0]
+    fast = fast_restore and enable_fast_restore(ec2, latest["SnapshotId"], zone)
+    try:
+        # Same type and performance as the launch template's volume, and at least as big as it
+        settings = {key: blank[key] for key in ("Iops", "Throughput") if key in blank}
+        volume_id = ec2.create_volume(SnapshotId=latest["SnapshotId"], AvailabilityZone=zone, VolumeType=blank["VolumeType"],
+                                      Size=max(blank["Size"], latest["VolumeSize"]),
+                                      TagSpecifications=[{"ResourceType": "volume",
+                                                          "Tags": [{"Key": BACKUP_TAG, "Value": name},
+                                                                   {"Key": "Name", "Value": f"{name} worlds"}]}],
+                                      **settings)["VolumeId"]
+        ec2.get_waiter("volume_available").wait(VolumeIds=[volume_id])
+    finally:
+        if fast_restore:
+            ec2.disable_fast_snapshot_restores(AvailabilityZones=[zone], SourceSnapshotIds=[latest["SnapshotId"]])
+
+    # The blank volume was never mounted, so it can just go
+    ec2.detach_volume(VolumeId=blank_id, InstanceId=instance_id)
+    ec2.get_waiter("volume_available").wait(VolumeIds=[blank_id])
+    ec2.attach_volume(VolumeId=volume_id, InstanceId=instance_id, Device=WORLD_DEVICE)
+    ec2.get_waiter("volume_in_use").wait(VolumeIds=[volume_id])
+    ec2.modify_instance_attribute(InstanceId=instance_id,
+                                  BlockDeviceMappings=[{"DeviceName": WORLD_DEVICE, "Ebs": {"DeleteOnTermination": True}}])
+    ec2.delete_volume(VolumeId=blank_id)
+    wait_for_device(WORLD_DEVICE)
+    return {"snapshot": latest["SnapshotId"], "snapshot_time": latest["StartTime"].isoformat(), "volume": volume_id,
+            "fast_restore": fast, "seconds": round(time.monotonic() - started, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minecraft world backups as EBS snapshots of the world volume")
+    parser.add_argument("command", choices=["snapshot", "restore", "list"])
+    parser.add_argument("--name", default=os.environ.get("SNAPSHOT_NAME"),
+                        help="the stack name the snapshots are tagged with")
+    parser.add_argument("--retain", type=int, default=int(os.environ.get("SNAPSHOT_RETAIN") or 7))
+    parser.add_argument("--fast-restore", action="store_true", default=bool(os.environ.get("SNAPSHOT_FAST_RESTORE")))
+    parser.add_argument("--worlds", default=mc_instance.WORLDS_FILE)
+    parser.add_argument("--server-dir", help="snapshot: the world being stopped, every world on the volume is "
+                                             "flushed and snapshotted anyway")
+    args = parser.parse_args()
+    if not args.name:
+        parser.error("--name is needed without /etc/minecraft/backup.conf")
+
+    ec2 = boto3.client('ec2', region_name=mc_instance.region())
+    if args.command == "snapshot":
+        server_dirs = [mc_instance.server_dir(world) for world in mc_instance.worlds(args.worlds)]
+        if args.server_dir and args.server_dir not in server_dirs:
+            server_dirs.append(args.server_dir)
+        result = snapshot(ec2, server_dirs, args.name, args.retain)
+    elif args.command == "restore":
+        result = restore(ec2, args.name, args.fast_restore)
+        if result is None:
+            print("No snapshot found for " + args.name)
+            return 1
+    else:
+        result = [{"snapshot": found["SnapshotId"], "time": found["StartTime"].isoformat(), "state": found["State"],
+                   "source": next((tag["Value"] for tag in found.get("Tags", []) if tag["Key"] == SOURCE_TAG), "lifecycle"),
+                   "size_gib": found["VolumeSize"]} for found in snapshots(ec2, args.name)]
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# Watches for the two minute spot interruption notice and gets the world somewhere safe before the instance stops.
+#
+# Spot instances are launched with a persistent request that stops (rather than terminates) the instance, so the world
+# volume and instance id survive and the instance starts again by itself once there's capacity.  What doesn't survive
+# is anything still in the server's memory, or on the instance store fast tier.  When the notice shows up, for every
+# world on the instance:
+#   1. tell the players, and flush the world to disk with save-all
+#   2. copy the fast tier back to the world volume (if there is one, and the world made it onto it)
+#   3. run an incremental world_backup.py backup (or a snapshot_backup.py snapshot), with whatever time is left
+# When the instance comes back it gets a new public IP, minecraft-dns.service points DNS at it (see dns_updater.py).
+#
+# Usage:
+#   spot_watcher.py [--worlds /etc/minecraft/worlds.json]
+#   spot_watcher.py simulate [--after 5]     run against a local stand-in for the metadata service that sends a notice
+#                                            after 5 seconds, without touching the server or S3
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+import mc_instance
+import rcon
+import world_sync
+
+METADATA_URL = "http://169.254.169.254/latest/meta-data/"
+POLL_SECONDS = 5
+SAFETY_SECONDS = 15         # stop working this long before the instance is stopped
+
+
+def interruption_notice(metadata_url=METADATA_URL):
+    # 404 until the instance is marked for interruption, then {"action": "stop", "time": "2021-06-01T12:00:00Z"}
+    response = requests.get(metadata_url + "spot/instance-action", timeout=2)
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+
+def notice_deadline(notice):
+    return datetime.strptime(notice["time"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+def seconds_left(deadline):
+    return (deadline - datetime.now(timezone.utc)).total_seconds() - SAFETY_SECONDS
+
+
+def run_step(name, command, deadline, dry_run):
+    # Runs one step of the save with a timeout of whatever time is left, a step that runs over is abandoned
+    remaining = seconds_left(deadline)
+    if remaining <= 0:
+        print(f"Skipping {name}, out of time")
+        return False
+    print(f"{name}: {' '.join(command)} ({int(remaining)}s left)")
+    if dry_run:
+        return True
+    try:
+        subprocess.run(command, timeout=remaining, check=True)
+        return True
+    except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as error:
+        print(f"{name} failed: {error}")
+        return False
+
+
+def say(console, message, dry_run):
+    print("say " + message)
+    if console and not dry_run:
+        console.command("say " + message)
+
+
+def on_fast_tier(server_dir):
+    # Only a hydrated fast tier has anything to copy back, world_sync.py refuses to sync anything else
+    return os.path.ismount(world_sync.FAST_DIR) and world_sync.hydrated(server_dir)
+
+
+def save_before_interruption(notice, server_dirs, dry_run=False):
+    # Every world gets flushed first, then synced, then backed up, so when time runs short it's the slowest (and least
+    # important) step of the last worlds that gets skipped
+    deadline = notice_deadline(notice)
+    started = time.monotonic()
+    consoles = {}
+    for server_dir in server_dirs:
+        consoles[server_dir] = None
+        try:
+            consoles[server_dir] = None if dry_run else rcon.from_server_dir(server_dir)
+            say(consoles[server_dir], "This server is being reclaimed by AWS in under 2 minutes, saving the world now...",
+                dry_run)
+            if consoles[server_dir]:
+                consoles[server_dir].command("save-all flush")
+        except (OSError, ConnectionError, rcon.RconError) as error:
+            print(f"Can't reach {server_dir} over RCON ({error}), backing up what's on disk")
+            if consoles[server_dir]:
+                consoles[server_dir].close()
+            consoles[server_dir] = None
+
+    steps = {}
+    backup = (["/opt/resources/snapshot_backup.py", "snapshot"] if os.environ.get("BACKUP_BACKEND") == "snapshot"
+              else ["/opt/resources/world_backup.py", "backup"])
+    for step, script in (("sync", ["/opt/resources/world_sync.py", "sync", "--rate-mbps", "0"]),
+                         ("backup", backup)):
+        for server_dir in server_dirs:
+            if step == "sync" and not on_fast_tier(server_dir):
+                continue
+            steps[f"{step} {os.path.basename(server_dir)}"] = run_step(
+                step, [sys.executable] + script + ["--server-dir", server_dir], deadline, dry_run)
+
+    for server_dir, console in consoles.items():
+        backed_up = steps[f"backup {os.path.basename(server_dir)}"]
+        try:
+            say(console, "World saved, the server will be back when AWS has capacity again." if backed_up
+                else "Couldn't finish the backup in time, the last few minutes may be lost.", dry_run)
+        except (OSError, ConnectionError, rcon.RconError):
+            pass
+        if console:
+            console.close()
+    return dict(steps, seconds=round(time.monotonic() - started, 1), seconds_to_spare=int(seconds_left(deadline)))
+
+
+def watch(server_dirs, metadata_url=METADATA_URL, poll=POLL_SECONDS, dry_run=False):
+    while True:
+        try:
+            notice = interruption_notice(metadata_url)
+        except (requests.RequestException, ValueError) as error:
+            print(f"Metadata service error: {error}")
+            notice = None
+        if notice and notice.get("action") in ("stop", "terminate", "hibernate"):
+            return save_before_interruption(notice, server_dirs, dry_run)
+        time.sleep(poll)
+
+
+class FakeMetadata(BaseHTTPRequestHandler):
+    # Answers spot/instance-action with 404 until interrupt_at, then with a notice two minutes out like the real one
+
+    interrupt_at = None
+
+    def do_GET(self):
+        if self.path.endswith("spot/instance-action") and time.time() >= self.interrupt_at:
+            stop_time = datetime.now(timezone.utc) + timedelta(minutes=2)
+            body = json.dumps({"action": "stop", "time": stop_time.strftime("%Y-%m-%dT%H:%M:%SZ")}).encode()
+            self.send_response(200)
+        else:
+            body = b"Not Found"
+            self.send_response(404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def simulate(after, server_dirs):
+    FakeMetadata.interrupt_at = time.time() + after
+    server = HTTPServer(("127.0.0.1", 0), FakeMetadata)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/latest/meta-data/"
+    started = time.monotonic()
+    result = watch(server_dirs, metadata_url=url, poll=1, dry_run=True)
+    server.shutdown()
+    result["noticed_after_seconds"] = round(time.monotonic() - started - after, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Save the minecraft world when a spot interruption notice arrives")
+    parser.add_argument("command", nargs="?", choices=["watch", "simulate"], default="watch")
+    parser.add_argument("--worlds", default=mc_instance.WORLDS_FILE, help="worlds.json written by the stack")
+    parser.add_argument("--metadata-url", default=os.environ.get("METADATA_URL", METADATA_URL))
+    parser.add_argument("--after", type=float, default=5, help="simulate: seconds until the fake notice")
+    args = parser.parse_args()
+
+    server_dirs = [mc_instance.server_dir(world) for world in mc_instance.worlds(args.worlds)]
+    if args.command == "simulate":
+        print(json.dumps(simulate(args.after, server_dirs), indent=2))
+        return
+    print(json.dumps(watch(server_dirs, args.metadata_url)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# Collects tick performance from the server console over RCON and sends it to cloudwatch as high resolution metrics
+# (through the cloudwatch agent, see emf.py):
+#   tps             ticks per second over the last minute (20 is perfect)
+#   mspt            average milliseconds per tick over the last 5 seconds (over 50 means the server is lagging)
+#   mspt_max        slowest tick over the last 5 seconds
+#   loaded_chunks   chunks loaded across all worlds
+#   entities        entities loaded across all worlds
+# Each value is published per World (the minecraft@<world> it came from) and for the whole instance.
+# tps, mspt and loaded_chunks come from Paper commands, on a vanilla server only entities gets reported.
+#
+# Usage:
+#   tick_metrics.py [--server-dir /opt/minecraft/server] [--interval 10]
+import argparse
+import os
+import re
+import time
+
+import emf
+import mc_instance
+import rcon
+
+COLOR_CODE = re.compile("\u00a7.")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def clean(text):
+    return COLOR_CODE.sub("", text or "")
+
+
+def parse_tps(text):
+    # "TPS from last 1m, 5m, 15m: 20.0, 20.0, 20.0" (values above 20 show as *20.0)
+    text = clean(text)
+    if "TPS from last" not in text:
+        return None
+    values = NUMBER.findall(text.split(":", 1)[1])
+    return float(values[0]) if values else None
+
+
+def parse_mspt(text):
+    # "Server tick times (avg/min/max) from last 5s, 10s, 1m:\n◴ 1.2/0.5/3.4, 1.1/0.5/3.4, 1.3/0.4/9.1"
+    text = clean(text)
+    if "tick times" not in text:
+        return None
+    values = NUMBER.findall(text.split(":", 1)[1])
+    return (float(values[0]), float(values[2])) if len(values) >= 3 else None
+
+
+def parse_chunks(text):
+    # "Chunks in world: Total: 625 Inactive: 0 Border: 104 Ticking: 441 Entity: 80", one line per world, and with more
+    # than one world a last "Chunks in all listed worlds: Total: ..." line that already adds them up
+    lines = [line for line in clean(text).splitlines() if "all listed worlds" not in line]
+    totals = re.findall(r"Total: (\d+)", "\n".join(lines))
+    return sum(map(int, totals)) if totals else None
+
+
+def parse_entities(text):
+    # "Test passed, count: 123"
+    match = re.search(r"count: (\d+)", clean(text))
+    return int(match.group(1)) if match else None
+
+
+def collect(console):
+    metrics = {}
+    tps = parse_tps(console.command("tps"))
+    if tps is not None:
+        metrics["tps"] = (tps, "None")
+    mspt = parse_mspt(console.command("mspt"))
+    if mspt is not None:
+        metrics["mspt"] = (mspt[0], "Milliseconds")
+        metrics["mspt_max"] = (mspt[1], "Milliseconds")
+    chunks = parse_chunks(console.command("paper chunkinfo *"))
+    if chunks is not None:
+        metrics["loaded_chunks"] = (chunks, "Count")
+    entities = parse_entities(console.command("execute if entity @e"))
+    if entities is not None:
+        metrics["entities"] = (entities, "Count")
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send minecraft tick performance metrics to cloudwatch")
+    parser.add_argument("--server-dir", default=rcon.SERVER_DIR)
+    parser.add_argument("--interval", type=int, default=10)
+    args = parser.parse_args()
+
+    dimensions = {"InstanceId": mc_instance.instance_id(), "World": os.path.basename(os.path.normpath(args.server_dir))}
+    console = rcon.from_server_dir(args.server_dir)
+    while True:
+        started = time.monotonic()
+        try:
+            emf.emit(collect(console), dimensions, resolution=1, dimension_sets=[["InstanceId", "World"], ["InstanceId"]])
+        except (OSError, ConnectionError, rcon.RconError):
+            pass        # The server is starting, stopping or restarting, try again next time around
+        time.sleep(max(1, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+# Trades view distance for tick time while the server is running.
+#
+# server.properties starts every server at the same view-distance and entity-broadcast-range-percentage, whatever the
+# instance size or however many players are on.  This reads mspt and the player count over RCON and walks a ladder of
+# settings, from the configured view distance down to --min-view:
+#   - every rung lowers the view distance by one, keeps the simulation distance a little under it and sends entities
+#     from a little less far away, so the cheapest rungs shed the most work per chunk
+#   - it steps down when the smoothed mspt stays over --high-mspt, and back up when it stays under --low-mspt *and* the
+#     next rung up is expected to fit under --high-mspt too (the cost of a rung grows with the area it simulates)
+#   - stepping down is quick, stepping up is slow, and after a step down it waits --cooldown seconds before climbing
+#     again, so the distance doesn't bounce between two rungs
+#   - with nobody online it holds where it is, an empty server's mspt says nothing about a full one
+# Every decision is published as view_distance, simulation_distance and entity_broadcast_percent per World.
+#
+# Vanilla and Paper 1.17 have no console command to change these while running, so a plugin has to provide one:
+# --view-command, --simulation-command and --entity-command are RCON command templates with {value} in them.  Without
+# them nothing changes while the server runs: the controller only works out the rung the measured load calls for and
+# writes it to server.properties, so the next start uses what it learned.
+# network-compression-threshold is left alone, it only trades CPU for bandwidth and a server that's lagging on ticks
+# is rarely short of bandwidth.
+#
+# Usage:
+#   view_controller.py [--server-dir /opt/minecraft/server] [--interval 10]
+#   view_controller.py replay [trace.csv ...]      run the controller against recorded load (seconds,mspt,players per
+#                                                  line, recorded at --recorded-view), or generated traces without files
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+import emf
+import mc_instance
+import rcon
+from idle_watchdog import player_count
+from tick_metrics import parse_mspt
+
+INTERVAL = 10
+HIGH_MSPT = 45          # a tick has 50ms, leave some room for spikes
+LOW_MSPT = 30
+SMOOTHING = 0.3         # weight of the newest sample in the moving average
+DOWN_SAMPLES = 2        # samples in a row over HIGH_MSPT before stepping down
+UP_SAMPLES = 6          # samples in a row under LOW_MSPT before stepping up
+COOLDOWN_SECONDS = 300
+MIN_VIEW = 4
+MIN_SIMULATION = 4
+MIN_ENTITY_PERCENT = 50
+FIXED_SHARE = 0.3       # part of the tick that doesn't depend on the distances (redstone, players, the world itself)
+
+
+class Rung:
+
+    def __init__(self, view, simulation, entity_percent):
+        self.view = view
+        self.simulation = simulation
+        self.entity_percent = entity_percent
+
+    def area(self):
+        # Chunks ticked around each player
+        return (2 * self.simulation + 1) ** 2
+
+    def __repr__(self):
+        return f"Rung(view={self.view}, simulation={self.simulation}, entity_percent={self.entity_percent})"
+
+
+def ladder(max_view, min_view=MIN_VIEW, max_entity_percent=100):
+    # Cheapest first.  Simulation distance stays 2 under view distance (chunks at the edge are only sent, not ticked)
+    rungs = []
+    for view in range(min(min_view, max_view), max_view + 1):
+        fraction = (view - min_view) / (max_view - min_view) if max_view > min_view else 1
+        entity_percent = round(MIN_ENTITY_PERCENT + (max_entity_percent - MIN_ENTITY_PERCENT) * fraction)
+        rungs.append(Rung(view, max(MIN_SIMULATION, view - 2), entity_percent))
+    return rungs
+
+
+def relative_cost(rung, reference):
+    # Expected mspt at rung compared to reference, if the load stays the same
+    return FIXED_SHARE + (1 - FIXED_SHARE) * rung.area() / reference.area()
+
+
+class Controller:
+    # The decision part, fed one mspt sample at a time so replay can drive it too.  level is the rung the server runs at,
+    # planned the rung the controller wants.  They only differ without live commands: then the server keeps running at
+    # level, the measured average stays a measurement of level, and planned is only for server.properties.
+
+    def __init__(self, rungs, high_mspt=HIGH_MSPT, low_mspt=LOW_MSPT, cooldown=COOLDOWN_SECONDS, view=None, live=True):
+        # view is where the server is now, the top of the ladder unless a previous run already stepped it down
+        self.rungs = rungs
+        self.level = max([n for n, rung in enumerate(rungs) if view is None or rung.view <= view] or [0])
+        self.planned = self.level
+        self.high_mspt = high_mspt
+        self.low_mspt = low_mspt
+        self.cooldown = cooldown
+        self.live = live
+        self.smoothed = None
+        self.over = self.under = 0
+        self.last_down = None
+
+    @property
+    def rung(self):
+        return self.rungs[self.level]
+
+    def expected(self, level):
+        # The smoothed mspt the server would have at level
+        return self.smoothed * relative_cost(self.rungs[level], self.rung)
+
+    def update(self, now, mspt, players):
+        # Returns the newly planned rung when it changes, otherwise None
+        if mspt is None:
+            return None
+        self.smoothed = mspt if self.smoothed is None else SMOOTHING * mspt + (1 - SMOOTHING) * self.smoothed
+        if not players:
+            self.over = self.under = 0
+            return None
+        self.over = self.over + 1 if self.expected(self.planned) > self.high_mspt else 0
+        self.under = self.under + 1 if self.expected(self.planned) < self.low_mspt else 0
+
+        if self.over >= DOWN_SAMPLES and self.planned > 0:
+            self.planned -= 1
+            self.last_down = now
+        elif (self.under >= UP_SAMPLES and self.planned < len(self.rungs) - 1
+              and (self.last_down is None or now - self.last_down >= self.cooldown)
+              and self.expected(self.planned + 1) < self.high_mspt):
+            self.planned += 1
+        else:
+            return None
+        if self.live:
+            # The average was measured at the old rung, start the new one from what it's expected to be
+            self.smoothed = self.expected(self.planned)
+            self.level = self.planned
+        self.over = self.under = 0
+        return self.rungs[self.planned]
+
+
+def commands_for(rung, templates):
+    commands = []
+    for key, value in (("view", rung.view), ("simulation", rung.simulation), ("entity", rung.entity_percent)):
+        if templates.get(key):
+            commands.append(templates[key].format(value=value))
+    return commands
+
+
+def save_properties(server_dir, rung):
+    # So the next start begins at the rung the controller settled on.  simulation-distance only exists from 1.18.
+    path = os.path.join(server_dir, "server.properties")
+    with open(path) as fp:
+        lines = fp.readlines()
+    values = {"view-distance": rung.view, "simulation-distance": rung.simulation,
+              "entity-broadcast-range-percentage": rung.entity_percent}
+    lines = [f"{line.split('=', 1)[0]}={values[line.split('=', 1)[0]]}\n" if line.split("=", 1)[0] in values else line
+             for line in lines]
+    # It has the RCON password in it, so the copy gets the original's owner and mode (configure.sh makes it 640) before
+    # anything is written to it
+    stat = os.stat(path)
+    with open(path + ".tmp", "w") as fp:
+        os.fchown(fp.fileno(), stat.st_uid, stat.st_gid)
+        os.fchmod(fp.fileno(), stat.st_mode & 0o7777)
+        fp.writelines(lines)
+    os.replace(path + ".tmp", path)
+
+
+def decision_metrics(controller, changed):
+    rung = controller.rung
+    return {"view_distance": (rung.view, "Count"),
+            "simulation_distance": (rung.simulation, "Count"),
+            "entity_broadcast_percent": (rung.entity_percent, "Percent"),
+            "view_distance_changes": (1 if changed else 0, "Count")}
+
+
+def control(server_dir, controller, templates, interval=INTERVAL):
+    dimensions = {"InstanceId": mc_instance.instance_id(), "World": os.path.basename(os.path.normpath(server_dir))}
+    console = None
+    while True:
+        started = time.monotonic()
+        try:
+            console = console or rcon.from_server_dir(server_dir)
+            mspt = parse_mspt(console.command("mspt"))
+            changed = controller.update(started, mspt[0] if mspt else None, player_count(console))
+            if changed:
+                print(f"Smoothed mspt {controller.smoothed:.1f}, " + ("moving to " if controller.live else "next start at ")
+                      + repr(changed))
+                for command in commands_for(changed, templates):
+                    console.command(command)
+                save_properties(server_dir, changed)
+            emf.emit(decision_metrics(controller, changed), dimensions, resolution=1,
+                     dimension_sets=[["InstanceId", "World"]])
+        except (OSError, ConnectionError, rcon.RconError):
+            if console:
+                console.close()
+            console = None      # The server is starting, stopping or restarting, try again next time around
+        time.sleep(max(1, interval - (time.monotonic() - started)))
+
+
+###############
+# Replay
+###############
+
+def read_trace(path):
+    # CSV of seconds,mspt,players sampled while the server ran at a fixed view distance
+    with open(path) as fp:
+        return [(float(row[0]), float(row[1]), int(row[2])) for row in csv.reader(fp) if row and not row[0].startswith("#")]
+
+
+def synthetic_trace(rng, hours=3, interval=INTERVAL):
+    # Players coming and going, each adding a few ms, plus the odd burst of chunk generation or a farm kicking in
+    trace, players, burst = [], 0, 0
+    for step in range(int(hours * 3600 / interval)):
+        if rng.random() < interval / 600:
+            players = max(0, min(20, players + rng.choice([-1, 1, 1])))
+        if burst <= 0 and rng.random() < interval / 1800:
+            burst = rng.uniform(60, 600)
+        burst -= interval
+        mspt = (4 + players * rng.uniform(2.5, 4.5) + (rng.uniform(15, 40) if burst > 0 and players else 0)) * rng.uniform(0.9, 1.1)
+        trace.append((step * interval, round(mspt, 1), players))
+    return trace
+
+
+def replay(traces, rungs, recorded, high_mspt, low_mspt, cooldown):
+    # mspt in the trace was recorded at the `recorded` rung, at any other rung it scales with relative_cost
+    results = []
+    for name, trace in traces:
+        controller = Controller(rungs, high_mspt, low_mspt, cooldown)
+        overrun = {"fixed": 0, "controlled": 0}
+        changes, view_seconds, previous = 0, 0, None
+        for at, mspt, players in trace:
+            step = at - previous[0] if previous else 0
+            previous = (at, mspt)
+            effective = mspt * relative_cost(controller.rung, recorded)
+            overrun["fixed"] += step if mspt > 50 else 0
+            overrun["controlled"] += step if effective > 50 else 0
+            view_seconds += controller.rung.view * step
+            if controller.update(at, effective, players):
+                changes += 1
+        seconds = trace[-1][0] - trace[0][0] or 1
+        results.append({"trace": name,
+                        "fixed_overrun_minutes": round(overrun["fixed"] / 60, 1),
+                        "controlled_overrun_minutes": round(overrun["controlled"] / 60, 1),
+                        "changes_per_hour": round(changes * 3600 / seconds, 1),
+                        "average_view_distance": round(view_seconds / seconds, 1)})
+    totals = {key: round(sum(row[key] for row in results) / (1 if "minutes" in key else len(results)), 1)
+              for key in results[0] if key != "trace"}
+    return {"traces": len(results), "recorded_view_distance": recorded.view, "totals": totals, "sessions": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adjust view distance to the server's tick time")
+    parser.add_argument("command", nargs="?", choices=["control", "replay"], default="control")
+    parser.add_argument("traces", nargs="*", help="replay: load traces, generated ones if none are given")
+    parser.add_argument("--server-dir", default=rcon.SERVER_DIR)
+    parser.add_argument("--interval", type=float, default=INTERVAL)
+    parser.add_argument("--max-view", type=int, help="default: view-distance from server.properties when first started")
+    parser.add_argument("--min-view", type=int, default=MIN_VIEW)
+    parser.add_argument("--high-mspt", type=float, default=HIGH_MSPT)
+    parser.add_argument("--low-mspt", type=float, default=LOW_MSPT)
+    parser.add_argument("--cooldown", type=float, default=COOLDOWN_SECONDS, help="seconds after a step down before going up")
+    parser.add_argument("--view-command", default="", help="RCON command to set the view distance, {value} is replaced")
+    parser.add_argument("--simulation-command", default="")
+    parser.add_argument("--entity-command", default="")
+    parser.add_argument("--recorded-view", type=int, default=10, help="replay: view distance the traces were recorded at")
+    parser.add_argument("--sessions", type=int, default=50, help="replay: generated sessions")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        rungs = ladder(args.max_view or args.recorded_view, args.min_view)
+        recorded = next(rung for rung in ladder(args.recorded_view, args.min_view) if rung.view == args.recorded_view)
+        if args.traces:
+            traces = [(path, read_trace(path)) for path in args.traces]
+        else:
+            rng = random.Random(1)
+            traces = [(f"generated-{n}", synthetic_trace(rng)) for n in range(args.sessions)]
+        result = replay(traces, rungs, recorded, args.high_mspt, args.low_mspt, args.cooldown)
+        if not args.traces:
+            result.pop("sessions")
+        print(json.dumps(result, indent=2))
+        return
+
+    # The controller rewrites view-distance as it goes, so the ceiling has to come from the command line after the first start
+    view = int(rcon.server_properties(args.server_dir).get("view-distance", 10))
+    templates = {"view": args.view_command, "simulation": args.simulation_command, "entity": args.entity_command}
+    controller = Controller(ladder(args.max_view or view, args.min_view), args.high_mspt, args.low_mspt, args.cooldown, view,
+                            live=any(templates.values()))
+    control(args.server_dir, controller, templates, args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
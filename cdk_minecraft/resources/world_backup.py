@@ -0,0 +1,482 @@
+#!/usr/bin/python3
+# Incremental world backup to the MinecraftBackups bucket.
+#
+# Instead of copying the whole world on every stop, files are cut into fixed size chunks that are stored under their
+# sha256 hash.  Every backup writes a manifest listing each file and the chunks it is made of, so a backup only has to
+# upload chunks that changed since the last one.  Region files (.mca) are written in place in 4k sectors, so most of a
+# region file stays byte for byte the same between sessions and most chunks are reused.
+#
+# Layout in the bucket (the prefix is the dns_hostname tag, so each server keeps its own backups, and other worlds on the
+# same server use <dns_hostname>/<world>):
+#   <prefix>/chunks/ab/abcdef...          content addressed chunks, shared by every snapshot
+#   <prefix>/manifests/<timestamp>.json   one manifest per snapshot
+#   <prefix>/manifests/latest             name of the newest manifest
+#
+# Usage:
+#   world_backup.py backup        back up the worlds in /opt/minecraft/server
+#   world_backup.py restore       restore the newest snapshot, if there is one
+#   world_backup.py restore --owner minecraft --start-service minecraft@server --metrics
+#                                 start the server once the spawn area is restored and stream the rest in behind it
+#   world_backup.py exists        exit status tells whether there is a snapshot to restore
+#   world_backup.py prune         delete chunks that no manifest uses anymore (minecraft-backup-prune@.timer, weekly)
+#   world_backup.py benchmark --bucket test --endpoint-url http://localhost:5000
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import gzip
+import os
+import pwd
+import random
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+import rcon
+
+SERVER_DIR = "/opt/minecraft/server"
+CHUNK_SIZE = 1024 * 1024            # region files get cut into chunks of this size, everything else is stored whole
+WORKERS = 16
+SKIP_FILES = {"session.lock"}
+SPAWN_RADIUS = 1                    # regions this far from the spawn region are restored before the server starts
+REGION_NAME = re.compile(r"r\.(-?\d+)\.(-?\d+)\.mca$")
+PRUNE_MIN_AGE = 24 * 3600           # younger chunks may belong to a backup that hasn't written its manifest yet
+
+# Whole files bigger than this go up as parallel multipart uploads
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024,
+                                 multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=4)
+
+
+class ChunkStore:
+    # Everything that talks to S3 lives here, so backup/restore only deal with files and hashes
+
+    def __init__(self, bucket, prefix, endpoint_url=None):
+        self.s3 = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    def chunk_key(self, digest):
+        return f"{self.prefix}/chunks/{digest[:2]}/{digest}"
+
+    def manifest_key(self, name):
+        return f"{self.prefix}/manifests/{name}"
+
+    def put_chunk(self, digest, data):
+        # data is the very buffer digest was worked out from, so a chunk always matches its name
+        if len(data) > TRANSFER_CONFIG.multipart_threshold:
+            self.s3.upload_fileobj(io.BytesIO(data), self.bucket, self.chunk_key(digest), Config=TRANSFER_CONFIG)
+        else:
+            self.s3.put_object(Bucket=self.bucket, Key=self.chunk_key(digest), Body=data)
+        with self._lock:
+            self.bytes_uploaded += len(data)
+
+    def get_chunk(self, digest):
+        body = self.s3.get_object(Bucket=self.bucket, Key=self.chunk_key(digest))["Body"].read()
+        with self._lock:
+            self.bytes_downloaded += len(body)
+        return body
+
+    def put_manifest(self, manifest):
+        name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json"
+        # Only manifests are tagged to expire, chunks live as long as a manifest still points at them (see prune)
+        self.s3.put_object(Bucket=self.bucket, Key=self.manifest_key(name), Body=json.dumps(manifest).encode(),
+                           Tagging="expires=true")
+        self.s3.put_object(Bucket=self.bucket, Key=self.manifest_key("latest"), Body=name.encode())
+        return name
+
+    def latest_manifest(self):
+        try:
+            name = self.s3.get_object(Bucket=self.bucket, Key=self.manifest_key("latest"))["Body"].read().decode()
+            return json.loads(self.s3.get_object(Bucket=self.bucket, Key=self.manifest_key(name))["Body"].read())
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def list_objects(self, sub_prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/{sub_prefix}/"):
+            yield from page.get("Contents", [])
+
+
+def level_name(server_dir):
+    try:
+        with open(os.path.join(server_dir, "server.properties")) as fp:
+            for line in fp:
+                if line.startswith("level-name="):
+                    return line.split("=", 1)[1].strip() or "world"
+    except FileNotFoundError:
+        pass
+    return "world"
+
+
+def world_files(server_dir):
+    # Yields (relative path, full path) for the overworld, nether and end folders.  World folders may be symlinks to
+    # a faster disk, so we follow them.
+    for world in sorted(glob.glob(os.path.join(server_dir, level_name(server_dir) + "*"))):
+        if not os.path.isdir(world):
+            continue
+        real_world = os.path.realpath(world)
+        for root, dirs, files in os.walk(real_world, followlinks=True):
+            dirs.sort()
+            for name in sorted(files):
+                if name in SKIP_FILES:
+                    continue
+                full_path = os.path.join(root, name)
+                yield os.path.join(os.path.basename(world), os.path.relpath(full_path, real_world)), full_path
+
+
+def backup_file(store, path, chunk_size, stored, lock):
+    # Region files are split into chunk_size pieces, anything else is one piece.  Every piece is hashed and uploaded from
+    # the same read, so a file the server writes to meanwhile can't end up in the bucket under the wrong digest.  stored
+    # holds the digests that are in the bucket already (or being uploaded by another thread).
+    chunks = []
+    with open(path, "rb") as fp:
+        pieces = iter(lambda: fp.read(chunk_size), b"") if path.endswith(".mca") else [fp.read()]
+        for data in pieces:
+            digest = hashlib.sha256(data).hexdigest()
+            chunks.append(digest)
+            with lock:
+                new = digest not in stored
+                stored.add(digest)
+            if new:
+                store.put_chunk(digest, data)
+    return chunks
+
+
+@contextlib.contextmanager
+def saves_paused(server_dir):
+    # save-off and a flush while the world is read, like world_sync.py does.  Nothing to pause if the server isn't running.
+    try:
+        console = rcon.from_server_dir(server_dir)
+        console.command("save-off")
+        console.command("save-all flush")
+    except (OSError, ConnectionError, rcon.RconError):
+        console = None
+    try:
+        yield
+    finally:
+        if console:
+            console.command("save-on")
+            console.close()
+
+
+def backup(store, server_dir=SERVER_DIR, chunk_size=CHUNK_SIZE, workers=WORKERS):
+    started = time.monotonic()
+    previous = store.latest_manifest() or {"files": {}}
+    previous_files = previous["files"] if previous.get("chunk_size") == chunk_size else {}
+
+    # Chunks referenced by the last manifest are already in the bucket, prune never removes those
+    known = set()
+    for entry in previous_files.values():
+        known.update(entry["chunks"])
+
+    files = {}
+    to_hash = []
+    for rel_path, full_path in world_files(server_dir):
+        stat = os.stat(full_path)
+        files[rel_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "mode": stat.st_mode & 0o777}
+        old = previous_files.get(rel_path)
+        if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+            files[rel_path]["chunks"] = old["chunks"]       # Untouched since last backup, no need to even read it
+        else:
+            to_hash.append((rel_path, full_path))
+
+    hashed_bytes = 0
+    stored, lock = set(known), threading.Lock()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        hashed = executor.map(lambda item: backup_file(store, item[1], chunk_size, stored, lock), to_hash)
+        for (rel_path, full_path), chunks in zip(to_hash, hashed):
+            files[rel_path]["chunks"] = chunks
+            hashed_bytes += files[rel_path]["size"]
+
+    name = store.put_manifest({"version": 1,
+                               "created": datetime.now(timezone.utc).isoformat(),
+                               "chunk_size": chunk_size,
+                               "files": files})
+
+    return {"manifest": name,
+            "files": len(files),
+            "total_bytes": sum(f["size"] for f in files.values()),
+            "hashed_bytes": hashed_bytes,
+            "uploaded_chunks": len(stored) - len(known),
+            "uploaded_bytes": store.bytes_uploaded,
+            "seconds": round(time.monotonic() - started, 3)}
+
+
+def spawn_region(level_dat):
+    # level.dat is gzipped NBT.  Rather than parsing all of it we look for the SpawnX / SpawnZ int tags, and turn the
+    # block coordinates into region coordinates (512 blocks per region).
+    try:
+        with gzip.open(level_dat) as fp:
+            data = fp.read()
+    except (OSError, EOFError):
+        return 0, 0
+    region = []
+    for name in (b"SpawnX", b"SpawnZ"):
+        tag = b"\x03" + struct.pack(">H", len(name)) + name
+        at = data.find(tag)
+        region.append(struct.unpack(">i", data[at + len(tag):at + len(tag) + 4])[0] >> 9 if at >= 0 else 0)
+    return tuple(region)
+
+
+def region_order(region_files, overworld, spawn):
+    # Splits region files into the ones around spawn, and the rest sorted nearest first.  The nether and the end come
+    # after the overworld since that's where new players show up.
+    spawn_area, remaining = [], []
+    for rel_path in region_files:
+        x, z = map(int, REGION_NAME.search(rel_path).groups())
+        other_dimension = not rel_path.startswith(overworld + "/") or "/DIM" in rel_path
+        distance = max(abs(x), abs(z)) if other_dimension else max(abs(x - spawn[0]), abs(z - spawn[1]))
+        if not other_dimension and distance <= SPAWN_RADIUS:
+            spawn_area.append(rel_path)
+        else:
+            remaining.append((other_dimension, distance, rel_path))
+    return spawn_area, [rel_path for _, _, rel_path in sorted(remaining)]
+
+
+def restore_file(store, server_dir, rel_path, entry, owner, keep_existing=False):
+    # keep_existing: the server is already up, and a region file it has created since is newer than the backup's
+    target = os.path.join(server_dir, rel_path)
+    if keep_existing and os.path.exists(target):
+        return False
+    with open(target + ".restoring", "wb") as fp:
+        for digest in entry["chunks"]:
+            fp.write(store.get_chunk(digest))
+    os.chmod(target + ".restoring", entry["mode"])
+    if owner:
+        os.chown(target + ".restoring", *owner)
+    # The server may already be running while regions stream in, so files only appear once they are complete
+    if not keep_existing:
+        os.replace(target + ".restoring", target)
+        return True
+    # A link can't replace anything, so a region the server wrote while this one downloaded is left alone too
+    try:
+        os.link(target + ".restoring", target)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(target + ".restoring")
+
+
+def restore_files(store, server_dir, files, paths, owner, workers, keep_existing=False):
+    # The number of files written
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # The pool works through the paths in order, so nearer regions land first
+        return sum(executor.map(lambda rel_path: restore_file(store, server_dir, rel_path, files[rel_path], owner,
+                                                              keep_existing), paths))
+
+
+def restore(store, server_dir=SERVER_DIR, workers=WORKERS, owner=None, when_ready=None):
+    # Restores in three steps: level.dat, player data and the other small files, then the region files around spawn,
+    # then everything else.  when_ready is called after the second step, which is enough for players to join.
+    started = time.monotonic()
+    manifest = store.latest_manifest()
+    if not manifest:
+        return None
+    files = manifest["files"]
+
+    for directory in sorted({os.path.dirname(os.path.join(server_dir, rel_path)) for rel_path in files}):
+        os.makedirs(directory, exist_ok=True)
+        if owner:
+            os.chown(directory, *owner)
+
+    overworld = level_name(server_dir)
+    region_files = [rel_path for rel_path in files if REGION_NAME.search(rel_path)]
+    restore_files(store, server_dir, files, [p for p in files if not REGION_NAME.search(p)], owner, workers)
+    spawn_area, remaining = region_order(region_files, overworld,
+                                         spawn_region(os.path.join(server_dir, overworld, "level.dat")))
+    restore_files(store, server_dir, files, spawn_area, owner, workers)
+
+    ready_seconds = time.monotonic() - started
+    if when_ready:
+        when_ready()
+    # Once when_ready has started the server, it may write a region before it streams in: the server's copy wins
+    skipped = len(remaining) - restore_files(store, server_dir, files, remaining, owner, workers,
+                                             keep_existing=when_ready is not None)
+
+    seconds = time.monotonic() - started
+    return {"files": len(files),
+            "spawn_area_files": len(spawn_area),
+            "kept_server_files": skipped,
+            "downloaded_bytes": store.bytes_downloaded,
+            "ready_seconds": round(ready_seconds, 3),
+            "seconds": round(seconds, 3),
+            "bytes_per_second": round(store.bytes_downloaded / seconds) if seconds else 0}
+
+
+def wait_until_joinable(port, timeout):
+    import mc_instance
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            mc_instance.server_status(port=port)
+            return True
+        except Exception:
+            time.sleep(2)
+    return False
+
+
+def streaming_restore(store, server_dir, workers, owner, service, port):
+    # Starts the service as soon as the spawn area is back, and keeps restoring the rest of the world behind it.
+    # The time until the server answers a status ping is measured from the start of the restore.
+    started = time.monotonic()
+    joinable = {}
+
+    def watch():
+        if wait_until_joinable(port, timeout=1800):
+            joinable["seconds"] = round(time.monotonic() - started, 3)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+
+    def start_service():
+        subprocess.run(["systemctl", "start", service], check=True)
+        watcher.start()
+
+    result = restore(store, server_dir, workers, owner, when_ready=start_service)
+    if result is None:
+        return None
+    watcher.join(timeout=1800)
+    result["time_to_joinable"] = joinable.get("seconds")
+    return result
+
+
+def publish_restore_metrics(result):
+    import mc_instance
+    metrics = [{"MetricName": "restore_throughput", "Value": result["bytes_per_second"], "Unit": "Bytes/Second"}]
+    if result.get("time_to_joinable") is not None:
+        metrics.append({"MetricName": "restore_time_to_joinable", "Value": result["time_to_joinable"],
+                        "Unit": "Seconds"})
+    instance = mc_instance.instance_id()
+    for metric in metrics:
+        metric["Dimensions"] = [{"Name": "InstanceId", "Value": instance}]
+    boto3.client('cloudwatch', region_name=mc_instance.region()).put_metric_data(Namespace="Minecraft",
+                                                                                 MetricData=metrics)
+
+
+def prune(store, min_age=PRUNE_MIN_AGE):
+    # Chunks are shared between snapshots, so they can only go once no manifest references them anymore.  Chunks younger
+    # than min_age are left alone, a backup running right now uploads its chunks before it writes its manifest.
+    referenced = set()
+    for item in store.list_objects("manifests"):
+        if item["Key"].endswith(".json"):
+            manifest = json.loads(store.s3.get_object(Bucket=store.bucket, Key=item["Key"])["Body"].read())
+            for entry in manifest["files"].values():
+                referenced.update(entry["chunks"])
+
+    cutoff = time.time() - min_age
+    unused = [item["Key"] for item in store.list_objects("chunks")
+              if item["Key"].rsplit("/", 1)[-1] not in referenced and item["LastModified"].timestamp() < cutoff]
+    for start in range(0, len(unused), 1000):
+        store.s3.delete_objects(Bucket=store.bucket,
+                                Delete={"Objects": [{"Key": key} for key in unused[start:start + 1000]]})
+    return {"referenced_chunks": len(referenced), "deleted_chunks": len(unused)}
+
+
+def benchmark(store, regions, region_mb, change_percent, chunk_size, workers):
+    # Builds a fake world, backs it up, dirties a share of every region file the way a play session does and backs it
+    # up again.  Point --endpoint-url at a local S3 stand-in (moto_server, minio) to run it without AWS.
+    results = []
+    with tempfile.TemporaryDirectory() as server_dir:
+        region_dir = os.path.join(server_dir, "world", "region")
+        os.makedirs(region_dir)
+        with open(os.path.join(server_dir, "world", "level.dat"), "wb") as fp:
+            fp.write(os.urandom(4096))
+        for index in range(regions):
+            with open(os.path.join(region_dir, f"r.{index}.0.mca"), "wb") as fp:
+                fp.write(os.urandom(region_mb * 1024 * 1024))
+
+        store.bytes_uploaded = 0
+        results.append(dict(run="initial", **backup(store, server_dir, chunk_size, workers)))
+
+        # Players touch the chunks around them, so the rewritten sectors sit together somewhere in each region file
+        sectors = region_mb * 256
+        dirty = max(1, int(sectors * change_percent / 100))
+        for index in range(regions):
+            with open(os.path.join(region_dir, f"r.{index}.0.mca"), "r+b") as fp:
+                fp.seek(random.randrange(sectors - dirty + 1) * 4096)
+                fp.write(os.urandom(dirty * 4096))
+        store.bytes_uploaded = 0
+        results.append(dict(run="incremental", **backup(store, server_dir, chunk_size, workers)))
+
+        store.bytes_uploaded = 0
+        results.append(dict(run="unchanged", **backup(store, server_dir, chunk_size, workers)))
+    return results
+
+
+def default_location():
+    import mc_instance
+    instance_tags = mc_instance.tags()
+    return mc_instance.bucket_from_url(instance_tags["s3_backup_url"]), instance_tags.get("dns_hostname", "minecraft")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental minecraft world backups")
+    parser.add_argument("command", choices=["backup", "restore", "exists", "prune", "benchmark"])
+    parser.add_argument("--bucket", help="Defaults to the bucket in the s3_backup_url tag")
+    parser.add_argument("--prefix", help="Defaults to the dns_hostname tag")
+    parser.add_argument("--server-dir", default=SERVER_DIR)
+    parser.add_argument("--endpoint-url", help="Use a local S3 stand-in instead of AWS")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--owner", help="restore: user that should own the restored files")
+    parser.add_argument("--start-service", help="restore: systemd unit to start once players can join")
+    parser.add_argument("--port", type=int, default=25565, help="restore: port to check for joinability")
+    parser.add_argument("--metrics", action="store_true", help="restore: publish restore metrics to cloudwatch")
+    parser.add_argument("--regions", type=int, default=32, help="benchmark: number of region files")
+    parser.add_argument("--region-mb", type=int, default=8, help="benchmark: size of each region file")
+    parser.add_argument("--change-percent", type=float, default=5, help="benchmark: share of sectors to rewrite")
+    args = parser.parse_args()
+
+    if args.bucket:
+        bucket, prefix = args.bucket, args.prefix or "minecraft"
+    else:
+        bucket, prefix = default_location()
+        prefix = args.prefix or prefix
+    # Other worlds on the same instance back up next to the main one, under <dns_hostname>/<world>
+    world = os.path.basename(os.path.normpath(args.server_dir))
+    if world != "server" and not args.prefix:
+        prefix = f"{prefix}/{world}"
+    if args.command == "benchmark":
+        prefix = f"benchmark-{int(time.time())}"
+    store = ChunkStore(bucket, prefix, endpoint_url=args.endpoint_url)
+
+    if args.command == "backup":
+        with saves_paused(args.server_dir):
+            result = backup(store, args.server_dir, chunk_size=args.chunk_size, workers=args.workers)
+    elif args.command == "exists":
+        return 0 if store.latest_manifest() else 1
+    elif args.command == "restore":
+        owner = pwd.getpwnam(args.owner)[2:4] if args.owner else None
+        if args.start_service:
+            result = streaming_restore(store, args.server_dir, args.workers, owner, args.start_service, args.port)
+        else:
+            result = restore(store, args.server_dir, args.workers, owner)
+        if result is None:
+            print("No backup found for " + store.prefix)
+            return 1
+        if args.metrics:
+            publish_restore_metrics(result)
+    elif args.command == "prune":
+        result = prune(store)
+    else:
+        result = benchmark(store, args.regions, args.region_mb, args.change_percent, args.chunk_size, args.workers)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
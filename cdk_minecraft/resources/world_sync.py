@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+# Keeps the worlds on a fast tier (instance store NVMe or tmpfs) and copies them back to the EBS world volume.
+#
+# With worldFastTier set, the world folders in the server directory are symlinks into /mnt/minecraft_fast, and the
+# copy that survives a stop lives on EBS in /opt/minecraft/persist/<server>.  Instance store and tmpfs are empty after
+# every stop/start, so:
+#   hydrate   at boot, before the server starts: copy the persisted worlds onto the fast tier and set up the symlinks.
+#             Only once every world is copied does it leave a .hydrated marker on the fast tier; minecraft@.service
+#             requires minecraft-fast-tier.service, so a failed hydrate (a full tmpfs, say) keeps the server from starting
+#   sync      on a timer and after the server stops: copy changed files back to EBS, throttled so the server doesn't
+#             notice, and checksummed so a half copied file never replaces a good one.  Without the marker the fast tier
+#             isn't a full copy of the world, so sync refuses to run rather than delete what's missing from EBS
+#   bench     read every region file the way the server loads chunks, to compare disks before/after a change
+#
+# Usage:
+#   world_sync.py hydrate|sync [--server-dir /opt/minecraft/server] [--rate-mbps 50]
+#   world_sync.py hydrate --all         every server under /opt/minecraft
+#   world_sync.py bench [--server-dir /opt/minecraft/server]
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import time
+
+import rcon
+
+MINECRAFT_HOME = "/opt/minecraft"
+FAST_DIR = "/mnt/minecraft_fast"
+PERSIST_DIR = "/opt/minecraft/persist"
+BLOCK_SIZE = 1024 * 1024
+SKIP_FILES = {"session.lock"}
+HYDRATED_MARKER = ".hydrated"
+
+
+class NotHydrated(RuntimeError):
+    pass
+
+
+def world_names(server_dir):
+    try:
+        level = rcon.server_properties(server_dir).get("level-name") or "world"
+    except FileNotFoundError:
+        level = "world"
+    return [level, level + "_nether", level + "_the_end"]
+
+
+def tier_paths(server_dir):
+    server = os.path.basename(os.path.normpath(server_dir))
+    return os.path.join(FAST_DIR, server), os.path.join(PERSIST_DIR, server)
+
+
+def same_file(source, target):
+    try:
+        source_stat, target_stat = os.stat(source), os.stat(target)
+    except FileNotFoundError:
+        return False
+    return source_stat.st_size == target_stat.st_size and source_stat.st_mtime_ns == target_stat.st_mtime_ns
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_file(source, target, rate):
+    # Copies at no more than rate bytes/second, then reads the copy back and compares checksums before it replaces
+    # the old version.  Returns the bytes copied.
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    digest = hashlib.sha256()
+    copied = 0
+    started = time.monotonic()
+    with open(source, "rb") as src, open(target + ".sync", "wb") as dst:
+        for block in iter(lambda: src.read(BLOCK_SIZE), b""):
+            digest.update(block)
+            dst.write(block)
+            copied += len(block)
+            if rate:
+                ahead = copied / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        dst.flush()
+        os.fsync(dst.fileno())
+    if file_hash(target + ".sync") != digest.hexdigest():
+        os.remove(target + ".sync")
+        raise IOError("Checksum mismatch copying " + source)
+    shutil.copystat(source, target + ".sync")
+    os.replace(target + ".sync", target)
+    return copied
+
+
+def mirror(source_root, target_root, rate=0):
+    # Makes target_root match source_root, only copying files whose size or modification time changed
+    os.makedirs(target_root, exist_ok=True)
+    copied = files = 0
+    seen = set()
+    for root, dirs, names in os.walk(source_root):
+        for name in names:
+            if name in SKIP_FILES or name.endswith(".sync"):
+                continue
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, os.path.relpath(source, source_root))
+            seen.add(target)
+            if not same_file(source, target):
+                try:
+                    copied += copy_file(source, target, rate)
+                    files += 1
+                except FileNotFoundError:
+                    pass        # The server removed it while we were copying
+    for root, dirs, names in os.walk(target_root):
+        for name in names:
+            if os.path.join(root, name) not in seen:
+                os.remove(os.path.join(root, name))
+    return files, copied
+
+
+def hydrated(server_dir):
+    return os.path.exists(os.path.join(tier_paths(server_dir)[0], HYDRATED_MARKER))
+
+
+def hydrate(server_dir):
+    # Returns False when the fast tier already holds the worlds: instance store survives a reboot, and configure.sh
+    # hydrates before the server's first start.  Either way what's there is newer than EBS.
+    if hydrated(server_dir):
+        return False
+    fast, persist = tier_paths(server_dir)
+    for world in world_names(server_dir):
+        link = os.path.join(server_dir, world)
+        if os.path.isdir(link) and not os.path.islink(link):
+            # First boot: a world restored straight into the server directory becomes the persisted copy
+            os.makedirs(persist, exist_ok=True)
+            shutil.move(link, os.path.join(persist, world))
+        os.makedirs(os.path.join(persist, world), exist_ok=True)
+        mirror(os.path.join(persist, world), os.path.join(fast, world))
+        if not os.path.islink(link):
+            os.symlink(os.path.join(fast, world), link)
+    # This runs as root, the copies belong to whoever owns the server
+    owner = os.stat(server_dir)
+    for top in (fast, persist):
+        os.chown(top, owner.st_uid, owner.st_gid)
+        for root, dirs, names in os.walk(top):
+            for name in dirs + names:
+                os.lchown(os.path.join(root, name), owner.st_uid, owner.st_gid)
+    # Last, so it's only there once everything above worked
+    with open(os.path.join(fast, HYDRATED_MARKER), "w"):
+        pass
+    return True
+
+
+def sync(server_dir, rate):
+    if not hydrated(server_dir):
+        raise NotHydrated(f"{server_dir} was never fully copied to the fast tier, not touching the copy on EBS")
+    fast, persist = tier_paths(server_dir)
+    # Hold off autosaves while we copy, so region files don't change under us.  If the server isn't running (this also
+    # runs after it stops) there's nothing to pause.
+    console = None
+    try:
+        console = rcon.from_server_dir(server_dir)
+        console.command("save-off")
+        console.command("save-all flush")
+    except (OSError, ConnectionError, rcon.RconError):
+        console = None
+    try:
+        results = {world: mirror(os.path.join(fast, world), os.path.join(persist, world), rate)
+                   for world in world_names(server_dir) if os.path.isdir(os.path.join(fast, world))}
+    finally:
+        if console:
+            console.command("save-on")
+            console.close()
+    return {world: {"files": files, "bytes": copied} for world, (files, copied) in results.items()}
+
+
+def bench(server_dir):
+    # Loads every chunk of every region file like the server does: read the 4k location table, then each chunk at its
+    # sector offset, in a shuffled order since players don't load regions front to back.
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as fp:
+            fp.write("3\n")             # Start cold, otherwise the second run just measures the page cache
+    except OSError:
+        print("Not running as root, the page cache may already hold some of the world", file=sys.stderr)
+    regions = [path for world in world_names(server_dir)
+               for path in glob.glob(os.path.join(server_dir, world, "**", "*.mca"), recursive=True)]
+    chunks = read = 0
+    started = time.monotonic()
+    for path in regions:
+        with open(path, "rb") as fp:
+            header = fp.read(4096)
+            offsets = [struct.unpack(">I", header[i:i + 4])[0] for i in range(0, len(header) - 3, 4)]
+            offsets = [entry for entry in offsets if entry]
+            random.shuffle(offsets)
+            for entry in offsets:
+                fp.seek((entry >> 8) * 4096)
+                read += len(fp.read((entry & 0xFF) * 4096))
+                chunks += 1
+    seconds = time.monotonic() - started
+    return {"regions": len(regions), "chunks": chunks, "bytes": read, "seconds": round(seconds, 3),
+            "chunks_per_second": round(chunks / seconds) if seconds else 0,
+            "mb_per_second": round(read / 1024 ** 2 / seconds, 1) if seconds else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move minecraft worlds between the fast tier and EBS")
+    parser.add_argument("command", choices=["hydrate", "sync", "bench"])
+    parser.add_argument("--server-dir", default=rcon.SERVER_DIR)
+    parser.add_argument("--all", action="store_true", help="hydrate: every server under " + MINECRAFT_HOME)
+    parser.add_argument("--rate-mbps", type=float, default=50, help="sync: throttle copies to this many MB/s")
+    args = parser.parse_args()
+
+    if args.command == "hydrate":
+        server_dirs = [args.server_dir]
+        if args.all:
+            server_dirs = [os.path.dirname(path) for path in glob.glob(os.path.join(MINECRAFT_HOME, "*", "server.properties"))]
+        for server_dir in server_dirs:
+            hydrate(server_dir)
+    elif args.command == "sync":
+        try:
+            print(json.dumps(sync(args.server_dir, int(args.rate_mbps * 1024 * 1024))))
+        except NotHydrated as error:
+            print(error, file=sys.stderr)
+            return 1
+    else:
+        print(json.dumps(bench(args.server_dir), indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
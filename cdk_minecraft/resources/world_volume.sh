@@ -0,0 +1,29 @@
+#!/bin/bash
+# Mounts the world volume the stack attaches at /opt/minecraft, and the fast tier (instance store or tmpfs) at
+#   /mnt/minecraft_fast when worldFastTier is set.  configure.sh runs this on the first boot, minecraft-fast-tier.service on
+#   every boot after that, since instance store and tmpfs come back empty after a stop.
+source /etc/minecraft/world_volume.conf
+
+# The world volume, formatted the first time only.  On nitro instances /dev/sdf is a link to the nvme device.
+if [ -e /dev/sdf ] && ! mountpoint -q /opt/minecraft; then
+    blkid /dev/sdf || mkfs.xfs /dev/sdf
+    WORLD_UUID=$(blkid -s UUID -o value /dev/sdf)
+    grep -q "$WORLD_UUID" /etc/fstab || echo "UUID=$WORLD_UUID /opt/minecraft xfs defaults,noatime,nofail 0 2" >> /etc/fstab
+    mkdir -p /opt/minecraft
+    mount /opt/minecraft
+fi
+
+mkdir -p /mnt/minecraft_fast
+case "$WORLD_FAST_TIER" in
+    instance-store)
+        # The first local NVMe disk, EBS volumes show up with a different model name
+        FAST_DEVICE=$(lsblk -dpno NAME,MODEL | awk '/Instance Storage/ {print $1; exit}')
+        if [ -n "$FAST_DEVICE" ] && ! mountpoint -q /mnt/minecraft_fast; then
+            blkid $FAST_DEVICE || mkfs.xfs $FAST_DEVICE
+            mount -o noatime $FAST_DEVICE /mnt/minecraft_fast
+        fi
+        ;;
+    tmpfs)
+        mountpoint -q /mnt/minecraft_fast || mount -t tmpfs -o size=${WORLD_TMPFS_MIB}m,mode=755 tmpfs /mnt/minecraft_fast
+        ;;
+esac
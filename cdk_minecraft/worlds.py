@@ -0,0 +1,64 @@
+import json
+import re
+
+# Several minecraft@<name> servers can share one instance, listed under "worlds" in cdk.json:
+#   "worlds": [{"name": "server"},
+#              {"name": "creative", "port": 25566, "memoryShare": 0.25, "cpuWeight": 0.5, "idleMinutes": 5}]
+# Every world gets its own port, a slice of the instance's memory and CPU (enforced by systemd), its own backups and its
+# own idle policy.  The instance only shuts down when every world is idle.  Left out, there is one world called server,
+# which is how this stack always worked.
+
+DEFAULT_WORLDS = [{"name": "server"}]
+FIRST_PORT = 25565
+RCON_PORT_OFFSET = 10           # world on 25566 gets RCON on 25576, which the security group doesn't open
+NAME = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+
+
+def world_settings(worlds=None, idle_minutes=15, min_players=1):
+    # Fills in the defaults for each world.  Memory not handed out explicitly is split evenly between the rest.
+    worlds = worlds or DEFAULT_WORLDS
+    names = [world.get("name") for world in worlds]
+    if len(set(names)) != len(names) or not all(name and NAME.match(name) for name in names):
+        raise ValueError("Every world needs a unique name made of lowercase letters, numbers, - and _")
+    if "server" not in names:
+        raise ValueError("One of the worlds has to be called server, DNS, the startup URL and the old backups all use it")
+    claimed = sum(world.get("memoryShare", 0) for world in worlds)
+    unclaimed = [world for world in worlds if "memoryShare" not in world]
+    if claimed > 1 or (unclaimed and claimed >= 1):
+        raise ValueError("The memoryShare of the worlds adds up to more than 1")
+
+    # server keeps 25565 wherever it's listed, the startup URL, the wake proxy and the security group all expect it there.
+    # The others count up from the next port in the order they're listed.
+    if next(world for world in worlds if world["name"] == "server").get("port", FIRST_PORT) != FIRST_PORT:
+        raise ValueError(f"The server world has to stay on port {FIRST_PORT}")
+    other_ports = iter(range(FIRST_PORT + 1, FIRST_PORT + len(worlds)))
+
+    settings = []
+    for world in worlds:
+        port = FIRST_PORT if world["name"] == "server" else world.get("port") or next(other_ports)
+        settings.append({"name": world["name"],
+                         "port": port,
+                         "rcon_port": port + RCON_PORT_OFFSET,
+                         "memory_share": world.get("memoryShare", (1 - claimed) / len(unclaimed) if unclaimed else 0),
+                         "cpu_weight": world.get("cpuWeight", 1),
+                         "idle_minutes": world.get("idleMinutes", idle_minutes),
+                         "min_players": world.get("minPlayers", min_players)})
+    ports = [world["port"] for world in settings] + [world["rcon_port"] for world in settings]
+    if len(set(ports)) != len(ports):
+        raise ValueError("Two worlds are using the same port (RCON takes the world's port + 10)")
+    return settings
+
+
+def resource_dropin(world, memory_mib):
+    # systemd drop-in for minecraft@<name>.  Amazon Linux 2 runs systemd 219 on cgroup v1, which has CPUShares and
+    # MemoryLimit rather than CPUWeight and MemoryMax.
+    return ("[Service]\n"
+            "CPUAccounting=true\n"
+            f"CPUShares={int(1024 * world['cpu_weight'])}\n"
+            "MemoryAccounting=true\n"
+            f"MemoryLimit={memory_mib}M\n")
+
+
+def worlds_file(settings):
+    # /etc/minecraft/worlds.json, read by configure.sh and idle_watchdog.py
+    return json.dumps(settings, indent=2) + "\n"
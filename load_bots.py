@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# Puts a crowd of bots on a server and records how it copes, to pick InstanceType and jvmProfile with numbers instead
+# of guesswork.
+#
+# Each bot is a bare protocol client (no rendering, a few KB of memory) that logs in with an offline-mode name, gets
+# switched to creative over RCON so it can fly without being kicked, and then follows a pattern:
+#   explore   flies off in a straight line at sprint-flying speed, so the server has to generate new chunks
+#   wander    circles around spawn at walking speed, in chunks that already exist
+#   idle      stands still
+# All of them chat every so often.  Meanwhile tps and mspt are read over RCON and the CPU and memory of the java
+# process from /proc, so this has to run on the same machine as the server (on the instance, or a local server in CI),
+# with online-mode=false and RCON on.
+#
+# Every run writes a JSON result, and report puts any number of them side by side.  With --fail-mspt the run exits
+# non-zero when p95 mspt goes over it, for regression runs.
+#
+# Usage:
+#   load_bots.py run --bots 20 --minutes 10 [--patterns explore,wander,idle] [--label t3a.large-g1] [--out result.json]
+#   load_bots.py report result1.json result2.json ...
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+
+from mc_protocol import handshake, packet, parse_varint, read_varint, string, varint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cdk_minecraft", "resources"))
+import rcon                                             # noqa: E402
+from tick_metrics import parse_mspt, parse_tps          # noqa: E402
+
+# Packet ids change between versions, these are for 1.17.x (imageMinecraftVersion).  Serverbound ids end in _out.
+PROTOCOLS = {756: {"disconnect": 0x1A, "keep_alive": 0x21, "position": 0x38,
+                   "teleport_confirm_out": 0x00, "chat_out": 0x03, "settings_out": 0x05, "keep_alive_out": 0x0F,
+                   "position_out": 0x11}}
+PROTOCOLS[755] = PROTOCOLS[756]
+
+TICK = 0.05
+SPEEDS = {"explore": 20, "wander": 4.3, "idle": 0}     # blocks per second
+CRUISE_HEIGHT = 200         # explorers fly above everything, there's no collision checking in here
+WANDER_RADIUS = 96
+CHAT_LINES = ["anyone seen my pickaxe?", "heading north", "brb", "found a village!", "nice base", "lag?", "gg"]
+
+log = logging.getLogger("load_bots")
+
+
+async def read_packet(reader, threshold, wanted=None):
+    # Returns (packet id, payload).  Chunk data is most of what comes in, so compressed packets only get unpacked far
+    # enough for the id unless it's in wanted (None is all of them).  Payloads we don't want come back empty.
+    length = await read_varint(reader.readexactly)
+    data = await reader.readexactly(length)
+    if threshold < 0:
+        packet_id, offset = parse_varint(data, 0)
+        return packet_id, data[offset:]
+    data_length, offset = parse_varint(data, 0)
+    if data_length == 0:
+        packet_id, offset = parse_varint(data, offset)
+        return packet_id, data[offset:]
+    inflater = zlib.decompressobj()
+    head = inflater.decompress(data[offset:], 5)
+    packet_id, id_length = parse_varint(head, 0)
+    if wanted is not None and packet_id not in wanted:
+        return packet_id, b""
+    return packet_id, (head + inflater.decompress(inflater.unconsumed_tail))[id_length:]
+
+
+class Bot:
+
+    def __init__(self, name, pattern, protocol, rng):
+        self.name = name
+        self.pattern = pattern
+        self.protocol = protocol
+        self.ids = PROTOCOLS[protocol]
+        self.rng = rng
+        self.writer = None
+        self.threshold = -1
+        self.position = None
+        self.joined = asyncio.Event()
+        self.kicked = None
+        self.packets = 0
+
+    def send(self, packet_id, payload=b""):
+        body = varint(packet_id) + payload
+        if self.threshold >= 0:
+            # Everything we send is small enough to go uncompressed, which is a data length of 0
+            body = varint(0) + body
+        self.writer.write(varint(len(body)) + body)
+
+    async def login(self, host, port):
+        reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(handshake(self.protocol, host, port, 2))
+        self.writer.write(packet(0x00, string(self.name)))
+        while True:
+            packet_id, payload = await read_packet(reader, self.threshold)
+            if packet_id == 0x00:
+                raise ConnectionError(f"{self.name} was refused: {payload[1:].decode(errors='replace')}")
+            if packet_id == 0x01:
+                raise ConnectionError("The server is in online mode, set online-mode=false to use bots")
+            if packet_id == 0x03:
+                self.threshold = parse_varint(payload, 0)[0]
+            if packet_id == 0x02:
+                break
+        # locale, view distance, chat mode, chat colors, skin parts, main hand, text filtering
+        self.send(self.ids["settings_out"], string("en_us") + bytes([10]) + varint(0) + b"\x01\x7f" + varint(1) + b"\x00")
+        return reader
+
+    async def listen(self, reader):
+        wanted = {self.ids["keep_alive"], self.ids["position"], self.ids["disconnect"]}
+        while True:
+            try:
+                packet_id, payload = await read_packet(reader, self.threshold, wanted)
+            except (OSError, asyncio.IncompleteReadError):
+                self.kicked = self.kicked or "Connection lost"
+                return
+            self.packets += 1
+            if packet_id == self.ids["keep_alive"]:
+                self.send(self.ids["keep_alive_out"], payload[:8])
+            elif packet_id == self.ids["position"]:
+                # The server placed us (at spawn, or back where it wants us).  Relative flags are ignored, servers
+                # only use them for plugin teleports.
+                x, y, z = struct.unpack(">ddd", payload[:24])
+                teleport_id = parse_varint(payload, 33)[0]
+                self.send(self.ids["teleport_confirm_out"], varint(teleport_id))
+                self.position = [x, y, z]
+                self.joined.set()
+            elif packet_id == self.ids["disconnect"]:
+                self.kicked = payload[1:].decode(errors="replace")
+                return
+
+    async def move(self, until):
+        await self.joined.wait()
+        spawn = list(self.position)
+        heading = self.rng.uniform(0, 6.283)
+        next_chat = time.monotonic() + self.rng.uniform(10, 60)
+        step = SPEEDS[self.pattern] * TICK
+        angle = self.rng.uniform(0, 6.283)
+        radius = 0
+        while time.monotonic() < until and not self.kicked:
+            x, y, z = self.position
+            if self.pattern == "explore":
+                if self.rng.random() < TICK / 60:
+                    heading += self.rng.uniform(-1, 1)
+                x, z = x + step * math.cos(heading), z + step * math.sin(heading)
+                y = min(CRUISE_HEIGHT, y + step)
+            elif self.pattern == "wander":
+                # Out from spawn and then round in a circle, a step at a time so the server doesn't call it cheating
+                radius = min(WANDER_RADIUS, radius + step)
+                angle += step / WANDER_RADIUS
+                x, z = spawn[0] + radius * math.cos(angle), spawn[2] + radius * math.sin(angle)
+                y = min(spawn[1] + 20, y + step)
+            if step:
+                self.position = [x, y, z]
+                self.send(self.ids["position_out"], struct.pack(">ddd?", x, y, z, False))
+            if time.monotonic() > next_chat:
+                self.send(self.ids["chat_out"], string(self.rng.choice(CHAT_LINES)))
+                next_chat = time.monotonic() + self.rng.uniform(30, 120)
+            await self.writer.drain()
+            await asyncio.sleep(TICK)
+
+    async def run(self, host, port, until):
+        try:
+            reader = await self.login(host, port)
+            listener = asyncio.ensure_future(self.listen(reader))
+            await self.move(until)
+            listener.cancel()
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            self.kicked = self.kicked or str(e) or type(e).__name__
+        finally:
+            if self.writer:
+                self.writer.close()
+
+
+###############
+# Measuring
+###############
+
+def java_process():
+    # The pid and command line of the minecraft server, the java process with -jar in its arguments
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as fp:
+                args = fp.read().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        if args and args[0].endswith("java") and "-jar" in args:
+            return int(pid), args
+    return None, []
+
+
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as fp:
+        fields = fp.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss_mib(pid):
+    with open(f"/proc/{pid}/status") as fp:
+        for line in fp:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def instance_type():
+    # The EC2 instance type when there is one, so results from different instances can be told apart
+    import urllib.request
+    try:
+        return urllib.request.urlopen("http://169.254.169.254/latest/meta-data/instance-type", timeout=1).read().decode()
+    except OSError:
+        return None
+
+
+async def sample(console, pid, bots, started, until, interval, samples):
+    loop = asyncio.get_running_loop()
+    last_cpu, last_time = process_cpu_seconds(pid), time.monotonic()
+    while time.monotonic() < until:
+        await asyncio.sleep(interval)
+        mspt = parse_mspt(await loop.run_in_executor(None, console.command, "mspt"))
+        tps = parse_tps(await loop.run_in_executor(None, console.command, "tps"))
+        cpu, now = process_cpu_seconds(pid), time.monotonic()
+        rss = process_rss_mib(pid)      # None for a kernel thread, or when /proc doesn't say
+        samples.append({"seconds": round(now - started, 1),
+                        "bots": sum(1 for bot in bots if bot.joined.is_set() and not bot.kicked),
+                        "mspt": mspt[0] if mspt else None,
+                        "mspt_max": mspt[1] if mspt else None,
+                        "tps": tps,
+                        "cpu_percent": round(100 * (cpu - last_cpu) / (now - last_time), 1),
+                        "rss_mib": round(rss) if rss is not None else None})
+        last_cpu, last_time = cpu, now
+
+
+async def creative(console, bots):
+    # Flying in survival gets a bot kicked within seconds, so each one is switched as soon as it's in
+    loop = asyncio.get_running_loop()
+    for bot in bots:
+        await bot.joined.wait()
+        await loop.run_in_executor(None, console.command, f"gamemode creative {bot.name}")
+
+
+async def load(args):
+    pid, java_args = java_process()
+    if not pid:
+        raise SystemExit("No minecraft server running on this machine")
+    console = rcon.from_server_dir(args.server_dir)
+    rng = random.Random(args.seed)
+    patterns = args.patterns.split(",")
+    bots = [Bot(f"bot{n:03d}", patterns[n % len(patterns)], args.protocol, random.Random(rng.random()))
+            for n in range(args.bots)]
+    started = time.monotonic()
+    until = started + args.ramp * len(bots) + args.minutes * 60
+    samples = []
+    sampler = asyncio.ensure_future(sample(console, pid, bots, started, until, args.sample_seconds, samples))
+    switcher = asyncio.ensure_future(creative(console, bots))
+    tasks = []
+    for bot in bots:
+        tasks.append(asyncio.ensure_future(bot.run(args.host, args.port, until)))
+        await asyncio.sleep(args.ramp)
+    await asyncio.gather(*tasks)
+    await sampler
+    switcher.cancel()
+    for bot in bots:
+        console.command(f"kick {bot.name}")
+    console.close()
+
+    # Only the samples with every bot on count, the ramp up would flatter the numbers
+    full = [s for s in samples if s["bots"] == len(bots) and s["mspt"] is not None] or samples
+    return {"label": args.label or instance_type() or "local",
+            "instance_type": instance_type(),
+            "jvm": [arg for arg in java_args if arg.startswith("-X")],
+            "bots": args.bots, "patterns": patterns, "minutes": args.minutes,
+            "summary": summarize(full),
+            "kicked": {bot.name: bot.kicked for bot in bots if bot.kicked},
+            "samples": samples}
+
+
+def percentile(values, fraction):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(samples):
+    column = {key: [s[key] for s in samples] for key in ("mspt", "mspt_max", "tps", "cpu_percent", "rss_mib")}
+    return {"mspt_p50": percentile(column["mspt"], 0.5),
+            "mspt_p95": percentile(column["mspt"], 0.95),
+            "mspt_max": percentile(column["mspt_max"], 1),
+            "tps_p5": percentile(column["tps"], 0.05),
+            "cpu_percent_avg": round(sum(column["cpu_percent"]) / len(samples), 1) if samples else None,
+            "cpu_percent_p95": percentile(column["cpu_percent"], 0.95),
+            "rss_mib_max": percentile(column["rss_mib"], 1)}
+
+
+def report(paths):
+    # One row per result, as a markdown table
+    columns = ["label", "bots", "mspt_p50", "mspt_p95", "mspt_max", "tps_p5", "cpu_percent_avg", "cpu_percent_p95",
+               "rss_mib_max", "kicked", "jvm"]
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for path in paths:
+        with open(path) as fp:
+            result = json.load(fp)
+        row = dict(result["summary"], label=result["label"], bots=result["bots"], kicked=len(result["kicked"]),
+                   jvm=" ".join(result["jvm"]))
+        lines.append("| " + " | ".join("" if row[key] is None else str(row[key]) for key in columns) + " |")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a minecraft server with bots and measure how it copes")
+    parser.add_argument("command", choices=["run", "report"])
+    parser.add_argument("results", nargs="*", help="report: result files from earlier runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("--server-dir", default=rcon.SERVER_DIR, help="where server.properties is, for RCON")
+    parser.add_argument("--protocol", type=int, default=756, choices=sorted(PROTOCOLS))
+    parser.add_argument("--bots", type=int, default=10)
+    parser.add_argument("--patterns", default="explore,wander,idle", help="handed out to the bots in turn")
+    parser.add_argument("--minutes", type=float, default=10, help="how long to hold the load once every bot is in")
+    parser.add_argument("--ramp", type=float, default=2, help="seconds between bots joining")
+    parser.add_argument("--sample-seconds", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", help="name for this run in the report, the instance type by default")
+    parser.add_argument("--out", help="run: write the result here")
+    parser.add_argument("--fail-mspt", type=float, help="run: exit with 1 when p95 mspt is over this")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "report":
+        print(report(args.results))
+        return 0
+    for pattern in args.patterns.split(","):
+        if pattern not in SPEEDS:
+            parser.error(f"Unknown pattern {pattern}, use {', '.join(SPEEDS)}")
+    result = asyncio.run(load(args))
+    if args.out:
+        with open(args.out, "w") as fp:
+            json.dump(result, fp, indent=2)
+    print(json.dumps(dict(result, samples=len(result["samples"])), indent=2))
+    if args.fail_mspt and (result["summary"]["mspt_p95"] or 0) > args.fail_mspt:
+        log.info("p95 mspt %s is over %s", result["summary"]["mspt_p95"], args.fail_mspt)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
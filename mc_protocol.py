@@ -0,0 +1,66 @@
+# Minecraft protocol framing shared by wake_proxy.py and load_bots.py: varints, strings, length-prefixed packets and
+# the handshake.  Nothing in here talks to AWS, so the load generator and the tests can import it anywhere.
+#
+# Packets on the wire are a varint length followed by the body, the body being a varint packet id and the payload
+# (before compression is switched on, which only load_bots.py has to care about).
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def string(value):
+    data = value.encode()
+    return varint(len(data)) + data
+
+
+def packet(packet_id, payload=b""):
+    body = varint(packet_id) + payload
+    return varint(len(body)) + body
+
+
+def parse_varint(data, offset):
+    # Returns (value, offset just past it)
+    value = 0
+    for position in range(5):
+        byte = data[offset + position]
+        value |= (byte & 0x7F) << (7 * position)
+        if not byte & 0x80:
+            return value, offset + position + 1
+    raise ValueError("VarInt too long")
+
+
+async def read_varint(read_exactly):
+    # read_exactly(size) is a coroutine returning exactly size bytes, like StreamReader.readexactly
+    value = 0
+    for position in range(5):
+        byte = (await read_exactly(1))[0]
+        value |= (byte & 0x7F) << (7 * position)
+        if not byte & 0x80:
+            return value
+    raise ValueError("VarInt too long")
+
+
+def handshake(protocol, host, port, next_state):
+    address = host.encode()
+    return packet(0x00, varint(protocol) + varint(len(address)) + address + port.to_bytes(2, "big") + varint(next_state))
+
+
+def parse_handshake(data):
+    # Handshake packet: id 0x00, protocol version, server address, port, next state (1 status, 2 login)
+    packet_id, offset = parse_varint(data, 0)
+    if packet_id != 0:
+        raise ValueError("Expected a handshake")
+    protocol, offset = parse_varint(data, offset)
+    length, offset = parse_varint(data, offset)
+    offset += length + 2
+    next_state, offset = parse_varint(data, offset)
+    return protocol, next_state
@@ -0,0 +1,154 @@
+import hmac
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import uuid
+
+import boto3
+import botocore
+
+ec2 = boto3.client('ec2')
+
+CACHE_SECONDS = 10          # How long a looked up instance state is trusted, so a bookmark being hammered doesn't hammer EC2
+BOOT_SECONDS = int(os.environ.get('BOOT_SECONDS', 150))    # Rough time from "start" until players can join
+TRACE_TAG = 'boot_trace'    # boot_trace.py on the server follows the start from here to joinable under this id
+DNS_TAG = 'dns_record'      # dns_updater.py on the server says here which IP the DNS name has, once Route53 has it everywhere
+WAIT_SECONDS = 25           # API Gateway gives up after 29 seconds, so the long poll has to answer before that
+MINECRAFT_PORT = 25565
+
+# Lambda keeps this around between invocations while the container is warm
+_instance_cache = {}
+
+
+def describe_instance(instance_id, max_age=CACHE_SECONDS):
+    cached = _instance_cache.get(instance_id)
+    if cached and time.time() - cached['fetched'] < max_age:
+        return cached
+
+    instance = ec2.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+    tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+    try:
+        dns = json.loads(tags.get(DNS_TAG, '{}'))
+    except ValueError:
+        dns = {}
+    cached = {'state': instance['State']['Name'],
+              'public_ip': instance.get('PublicIpAddress'),
+              'dns': dns,
+              'launch_time': instance['LaunchTime'].timestamp(),
+              'fetched': time.time()}
+    _instance_cache[instance_id] = cached
+    return cached
+
+
+def varint(value):
+    out = b""
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out += bytes([byte | 0x80])
+        else:
+            return out + bytes([byte])
+
+
+def read_varint(sock):
+    value = 0
+    for position in range(5):
+        byte = sock.recv(1)
+        if not byte:
+            raise ConnectionError("Connection closed")
+        value |= (byte[0] & 0x7F) << (7 * position)
+        if not byte[0] & 0x80:
+            return value
+    raise ValueError("VarInt too long")
+
+
+def server_answers(host, port=MINECRAFT_PORT, timeout=2):
+    # Sends a server list ping (handshake + status request) and checks that a status response comes back
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            address = host.encode()
+            handshake = b"\x00" + varint(47) + varint(len(address)) + address + struct.pack(">H", port) + varint(1)
+            sock.sendall(varint(len(handshake)) + handshake + varint(1) + b"\x00")
+            read_varint(sock)
+            return read_varint(sock) == 0
+    except (OSError, ValueError):
+        return False
+
+
+def eta_seconds(instance, joinable):
+    if joinable:
+        return 0
+    if instance['state'] in ('pending', 'running'):
+        return max(5, int(BOOT_SECONDS - (time.time() - instance['launch_time'])))
+    return BOOT_SECONDS
+
+
+def start_server(instance_id):
+    # Starts the instance if it is stopped.  Returns the http status code, a message and what we know about the instance.
+    instance = describe_instance(instance_id)
+    if instance['state'] == 'stopped':
+        trace_id = uuid.uuid4().hex[:16]
+        ec2.create_tags(Resources=[instance_id],
+                        Tags=[{'Key': TRACE_TAG, 'Value': json.dumps({'id': trace_id, 'requested': round(time.time(), 3)})}])
+        ec2.start_instances(InstanceIds=[instance_id])
+        instance = dict(instance, state='pending', public_ip=None, launch_time=time.time(), fetched=time.time(),
+                        trace_id=trace_id)
+        _instance_cache[instance_id] = instance
+        return 200, 'Server is starting', instance
+    if instance['state'] == 'pending':
+        return 200, 'Server is already starting', instance
+    if instance['state'] == 'running':
+        return 200, 'Server is running', instance
+    if instance['state'] in ('stopping', 'shutting-down'):
+        return 409, 'Server is still shutting down, try again in a minute', instance
+    return 409, 'Server can not be started while it is ' + instance['state'], instance
+
+
+def wait_until_joinable(instance_id, deadline):
+    # Long poll: keep looking until the server answers a status ping, or we run out of time
+    while True:
+        instance = describe_instance(instance_id, max_age=5)
+        if instance['public_ip'] and server_answers(instance['public_ip']):
+            return instance, True
+        if time.time() + 3 > deadline:
+            return instance, False
+        time.sleep(2)
+
+
+def main(event, context):
+    parts = [part for part in (event.get('path') or "/").split("/") if part]
+    if "PASSWORD" in os.environ:
+        if not parts or not hmac.compare_digest(parts[0], os.environ.get('PASSWORD')):
+            return {'statusCode': 401,
+                    'body': json.dumps('Password required to access this resource')}
+        parts = parts[1:]
+    wait = parts == ["wait"]
+
+    instance_id = os.environ.get('INSTANCE_ID')
+    try:
+        status_code, message, instance = start_server(instance_id)
+        if status_code == 200 and wait:
+            instance, joinable = wait_until_joinable(instance_id, time.time() + WAIT_SECONDS)
+        else:
+            joinable = bool(instance['state'] == 'running' and instance['public_ip']
+                            and server_answers(instance['public_ip'], timeout=1))
+    except botocore.exceptions.ClientError:
+        return {'statusCode': 403,
+        'body': json.dumps('Permission denied starting resource, did your budget run out?')}
+    except:
+        print("Unexpected error:", sys.exc_info()[0])
+        raise
+
+    return {'statusCode': status_code,
+            'body': json.dumps({'message': 'Server is ready to join' if joinable else message,
+                                'state': instance['state'],
+                                'public_ip': instance['public_ip'],
+                                'joinable': joinable,
+                                'eta_seconds': eta_seconds(instance, joinable),
+                                'dns_name': instance['dns'].get('name'),
+                                'dns_ready': bool(instance['public_ip'] and instance['dns'].get('ip') == instance['public_ip']),
+                                'trace_id': instance.get('trace_id')})}
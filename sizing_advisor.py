@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# Picks an InstanceType from how the server has actually been used, instead of guessing.
+#
+# fetch pulls the history the stack already collects (CPU, memory, swap and disk from the cloudwatch agent, players
+# and mspt from the Minecraft namespace) into a CSV with one row per period.  advise reads that CSV in chunks into
+# numpy arrays, splits it into play sessions (the instance was stopped in between), and works out:
+#   - per session, the peak and the player-weighted 95th percentile of CPU, memory and tick time.  A minute with
+#     five players on counts five times as much as a minute with one, and minutes with nobody on don't count at all,
+#     since nobody notices lag then
+#   - what the busiest sessions would need: vCPUs with --headroom to spare, memory, and for burstable (T) types
+#     an average CPU under the baseline, so it doesn't run out of credits
+#   - the cheapest instance type that covers it, on demand and as spot, and what it costs for the hours the server
+#     actually runs in a month, against budgetLimit
+# CPU is compared in vCPUs across families and generations, which undersells newer ones a little.  Memory use mostly
+# reflects the heap jvmProfile gave the JVM, so it only shrinks when there's clear room.
+#
+# Usage:
+#   sizing_advisor.py fetch --instance-id i-0123456789abcdef0 [--days 30] [--out history.csv]
+#   sizing_advisor.py advise history.csv [--instance-type t3a.small] [--headroom 0.3] [--spot-region us-east-1]
+#   sizing_advisor.py generate fixture.csv [--days 90]      made up history, to try advise on
+import argparse
+import datetime
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+from cdk_minecraft.instance_types import instance_spec
+
+COLUMNS = ["timestamp", "cpu_percent", "mem_percent", "swap_percent", "disk_busy_percent", "players", "mspt"]
+SESSION_GAP = 600           # seconds without data that split two sessions
+CHUNK_ROWS = 200000
+MSPT_LIMIT = 50
+MEMORY_MARGIN = 1.1
+HOURS_PER_MONTH = 730
+
+# us-east-1 Linux on-demand $/hour when writing this, --prices takes a JSON file of {type: price} for other regions
+PRICES = {"t3a.small": 0.0188, "t3a.medium": 0.0376, "t3a.large": 0.0752, "t3a.xlarge": 0.1504,
+          "t3.small": 0.0208, "t3.medium": 0.0416, "t3.large": 0.0832, "t3.xlarge": 0.1664,
+          "t4g.small": 0.0168, "t4g.medium": 0.0336, "t4g.large": 0.0672, "t4g.xlarge": 0.1344,
+          "m5a.large": 0.086, "m5a.xlarge": 0.172, "m5.large": 0.096, "m5.xlarge": 0.192,
+          "m6i.large": 0.096, "m6i.xlarge": 0.192, "m6g.large": 0.077, "m6g.xlarge": 0.154,
+          "c5.large": 0.085, "c5.xlarge": 0.17, "c6i.large": 0.085, "c6i.xlarge": 0.17,
+          "c6g.large": 0.068, "c6g.xlarge": 0.136, "r5.large": 0.126, "r6g.large": 0.1008}
+SPOT_SHARE = 0.35           # rough spot price as a share of on demand, when we can't ask EC2
+
+# Percent of each vCPU a burstable type can use all the time without running out of credits
+BURSTABLE_BASELINE = {"nano": 5, "micro": 10, "small": 20, "medium": 20, "large": 30, "xlarge": 40, "2xlarge": 40}
+
+
+###############
+# History
+###############
+
+def cwagent_metrics(cloudwatch, private_dns):
+    # The agent names its metrics after the host name rather than the instance id, and has one cpu metric per core
+    host = private_dns.split(".")[0]
+    found = {}
+    for metric_name in ("cpu_usage_idle", "mem_used_percent", "swap_used_percent", "io_time"):
+        for page in cloudwatch.get_paginator("list_metrics").paginate(Namespace="CWAgent", MetricName=metric_name):
+            for metric in page["Metrics"]:
+                dimensions = {d["Name"]: d["Value"] for d in metric["Dimensions"]}
+                if dimensions.get("host", "").split(".")[0] == host:
+                    found.setdefault(metric_name, []).append(metric)
+    return found
+
+
+def fetch(instance_id, days, out, region_name=None):
+    import boto3
+    ec2 = boto3.client("ec2", region_name=region_name)
+    cloudwatch = boto3.client("cloudwatch", region_name=region_name)
+    instance = ec2.describe_instances(InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]
+    # 1 minute data is only kept for 15 days, after that cloudwatch has 5 minute averages
+    period = 60 if days <= 15 else 300
+    end = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+    start = end - datetime.timedelta(days=days)
+
+    queries = []
+    for name, metrics in cwagent_metrics(cloudwatch, instance["PrivateDnsName"]).items():
+        for n, metric in enumerate(metrics):
+            queries.append({"Id": f"{name}_{n}", "MetricStat": {"Metric": metric, "Period": period, "Stat": "Average"}})
+    for name in ("active_players", "mspt"):
+        queries.append({"Id": name, "MetricStat": {"Metric": {"Namespace": "Minecraft", "MetricName": name,
+                                                              "Dimensions": [{"Name": "InstanceId", "Value": instance_id}]},
+                                                   "Period": period, "Stat": "Maximum" if name == "active_players" else "Average"}})
+
+    series = {}
+    for page in cloudwatch.get_paginator("get_metric_data").paginate(MetricDataQueries=queries, StartTime=start, EndTime=end):
+        for result in page["MetricDataResults"]:
+            values = series.setdefault(result["Id"], {})
+            values.update(zip((int(t.timestamp()) for t in result["Timestamps"]), result["Values"]))
+
+    def average(prefix, timestamp, transform=lambda value: value):
+        values = [transform(s[timestamp]) for key, s in series.items() if key.startswith(prefix) and timestamp in s]
+        return sum(values) / len(values) if values else float("nan")
+
+    def busiest(prefix, timestamp, transform):
+        values = [transform(s[timestamp]) for key, s in series.items() if key.startswith(prefix) and timestamp in s]
+        return max(values) if values else float("nan")
+
+    timestamps = sorted(set().union(*(s.keys() for key, s in series.items() if key.startswith("cpu_usage_idle"))))
+    with open(out, "w") as fp:
+        fp.write(",".join(COLUMNS) + "\n")
+        for timestamp in timestamps:
+            row = [timestamp,
+                   average("cpu_usage_idle", timestamp, lambda idle: 100 - idle),
+                   average("mem_used_percent", timestamp),
+                   average("swap_used_percent", timestamp),
+                   busiest("io_time", timestamp, lambda ms: min(100, ms / (period * 10))),     # ms busy per period
+                   series.get("active_players", {}).get(timestamp, 0),
+                   series.get("mspt", {}).get(timestamp, float("nan"))]
+            fp.write(",".join(str(round(value, 2)) for value in row) + "\n")
+    return {"rows": len(timestamps), "period": period, "instance_type": instance["InstanceType"], "out": out}
+
+
+def read_history(path, chunk_rows=CHUNK_ROWS):
+    # The whole CSV as one array with a column per COLUMNS entry, parsed a chunk at a time so months of 1 minute data
+    # never sit in memory as python objects
+    chunks = []
+    with open(path) as fp:
+        header = fp.readline().strip().split(",")
+        if header != COLUMNS:
+            raise ValueError(f"{path} doesn't look like a history file, expected the columns {','.join(COLUMNS)}")
+        while True:
+            lines = list(itertools.islice(fp, chunk_rows))
+            if not lines:
+                break
+            chunks.append(np.loadtxt(lines, delimiter=",", ndmin=2))
+    history = np.concatenate(chunks) if chunks else np.empty((0, len(COLUMNS)))
+    return history[np.argsort(history[:, 0], kind="stable")]
+
+
+def generate(path, days, rng):
+    # Evening sessions of a few hours, busier at weekends, CPU and tick time following the player count
+    period, rows = 60, []
+    start = int(datetime.datetime(2021, 1, 1).timestamp())
+    for day in range(days):
+        if rng.random() < 0.3:
+            continue
+        weekend = day % 7 in (5, 6)
+        begin = start + day * 86400 + int(rng.uniform(17, 20) * 3600)
+        minutes = int(rng.uniform(60, 300 if weekend else 180))
+        t = np.arange(minutes)
+        players = np.clip(np.round(rng.uniform(1, 8 if weekend else 5) * np.sin(np.pi * t / minutes)
+                                   + rng.normal(0, 0.7, minutes)), 0, 20)
+        cpu = np.clip(12 + players * 7 + rng.normal(0, 5, minutes), 1, 100)
+        rows.append(np.column_stack([begin + t * period, cpu, np.clip(70 + players * 1.5, 0, 100), np.zeros(minutes),
+                                     np.clip(rng.normal(3, 2, minutes), 0, 100), players,
+                                     np.clip(5 + players * 3.5 + rng.normal(0, 2, minutes), 1, None)]))
+    history = np.concatenate(rows)
+    np.savetxt(path, history, delimiter=",", header=",".join(COLUMNS), comments="", fmt="%.2f")
+    return {"rows": len(history), "out": path}
+
+
+###############
+# Analysis
+###############
+
+def weighted_percentile(values, weights, share):
+    # nan values are ignored, with no weight at all this is the plain percentile
+    keep = ~np.isnan(values)
+    values, weights = values[keep], weights[keep]
+    if not len(values):
+        return float("nan")
+    if weights.sum() <= 0:
+        weights = np.ones_like(values)
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cumulative, share * cumulative[-1])])
+
+
+def sessions(history):
+    # Index ranges of the runs of rows without a gap of more than SESSION_GAP
+    breaks = np.flatnonzero(np.diff(history[:, 0]) > SESSION_GAP) + 1
+    edges = np.concatenate([[0], breaks, [len(history)]])
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def session_stats(history):
+    column = {name: n for n, name in enumerate(COLUMNS)}
+    stats = []
+    for start, end in sessions(history):
+        rows = history[start:end]
+        players = rows[:, column["players"]]
+        stats.append({"start": datetime.datetime.utcfromtimestamp(rows[0, 0]).isoformat(),
+                      "minutes": round((rows[-1, 0] - rows[0, 0]) / 60 + 1),
+                      "peak_players": int(np.nanmax(players)),
+                      **{f"{name}_p95": round(weighted_percentile(rows[:, column[name]], players, 0.95), 1)
+                         for name in ("cpu_percent", "mem_percent", "mspt")},
+                      **{f"{name}_peak": round(float(np.nanmax(rows[:, column[name]])), 1)
+                         for name in ("cpu_percent", "mem_percent", "swap_percent", "disk_busy_percent")}})
+    return stats
+
+
+def requirement(history, current_type, headroom):
+    # What the busiest sessions needed, in vCPUs and MiB, with headroom on top
+    spec = instance_spec(current_type)
+    column = {name: n for n, name in enumerate(COLUMNS)}
+    players = history[:, column["players"]]
+    cpu_p95 = weighted_percentile(history[:, column["cpu_percent"]], players, 0.95)
+    mem_p99 = weighted_percentile(history[:, column["mem_percent"]], players, 0.99)
+    swapping = np.nanpercentile(history[:, column["swap_percent"]], 95) > 1 if len(history) else False
+    # The JVM grows into whatever heap it was given, so memory only gets a small margin rather than the CPU headroom
+    memory = spec.memory_mib * mem_p99 / 100 * MEMORY_MARGIN
+    mspt_p95 = weighted_percentile(history[:, column["mspt"]], players, 0.95)
+    return {"vcpus": spec.vcpus * cpu_p95 / 100 / (1 - headroom),
+            # Anything short of the current size when it was swapping or lagging would make things worse
+            "memory_mib": max(memory, spec.memory_mib * 1.25) if swapping else memory,
+            "min_vcpus": spec.vcpus if mspt_p95 > MSPT_LIMIT else 1,
+            "average_vcpus": spec.vcpus * float(np.nanmean(history[:, column["cpu_percent"]])) / 100,
+            "cpu_p95_percent": round(cpu_p95, 1), "mem_p99_percent": round(mem_p99, 1),
+            "mspt_p95": round(mspt_p95, 1), "swapping": bool(swapping)}
+
+
+def fits(instance_type, needed):
+    spec = instance_spec(instance_type)
+    if spec.vcpus < max(needed["vcpus"], needed["min_vcpus"]) or spec.memory_mib < needed["memory_mib"]:
+        return False
+    size = instance_type.split(".")[1]
+    if instance_type.startswith("t"):
+        return needed["average_vcpus"] <= spec.vcpus * BURSTABLE_BASELINE.get(size, 0) / 100
+    return True
+
+
+def spot_prices(instance_types, region_name):
+    # Today's spot price per type, the median across availability zones
+    import boto3
+    ec2 = boto3.client("ec2", region_name=region_name)
+    found = {}
+    for page in ec2.get_paginator("describe_spot_price_history").paginate(
+            InstanceTypes=list(instance_types), ProductDescriptions=["Linux/UNIX"], StartTime=datetime.datetime.utcnow()):
+        for price in page["SpotPriceHistory"]:
+            found.setdefault(price["InstanceType"], []).append(float(price["SpotPrice"]))
+    return {instance_type: float(np.median(values)) for instance_type, values in found.items()}
+
+
+def advise(history, current_type, headroom, prices, budget_limit=None, spot=None):
+    needed = requirement(history, current_type, headroom)
+    covered_days = max(1, (history[-1, 0] - history[0, 0]) / 86400) if len(history) else 1
+    running_minutes = sum((end - start) for start, end in sessions(history)) * np.median(np.diff(history[:, 0])) / 60 \
+        if len(history) > 1 else 0
+    hours_per_month = float(min(HOURS_PER_MONTH, running_minutes / 60 / covered_days * HOURS_PER_MONTH / 24))
+
+    def costs(instance_type):
+        on_demand = prices[instance_type]
+        spot_price = (spot or {}).get(instance_type, on_demand * SPOT_SHARE)
+        return {"instance_type": instance_type,
+                "on_demand_monthly": round(on_demand * hours_per_month, 2),
+                "spot_monthly": round(spot_price * hours_per_month, 2)}
+
+    candidates = sorted((costs(t) for t in prices if fits(t, needed)), key=lambda row: row["on_demand_monthly"])
+    result = {"current": costs(current_type) if current_type in prices else {"instance_type": current_type},
+              "needed": {key: round(value, 2) if isinstance(value, float) else value for key, value in needed.items()},
+              "hours_per_month": round(hours_per_month, 1),
+              "recommended": candidates[0] if candidates else None,
+              "cheapest_spot": min(candidates, key=lambda row: row["spot_monthly"]) if candidates else None,
+              "alternatives": candidates[1:4]}
+    if budget_limit and candidates:
+        result["budget_limit"] = budget_limit
+        result["within_budget"] = candidates[0]["on_demand_monthly"] <= budget_limit
+    return result
+
+
+def cdk_context():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cdk.json")
+    try:
+        with open(path) as fp:
+            return json.load(fp)["context"]
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def main():
+    context = cdk_context()
+    parser = argparse.ArgumentParser(description="Recommend an instance type from the server's metric history")
+    parser.add_argument("command", choices=["fetch", "advise", "generate"])
+    parser.add_argument("history", nargs="?", help="advise/generate: the history CSV")
+    parser.add_argument("--instance-id", help="fetch: the server's instance id (the instanceId output)")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--out", default="history.csv", help="fetch: where to write the history")
+    parser.add_argument("--region", default=context.get("region"))
+    parser.add_argument("--instance-type", default=context.get("InstanceType"), help="advise: what the history ran on")
+    parser.add_argument("--headroom", type=float, default=0.3, help="share of the instance to keep free at p95")
+    parser.add_argument("--prices", help="JSON file of {instance type: on demand $/hour}")
+    parser.add_argument("--spot-region", help="advise: ask EC2 for current spot prices in this region")
+    parser.add_argument("--sessions", action="store_true", help="advise: include the per session numbers")
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        if not args.instance_id:
+            parser.error("fetch needs --instance-id")
+        result = fetch(args.instance_id, args.days, args.out, args.region)
+    elif args.command == "generate":
+        result = generate(args.history or "history.csv", args.days, np.random.default_rng(1))
+    else:
+        if not args.history:
+            parser.error("advise needs a history CSV, see fetch")
+        prices = PRICES
+        if args.prices:
+            with open(args.prices) as fp:
+                prices = json.load(fp)
+        history = read_history(args.history)
+        spot = spot_prices(prices, args.spot_region) if args.spot_region else None
+        result = advise(history, args.instance_type, args.headroom, prices, context.get("budgetLimit"), spot)
+        if args.sessions:
+            result["sessions"] = session_stats(history)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
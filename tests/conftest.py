@@ -0,0 +1,12 @@
+# The scripts in cdk_minecraft/resources run from /opt/resources on the server and import each other by module name,
+# the startup lambda is index.py in minecraft_start, and the off-instance tools sit at the top of the repo, so all three
+# go on the path for the tests.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "cdk_minecraft", "resources"))
+sys.path.insert(0, os.path.join(ROOT, "minecraft_start"))
+sys.path.insert(0, ROOT)
+# Nothing in the tests talks to AWS, but boto3 wants a region to build a client
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,140 @@
+import hashlib
+import io
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+import artifact_sync
+
+PAPER = b"paper jar"
+ESSENTIALS = b"essentials jar"
+LIBRARY = b"shared library jar"
+
+
+def artifact(target, data, kind=None):
+    digest = hashlib.sha256(data).hexdigest()
+    found = {"key": f"artifacts/{digest}/{os.path.basename(target)}", "sha256": digest, "size": len(data),
+             "target": target}
+    if kind:
+        found["kind"] = kind
+    return found
+
+
+class FakeS3:
+    # A files bucket, objects is key -> bytes.  Counts downloads per key.
+
+    def __init__(self, artifacts=None, objects=None):
+        self.objects = dict(objects or {})
+        if artifacts is not None:
+            self.objects[artifact_sync.MANIFEST_KEY] = json.dumps({"artifacts": artifacts}).encode()
+        self.downloads = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "missing"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def get_paginator(self, operation):
+        fake = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {"Contents": [{"Key": key, "ETag": f'"{hashlib.md5(data).hexdigest()}"', "Size": len(data)}
+                                    for key, data in fake.objects.items() if key.startswith(Prefix)]}
+        return Paginator()
+
+    def download_file(self, Bucket, Key, Filename):
+        self.downloads[Key] = self.downloads.get(Key, 0) + 1
+        with open(Filename, "wb") as fp:
+            fp.write(self.objects[Key])
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    manifest = [artifact("paper-1.17.1-411.jar", PAPER, kind="server"),
+                artifact("plugins/EssentialsX.jar", ESSENTIALS),
+                artifact("plugins/lib/shared.jar", LIBRARY),
+                artifact("plugins/Other/lib/shared.jar", LIBRARY)]
+    s3 = FakeS3(manifest, {entry["key"]: data for entry, data in zip(manifest, (PAPER, ESSENTIALS, LIBRARY))})
+    monkeypatch.setattr(artifact_sync.boto3, "client", lambda service: s3)
+    return s3
+
+
+@pytest.fixture
+def server_dirs(tmp_path):
+    found = [str(tmp_path / "server"), str(tmp_path / "creative")]
+    for server_dir in found:
+        os.makedirs(server_dir)
+    return found
+
+
+def test_sync_installs_every_artifact_in_every_world(bucket, server_dirs, tmp_path):
+    result = artifact_sync.sync("files", server_dirs, str(tmp_path / "cache"))
+    assert result["artifacts"] == 4 and result["cache_misses"] == 3 and result["has_server_jar"]
+    assert result["bytes_downloaded"] == len(PAPER) + len(ESSENTIALS) + len(LIBRARY)
+    for server_dir in server_dirs:
+        with open(os.path.join(server_dir, "plugins", "Other", "lib", "shared.jar"), "rb") as fp:
+            assert fp.read() == LIBRARY
+        with open(os.path.join(server_dir, artifact_sync.INSTALLED_FILE)) as fp:
+            assert len(json.load(fp)) == 4
+
+
+def test_same_digest_is_downloaded_once(bucket, server_dirs, tmp_path):
+    artifact_sync.sync("files", server_dirs, str(tmp_path / "cache"), threads=4)
+    assert all(count == 1 for count in bucket.downloads.values())
+    assert not [name for name in os.listdir(tmp_path / "cache" / "sha256") if name.endswith(".part")]
+
+
+def test_second_sync_is_all_cache_hits(bucket, server_dirs, tmp_path):
+    artifact_sync.sync("files", server_dirs, str(tmp_path / "cache"))
+    bucket.downloads.clear()
+    result = artifact_sync.sync("files", server_dirs, str(tmp_path / "cache"))
+    assert not bucket.downloads
+    assert result["hit_rate"] == 1 and result["bytes_downloaded"] == 0
+
+
+def test_download_that_doesnt_match_its_digest_is_rejected(tmp_path):
+    entry = artifact("plugins/EssentialsX.jar", ESSENTIALS)
+    s3 = FakeS3(objects={entry["key"]: b"tampered"})
+    with pytest.raises(ValueError):
+        artifact_sync.fetch(s3, "files", entry, str(tmp_path))
+    assert os.listdir(tmp_path / "sha256") == []
+    # Nothing went in the cache, so the next sync tries again
+    s3.objects[entry["key"]] = ESSENTIALS
+    assert artifact_sync.fetch(s3, "files", entry, str(tmp_path)) == len(ESSENTIALS)
+
+
+def test_installed_files_are_copies_of_the_cache(bucket, server_dirs, tmp_path):
+    artifact_sync.sync("files", server_dirs[:1], str(tmp_path / "cache"))
+    installed = os.path.join(server_dirs[0], "plugins", "EssentialsX.jar")
+    cached = artifact_sync.cache_path(artifact("plugins/EssentialsX.jar", ESSENTIALS), str(tmp_path / "cache"))
+    assert not os.path.samefile(installed, cached)
+    with open(installed, "ab") as fp:
+        fp.write(b" edited by the plugin")
+    assert artifact_sync.sha256_file(cached) == hashlib.sha256(ESSENTIALS).hexdigest()
+    assert not [name for name in os.listdir(os.path.dirname(installed)) if name.endswith(".artifact")]
+
+
+def test_install_removes_what_the_manifest_dropped(server_dirs, tmp_path):
+    server_dir = server_dirs[0]
+    cache = str(tmp_path / "cache")
+    old = [artifact("paper-1.16.5-790.jar", b"old paper", kind="server"), artifact("plugins/Gone.jar", b"gone")]
+    new = [artifact("paper-1.17.1-411.jar", PAPER, kind="server"), artifact("plugins/EssentialsX.jar", ESSENTIALS)]
+    s3 = FakeS3(objects={entry["key"]: data for entry, data in zip(old + new, (b"old paper", b"gone", PAPER, ESSENTIALS))})
+    for entry in old + new:
+        artifact_sync.fetch(s3, "files", entry, cache)
+    artifact_sync.install(server_dir, old, cache)
+    open(os.path.join(server_dir, "spigot-1.16.jar"), "w").close()
+    assert artifact_sync.install(server_dir, new, cache) == 3
+    assert sorted(os.listdir(server_dir)) == [artifact_sync.INSTALLED_FILE, "paper-1.17.1-411.jar", "plugins"]
+    assert os.listdir(os.path.join(server_dir, "plugins")) == ["EssentialsX.jar"]
+
+
+def test_bucket_without_a_manifest_installs_the_plugins_folder(monkeypatch, server_dirs, tmp_path):
+    s3 = FakeS3(objects={"plugins/EssentialsX.jar": ESSENTIALS, "plugins/": b"", "other/readme.txt": b"no"})
+    monkeypatch.setattr(artifact_sync.boto3, "client", lambda service: s3)
+    result = artifact_sync.sync("files", server_dirs[:1], str(tmp_path / "cache"))
+    assert result["artifacts"] == 1 and not result["has_server_jar"]
+    assert os.path.exists(os.path.join(server_dirs[0], "plugins", "EssentialsX.jar"))
@@ -0,0 +1,86 @@
+import json
+import sys
+import time
+
+import pytest
+
+import boot_trace
+
+# Seconds per span of a stock boot
+PHASES = {"ec2_start": 20.0, "os_boot": 12.0, "fast_tier": 4.0, "artifacts": 3.0, "dns": 6.0, "server_start": 1.0,
+          "world_load": 30.0}
+
+
+def trace(n, slower=None, by=0):
+    # One boot the way record() writes it, slower is a span that took `by` seconds longer
+    start, spans = 1622548800.0 + n * 86400, []
+    for name, seconds in PHASES.items():
+        seconds += n % 3 + (by if name == slower else 0)
+        spans.append({"span": name, "start": round(start, 3), "seconds": seconds})
+        start += seconds
+    return {"trace": f"t{n}", "instance_id": "i-0123456789", "boot": spans[1]["start"], "requested": spans[0]["start"],
+            "joinable": start, "time_to_joinable": round(start - spans[0]["start"], 3), "spans": spans}
+
+
+def trace_log(path, traces):
+    path.write_text("".join(json.dumps(found) + "\n" for found in traces) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    return trace_log(tmp_path / "baseline.log", [trace(n) for n in range(9)])
+
+
+def test_summary_per_span(baseline):
+    summary = boot_trace.summarize(boot_trace.read_traces(baseline))
+    assert set(summary) == set(PHASES) | {"time_to_joinable"}
+    # Each span takes its stock time plus 0, 1 or 2 seconds
+    assert summary["world_load"] == {"count": 9, "p50": 31.0, "p95": 32.0}
+    assert summary["time_to_joinable"]["p50"] == sum(PHASES.values()) + 7
+
+
+def test_slowed_span_is_flagged(baseline):
+    slowed = [trace(n, slower="artifacts", by=20) for n in range(9)]
+    found = boot_trace.regressions(boot_trace.summarize(slowed), boot_trace.summarize(boot_trace.read_traces(baseline)),
+                                   0.2)
+    assert found["artifacts"] == {"baseline_p50": 4.0, "p50": 24.0}
+    assert set(found) == {"artifacts", "time_to_joinable"}
+
+
+def test_small_or_tolerated_changes_are_not_flagged(baseline):
+    before = boot_trace.summarize(boot_trace.read_traces(baseline))
+    # A couple of seconds on a short span, and 20% on a long one
+    assert not boot_trace.regressions(boot_trace.summarize([trace(n, "dns", 3) for n in range(9)]), before, 0.2)
+    assert not boot_trace.regressions(boot_trace.summarize([trace(n, "world_load", 6) for n in range(9)]), before, 0.2)
+
+
+def test_replay_exits_1_on_a_regression(baseline, tmp_path, monkeypatch, capsys):
+    slowed = trace_log(tmp_path / "slowed.log", [trace(n, "world_load", 30) for n in range(9)])
+    monkeypatch.setattr(sys, "argv", ["boot_trace.py", "replay", slowed, "--baseline", baseline])
+    assert boot_trace.main() == 1
+    assert "world_load" in json.loads(capsys.readouterr().out)["regressions"]
+    monkeypatch.setattr(sys, "argv", ["boot_trace.py", "replay", baseline, "--baseline", baseline])
+    assert boot_trace.main() == 0
+
+
+def test_request_only_counts_a_tag_from_this_boot():
+    boot = 1622548800.0
+    tagged = {"boot_trace": json.dumps({"id": "abc", "requested": boot - 25})}
+    assert boot_trace.request(tagged, boot) == ("abc", boot - 25)
+    stale = {"boot_trace": json.dumps({"id": "abc", "requested": boot - boot_trace.REQUEST_MAX_AGE - 1})}
+    for tags in (stale, {}, {"boot_trace": "not json"}):
+        trace_id, requested = boot_trace.request(tags, boot)
+        assert trace_id.startswith("boot-") and requested is None
+
+
+def test_configure_spans_start_at_this_boots_phases(tmp_path):
+    boot = time.time() - 300
+    phases = [{"phase": "boot", "seconds": 10}, {"phase": "packages", "seconds": 90},
+              {"phase": "boot", "seconds": 20}, {"phase": "packages", "seconds": 5}, {"phase": "java", "seconds": 7}]
+    path = tmp_path / "phases.log"
+    path.write_text("".join(json.dumps(phase) + "\n" for phase in phases))
+    spans = boot_trace.configure_spans(boot, str(path))
+    assert [(span["span"], span["seconds"]) for span in spans] == [("configure_packages", 5), ("configure_java", 7)]
+    assert spans[0]["start"] == round(boot + 20, 3) and spans[1]["start"] == round(boot + 25, 3)
+    assert boot_trace.configure_spans(boot, str(tmp_path / "missing.log")) == []
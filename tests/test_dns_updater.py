@@ -0,0 +1,147 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import dns_updater
+
+ZONES = [{"Id": "/hostedzone/ZOTHER", "Name": "other.example."},
+         {"Id": "/hostedzone/ZPRIVATE", "Name": "example.com.", "Config": {"PrivateZone": True}},
+         {"Id": "/hostedzone/ZPUBLIC", "Name": "example.com.", "Config": {"PrivateZone": False}}]
+IP = "203.0.113.10"
+
+
+class FakeRoute53:
+    # Just enough of the route53 client for point(), changes go INSYNC after pending_polls get_change calls and a zone
+    # id that isn't in zones gets NoSuchHostedZone like the real thing
+
+    def __init__(self, zones, pending_polls=2):
+        self.zones = zones
+        self.records = {}
+        self.changes = {}
+        self.pending_polls = pending_polls
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get_paginator(self, operation):
+        fake = self
+
+        class Paginator:
+            def paginate(self):
+                # One zone per page, so a zone on a later page is only found by paging
+                for zone in fake.zones:
+                    fake._count(operation)
+                    yield {"HostedZones": [zone]}
+        return Paginator()
+
+    def _check_zone(self, zone_id, operation):
+        if not any(zone["Id"].split("/")[-1] == zone_id for zone in self.zones):
+            error = {"Code": "NoSuchHostedZone", "Message": f"No hosted zone found with ID: {zone_id}"}
+            raise ClientError({"Error": error}, operation)
+
+    def list_resource_record_sets(self, HostedZoneId, StartRecordName, StartRecordType, MaxItems):
+        self._count("list_resource_record_sets")
+        self._check_zone(HostedZoneId, "ListResourceRecordSets")
+        record = self.records.get((HostedZoneId, StartRecordName, StartRecordType))
+        return {"ResourceRecordSets": [record] if record else []}
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        self._count("change_resource_record_sets")
+        self._check_zone(HostedZoneId, "ChangeResourceRecordSets")
+        for change in ChangeBatch["Changes"]:
+            record = change["ResourceRecordSet"]
+            self.records[(HostedZoneId, record["Name"], record["Type"])] = record
+        change_id = f"/change/C{len(self.changes) + 1}"
+        self.changes[change_id] = self.pending_polls
+        return {"ChangeInfo": {"Id": change_id, "Status": "PENDING"}}
+
+    def get_change(self, Id):
+        self._count("get_change")
+        self.changes[Id] -= 1
+        return {"ChangeInfo": {"Id": Id, "Status": "INSYNC" if self.changes[Id] <= 0 else "PENDING"}}
+
+
+@pytest.fixture
+def route53():
+    return FakeRoute53(list(ZONES))
+
+
+@pytest.fixture
+def instance_tags():
+    return {"dns_hostname": "minecraft", "dns_zone": "example.com."}
+
+
+def point(route53, instance_tags, mode="boot", ip=IP):
+    return dns_updater.point(mode, route53, instance_tags, ip, instance_tags.__setitem__, poll=0)
+
+
+def test_boot_stable_stopping_and_a_new_ip(route53, instance_tags):
+    steps = [point(route53, instance_tags, mode, ip) for mode, ip in
+             (("boot", IP), ("boot", IP), ("stable", IP), ("stopping", IP), ("boot", "203.0.113.20"))]
+    assert [(step["changed"], step["ttl"]) for step in steps] == [(True, 60), (False, 60), (True, 900), (True, 60),
+                                                                   (True, 60)]
+    assert route53.calls["list_hosted_zones"] == len(ZONES)
+    assert json.loads(instance_tags[dns_updater.RECORD_TAG])["ip"] == "203.0.113.20"
+
+
+def test_public_zone_is_found_and_cached(route53, instance_tags):
+    result = point(route53, instance_tags)
+    assert result["changed"] and result["insync"]
+    assert json.loads(instance_tags[dns_updater.ZONE_ID_TAG]) == {"zone": "example.com.", "id": "ZPUBLIC"}
+    assert route53.records[("ZPUBLIC", "minecraft.example.com.", "A")]["ResourceRecords"] == [{"Value": IP}]
+    assert json.loads(instance_tags[dns_updater.RECORD_TAG])["ip"] == IP
+
+    route53.calls.clear()
+    assert not point(route53, instance_tags)["changed"]
+    assert route53.calls == {"list_resource_record_sets": 1}
+
+
+def test_waits_for_insync_except_when_stopping(route53, instance_tags):
+    point(route53, instance_tags, mode="stable")
+    assert route53.calls["get_change"] == route53.pending_polls
+    route53.calls.clear()
+    result = point(route53, instance_tags, mode="stopping")
+    assert result["changed"] and result["ttl"] == dns_updater.BOOT_TTL and not result["insync"]
+    assert "get_change" not in route53.calls
+
+
+@pytest.mark.parametrize("cached", ["ZPUBLIC", json.dumps({"zone": "other.example.", "id": "ZOTHER"}), "{not json",
+                                    json.dumps(["ZPUBLIC"])])
+def test_old_or_other_zone_cache_is_looked_up_again(route53, instance_tags, cached):
+    # A bare id from before the cache recorded the zone, or one cached before dns_zone was changed
+    instance_tags[dns_updater.ZONE_ID_TAG] = cached
+    point(route53, instance_tags)
+    assert route53.calls["list_hosted_zones"] == len(ZONES)
+    assert ("ZPUBLIC", "minecraft.example.com.", "A") in route53.records
+    assert json.loads(instance_tags[dns_updater.ZONE_ID_TAG])["id"] == "ZPUBLIC"
+
+
+def test_recreated_zone_is_looked_up_again(route53, instance_tags):
+    point(route53, instance_tags)
+    route53.zones[2] = {"Id": "/hostedzone/ZNEW", "Name": "example.com.", "Config": {"PrivateZone": False}}
+    result = point(route53, instance_tags, ip="203.0.113.20")
+    assert result["changed"] and result["insync"]
+    assert json.loads(instance_tags[dns_updater.ZONE_ID_TAG])["id"] == "ZNEW"
+    assert route53.records[("ZNEW", "minecraft.example.com.", "A")]["ResourceRecords"] == [{"Value": "203.0.113.20"}]
+
+
+def test_missing_zone(route53, instance_tags):
+    instance_tags["dns_zone"] = "missing.example."
+    assert point(route53, instance_tags) is None
+    assert dns_updater.ZONE_ID_TAG not in instance_tags
+
+
+def test_other_errors_are_not_retried(route53, instance_tags):
+    def denied(**kwargs):
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "no"}}, "ListResourceRecordSets")
+    route53.list_resource_record_sets = denied
+    with pytest.raises(ClientError):
+        point(route53, instance_tags)
+    assert route53.calls["list_hosted_zones"] == len(ZONES)
+
+
+def test_no_dns_tags(route53):
+    assert point(route53, {}) is None
+    assert route53.calls == {}
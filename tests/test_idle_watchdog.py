@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+import idle_watchdog
+
+POLL = idle_watchdog.POLL_SECONDS
+STOP = idle_watchdog.STOP_SECONDS
+
+
+def stops_at(trace, idle_minutes=15, min_players=1):
+    # When the watchdog decided to stop, without the time the stop itself takes
+    return idle_watchdog.simulate_watchdog(trace, idle_minutes, min_players) - STOP
+
+
+def test_sustained_idle_stops_after_idle_minutes():
+    trace = [(0, 2), (600, 1), (1200, 0), (9000, 0)]
+    assert 1200 + 15 * 60 <= stops_at(trace) < 1200 + 15 * 60 + POLL
+
+
+def test_brief_dip_doesnt_stop_the_server():
+    # Everyone drops for half a minute (a relog, a crash) in the middle of a session
+    trace = [(0, 2), (600, 0), (630, 2), (3600, 0), (9000, 0)]
+    assert 3600 + 15 * 60 <= stops_at(trace) < 3600 + 15 * 60 + POLL
+
+
+def test_quick_visit_doesnt_reset_the_idle_timer():
+    visit = idle_watchdog.HYSTERESIS_SECONDS - 2 * POLL
+    trace = [(0, 2), (600, 0), (900, 1), (900 + visit, 0), (9000, 0)]
+    assert 600 + 15 * 60 <= stops_at(trace) < 600 + 15 * 60 + POLL
+
+
+def test_visit_longer_than_hysteresis_resets_it():
+    trace = [(0, 2), (600, 0), (900, 1), (1200, 0), (9000, 0)]
+    assert 1200 + 15 * 60 <= stops_at(trace) < 1200 + 15 * 60 + POLL
+
+
+def test_min_players():
+    trace = [(0, 3), (600, 1), (9000, 1)]
+    assert 600 + 5 * 60 <= stops_at(trace, idle_minutes=5, min_players=2) < 600 + 5 * 60 + POLL
+
+
+def test_idle_timer_counts_unanswered_checks_as_idle():
+    timer = idle_watchdog.IdleTimer(60)
+    assert not timer.update(0, 1)
+    assert not timer.update(10, None)
+    assert not timer.update(69, None)
+    assert timer.update(70, None)
+
+
+@pytest.mark.parametrize("trace", [[(0, 2), (600, 0), (9000, 0)],
+                                   [(0, 2), (600, 0), (630, 2), (3600, 0), (9000, 0)],
+                                   [(0, 2), (600, 0), (900, 1), (940, 0), (9000, 0)]])
+def test_watchdog_stops_no_later_than_the_alarm(trace):
+    alarm = idle_watchdog.simulate_alarm(trace, 15, 1)
+    watchdog = idle_watchdog.simulate_watchdog(trace, 15, 1)
+    assert watchdog <= alarm
+    # The alarm can't fire before the players left plus the idle minutes either
+    assert alarm - STOP >= idle_watchdog.last_left(trace, alarm, 1) + 15 * 60
+
+
+def test_generated_sessions_save_idle_minutes():
+    rng = random.Random(1)
+    traces = [(f"generated-{n}", idle_watchdog.synthetic_trace(rng)) for n in range(50)]
+    result = idle_watchdog.simulate(traces, 15, 1, POLL, idle_watchdog.HYSTERESIS_SECONDS)
+    assert result["saved_minutes_per_session"] > 0
+    assert all(row["watchdog_idle_minutes"] <= row["alarm_idle_minutes"] for row in result["sessions"])
+    assert all(row["watchdog_cut_off_players"] == 0 for row in result["sessions"])
+
+
+def test_read_trace(tmp_path):
+    path = tmp_path / "trace.csv"
+    path.write_text("# seconds,players\n0,2\n600,0\n\n9000,0\n")
+    assert idle_watchdog.read_trace(path) == [(0, 2), (600, 0), (9000, 0)]
+
+
+@pytest.mark.parametrize("answer, players", [("There are 2 of a max of 20 players online: Steve, Alex", 2),
+                                             ("§6There are §c0§6/§c20§6 players online:", 0),
+                                             ("Unknown command", None)])
+def test_player_count(answer, players):
+    class Console:
+        def command(self, text):
+            return answer
+    assert idle_watchdog.player_count(Console()) == players
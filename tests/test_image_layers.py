@@ -0,0 +1,30 @@
+import json
+import os
+
+from cdk_minecraft import image_layers
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cdk_minecraft", "image")
+PARENT = "arn:aws:imagebuilder:us-east-1:aws:image/amazon-linux-2-x86/x.x.x"
+
+
+def test_unchanged_layers_keep_the_same_recipe():
+    first = image_layers.image_layers(IMAGE_DIR, {"MINECRAFT_VERSION": "1.17.1"})
+    second = image_layers.image_layers(IMAGE_DIR, {"MINECRAFT_VERSION": "1.17.1"})
+    assert [layer.hash for layer in first] == [layer.hash for layer in second]
+    assert image_layers.recipe_hash(first, PARENT) == image_layers.recipe_hash(second, PARENT)
+
+
+def test_a_changed_variable_changes_the_recipe():
+    old = image_layers.image_layers(IMAGE_DIR, {"MINECRAFT_VERSION": "1.17.1"})
+    new = image_layers.image_layers(IMAGE_DIR, {"MINECRAFT_VERSION": "1.18.1"})
+    assert image_layers.recipe_hash(old, PARENT) != image_layers.recipe_hash(new, PARENT)
+    assert image_layers.recipe_hash(old, PARENT) != image_layers.recipe_hash(old, PARENT + "-updated")
+
+
+def test_layers_run_in_order_and_record_themselves():
+    layers = image_layers.image_layers(IMAGE_DIR)
+    assert [layer.name for layer in layers] == ["packages", "java", "python", "tools", "paper"]
+    document = json.loads(layers[0].document)
+    commands = document["phases"][0]["steps"][0]["inputs"]["commands"][0]
+    assert commands.startswith("set -e\n")
+    assert f"{image_layers.LAYER_RECORD_DIR}/packages.json" in commands
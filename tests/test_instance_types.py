@@ -0,0 +1,39 @@
+import pytest
+
+import sizing_advisor
+from cdk_minecraft.instance_types import instance_spec
+
+
+@pytest.mark.parametrize("instance_type, vcpus, memory_gib", [
+    ("t3a.small", 2, 2), ("t2.micro", 1, 1), ("t4g.2xlarge", 8, 32), ("m4.large", 2, 8), ("m6g.medium", 1, 4),
+    ("c5.9xlarge", 36, 72), ("c5n.xlarge", 4, 10.5), ("r6i.32xlarge", 128, 1024), ("z1d.3xlarge", 12, 96),
+    ("i3.8xlarge", 32, 244)])
+def test_memory_comes_from_the_table(instance_type, vcpus, memory_gib):
+    spec = instance_spec(instance_type)
+    assert (spec.vcpus, spec.memory_mib) == (vcpus, int(memory_gib * 1024))
+
+
+@pytest.mark.parametrize("instance_type, arch, instance_store", [
+    ("t4g.small", "arm64", False), ("a1.large", "arm64", False), ("m5d.large", "x86_64", True),
+    ("c6gd.large", "arm64", True), ("i3.large", "x86_64", True), ("m5.large", "x86_64", False)])
+def test_arch_and_instance_store(instance_type, arch, instance_store):
+    spec = instance_spec(instance_type)
+    assert (spec.arch, spec.instance_store) == (arch, instance_store)
+
+
+@pytest.mark.parametrize("instance_type, vcpus", [("m5.metal", 2), ("g4dn.xlarge", 4), ("m7g.2xlarge", 8)])
+def test_unknown_types_fall_back_to_a_small_guess(instance_type, vcpus):
+    with pytest.warns(UserWarning, match=instance_type):
+        spec = instance_spec(instance_type)
+    assert (spec.vcpus, spec.memory_mib) == (vcpus, vcpus * 2 * 1024)
+
+
+def test_not_an_instance_type():
+    with pytest.raises(ValueError):
+        instance_spec("large")
+
+
+def test_every_type_the_sizing_advisor_prices_is_known(recwarn):
+    for instance_type in sizing_advisor.PRICES:
+        instance_spec(instance_type)
+    assert not recwarn.list
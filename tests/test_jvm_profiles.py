@@ -0,0 +1,62 @@
+import pytest
+
+from cdk_minecraft import jvm_profiles
+from cdk_minecraft.instance_types import instance_spec
+from cdk_minecraft.worlds import world_settings
+
+
+def max_heap(settings):
+    return int(settings["MCMAXMEM"].rstrip("M"))
+
+
+def single_world_heap(instance_type):
+    [(memory_mib, heap)] = jvm_profiles.world_memory(instance_type, world_settings())
+    return max_heap(jvm_profiles.jvm_profile(instance_type, heap))
+
+
+@pytest.mark.parametrize("instance_type", ["t3a.small", "t3.large", "m5.large", "m5.xlarge", "r6g.2xlarge"])
+def test_heap_leaves_room_for_the_kernel_and_sidecars(instance_type):
+    nominal = instance_spec(instance_type).memory_mib
+    sidecars = jvm_profiles.SIDECAR_MIB * (len(jvm_profiles.INSTANCE_SIDECARS) + len(jvm_profiles.WORLD_SIDECARS))
+    assert single_world_heap(instance_type) <= max(jvm_profiles.MIN_HEAP_MIB,
+                                                   nominal * jvm_profiles.USABLE_MEMORY_RATIO - 700 - sidecars)
+
+
+def test_m5_xlarge_heap_fits_in_memtotal():
+    # MemTotal on an m5.xlarge is about 15.6GB; the whole heap is touched at startup, so it has to fit with room to spare
+    assert single_world_heap("m5.xlarge") < 15600 - 700
+
+
+def test_more_worlds_leave_less_memory():
+    assert jvm_profiles.usable_memory_mib("m5.large", worlds=3) < jvm_profiles.usable_memory_mib("m5.large", worlds=1)
+
+
+@pytest.mark.parametrize("instance_type, worlds", [("m5.large", 2), ("m5.xlarge", 3), ("r5.large", 4)])
+def test_each_worlds_jvm_fits_its_memory_limit(instance_type, worlds):
+    settings = world_settings([{"name": "server"}] + [{"name": f"world{n}"} for n in range(1, worlds)])
+    for memory_mib, heap in jvm_profiles.world_memory(instance_type, settings):
+        assert jvm_profiles.MIN_HEAP_MIB <= heap
+        assert jvm_profiles.jvm_memory_mib(heap) <= memory_mib
+
+
+def test_worlds_that_dont_fit_fail_the_synth():
+    # Used to get -Xmx512M under a 449M MemoryLimit
+    settings = world_settings([{"name": "server"}, {"name": "creative"}, {"name": "lobby"}])
+    with pytest.raises(ValueError, match="World server"):
+        jvm_profiles.world_memory("t3a.small", settings)
+
+
+def test_small_share_fails_even_on_a_big_instance():
+    settings = world_settings([{"name": "server"}, {"name": "lobby", "memoryShare": 0.02}])
+    with pytest.raises(ValueError, match="World lobby"):
+        jvm_profiles.world_memory("m5.xlarge", settings)
+
+
+def test_profiles():
+    assert "-XX:+UseZGC" in jvm_profiles.jvm_profile("r5.2xlarge", 60000)["JVM_OPTS"]
+    assert "-XX:+UseG1GC" in jvm_profiles.jvm_profile("t3.large", 6000)["JVM_OPTS"]
+    minimal = jvm_profiles.jvm_profile("t3.large", 6000, profile="minimal")
+    assert minimal["MCMINMEM"] == f"{jvm_profiles.MIN_HEAP_MIB}M" and minimal["MCMAXMEM"] == "6000M"
+    assert max_heap(jvm_profiles.jvm_profile("t3.micro", 100)) == jvm_profiles.MIN_HEAP_MIB
+    with pytest.raises(ValueError):
+        jvm_profiles.jvm_profile("t3.large", 6000, profile="fast")
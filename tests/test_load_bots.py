@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import load_bots
+
+
+class FakeConsole:
+
+    def command(self, command):
+        return {"mspt": "§6Server tick times §e(§7avg§e/§7min§e/§7max§e)§6 from last 5s§7,§6 10s§7,§6 1m§e:\n"
+                        "§6◴ §a12.3§7/§a8.1§7/§a20.4§e, §a12.0§7/§a7.9§7/§a25.1§e, §a11.8§7/§a7.5§7/§a30.2",
+                "tps": "§6TPS from last 1m, 5m, 15m: §a20.0, §a20.0, §a20.0"}[command]
+
+
+def run_sampler(monkeypatch, rss):
+    monkeypatch.setattr(load_bots, "process_cpu_seconds", lambda pid: time.monotonic())
+    monkeypatch.setattr(load_bots, "process_rss_mib", lambda pid: rss)
+    samples = []
+    started = time.monotonic()
+    asyncio.run(load_bots.sample(FakeConsole(), 1, [], started, started + 0.05, 0.01, samples))
+    return samples
+
+
+def test_rss_is_rounded(monkeypatch):
+    samples = run_sampler(monkeypatch, 2047.6)
+    assert samples and all(s["rss_mib"] == 2048 for s in samples)
+
+
+def test_missing_rss_is_recorded_as_none(monkeypatch):
+    samples = run_sampler(monkeypatch, None)
+    assert samples and all(s["rss_mib"] is None for s in samples)
+    assert load_bots.summarize(samples)["rss_mib_max"] is None
+
+
+def test_summarize():
+    samples = [{"mspt": mspt, "mspt_max": mspt * 2, "tps": 20.0, "cpu_percent": 50.0, "rss_mib": 1000 + mspt}
+               for mspt in range(1, 101)]
+    summary = load_bots.summarize(samples)
+    assert summary["mspt_p50"] == 51 and summary["mspt_p95"] == 96 and summary["mspt_max"] == 200
+    assert summary["cpu_percent_avg"] == 50.0 and summary["rss_mib_max"] == 1100
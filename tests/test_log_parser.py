@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import log_parser
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = tmp_path / "latest.log"
+    path.write_text("[12:00:00 INFO]: Steve joined the game\n")
+    return path
+
+
+def lines_until_idle(follower):
+    # Everything follow() has for now, up to its first "nothing new"
+    found = []
+    for line in follower:
+        if line is None:
+            return found
+        found.append(line)
+
+
+def test_existing_log_is_followed_from_its_end(log):
+    follower = log_parser.follow(str(log), poll=0)
+    assert lines_until_idle(follower) == []
+    with open(log, "a") as fp:
+        fp.write("[12:00:01 INFO]: Alex joined the game\n")
+    assert lines_until_idle(follower) == ["[12:00:01 INFO]: Alex joined the game\n"]
+
+
+def test_rotated_log_is_read_from_the_top(log):
+    follower = log_parser.follow(str(log), poll=0)
+    lines_until_idle(follower)
+    with open(log, "a") as fp:
+        fp.write("[12:00:01 INFO]: Steve left the game\n")
+    os.rename(log, log.with_name("2021-08-01-1.log"))
+    log.write_text("[12:05:00 INFO]: Starting minecraft server\n")
+    lines = lines_until_idle(follower) + lines_until_idle(follower)
+    assert lines == ["[12:00:01 INFO]: Steve left the game\n", "[12:05:00 INFO]: Starting minecraft server\n"]
+
+
+def test_truncated_log_is_read_from_the_top(log):
+    follower = log_parser.follow(str(log), poll=0)
+    lines_until_idle(follower)
+    log.write_text("x\n")
+    assert lines_until_idle(follower) + lines_until_idle(follower) == ["x\n"]
+
+
+def test_log_that_appears_later_is_read_from_the_top(tmp_path, monkeypatch):
+    path = tmp_path / "latest.log"
+
+    def server_starts(seconds):
+        # The server starts writing while follow() waits for the file
+        path.write_text("[12:00:00 INFO]: Steve joined the game\n")
+
+    monkeypatch.setattr(log_parser.time, "sleep", server_starts)
+    assert next(log_parser.follow(str(path), poll=0)) == "[12:00:00 INFO]: Steve joined the game\n"
+
+
+def test_half_written_lines_wait_for_the_rest(log):
+    follower = log_parser.follow(str(log), poll=0)
+    lines_until_idle(follower)
+    with open(log, "a") as fp:
+        fp.write("[12:00:01 INFO]: <Steve> hel")
+    assert lines_until_idle(follower) == []
+    with open(log, "a") as fp:
+        fp.write("lo\n")
+    assert lines_until_idle(follower) == ["[12:00:01 INFO]: <Steve> hello\n"]
+
+
+def test_restart_doesnt_count_events_twice(log, tmp_path):
+    out = tmp_path / "events.log"
+    for _ in range(2):
+        # Each run stops at the first idle poll, like a crash and a Restart=always
+        with open(out, "a") as fp:
+            log_parser.run(log_parser.Parser("server", sample=0), lines_until_idle(log_parser.follow(str(log), poll=0)), fp)
+    assert out.read_text() == ""
+
+
+def test_parse_events():
+    parser = log_parser.Parser("server", sample=0)
+    assert parser.parse("[12:00:00 INFO]: Steve joined the game") == {"event": "join", "player": "Steve",
+                                                                       "world": "server"}
+    assert parser.parse("[12:00:00] [Server thread/INFO]: <Alex> hi") == {"event": "chat", "player": "Alex",
+                                                                          "message": "hi", "world": "server"}
+    lag = parser.parse("[12:00:00 WARN]: Can't keep up! Is the server overloaded? Running 2010ms or 40 ticks behind")
+    assert lag["behind_ms"] == 2010 and lag["ticks_behind"] == 40
+    assert parser.parse("\tat net.minecraft.server.MinecraftServer.run(MinecraftServer.java:1)") is None
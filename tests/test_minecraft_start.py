@@ -0,0 +1,155 @@
+import datetime
+import json
+
+import botocore.exceptions
+import pytest
+
+import index
+
+
+class FakeEC2:
+    # The instance as describe_instances reports it, and every call made
+
+    def __init__(self, state="stopped", public_ip=None, tags=None):
+        self.state = state
+        self.public_ip = public_ip
+        self.tags = dict(tags or {})
+        self.calls = []
+
+    def describe_instances(self, InstanceIds):
+        self.calls.append("describe_instances")
+        instance = {"InstanceId": InstanceIds[0], "State": {"Name": self.state},
+                    "LaunchTime": datetime.datetime.now(datetime.timezone.utc),
+                    "Tags": [{"Key": key, "Value": value} for key, value in self.tags.items()]}
+        if self.public_ip:
+            instance["PublicIpAddress"] = self.public_ip
+        return {"Reservations": [{"Instances": [instance]}]}
+
+    def start_instances(self, InstanceIds):
+        self.calls.append("start_instances")
+        self.state = "pending"
+
+    def create_tags(self, Resources, Tags):
+        self.calls.append("create_tags")
+        self.tags.update({tag["Key"]: tag["Value"] for tag in Tags})
+
+
+@pytest.fixture
+def lambda_env(monkeypatch):
+    monkeypatch.setenv("INSTANCE_ID", "i-0123456789")
+    monkeypatch.delenv("PASSWORD", raising=False)
+    monkeypatch.setattr(index, "_instance_cache", {})
+    monkeypatch.setattr(index.time, "sleep", lambda seconds: None)
+    answers = []
+    monkeypatch.setattr(index, "server_answers", lambda host, port=index.MINECRAFT_PORT, timeout=2: answers.pop(0)
+                        if answers else False)
+    return answers
+
+
+def use_ec2(monkeypatch, fake):
+    monkeypatch.setattr(index, "ec2", fake)
+    return fake
+
+
+def call(path="/"):
+    response = index.main({"path": path}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_describe_instance_is_cached(lambda_env, monkeypatch):
+    fake = use_ec2(monkeypatch, FakeEC2("running", "203.0.113.10"))
+    index.describe_instance("i-1")
+    index.describe_instance("i-1")
+    assert fake.calls.count("describe_instances") == 1
+    index.describe_instance("i-1", max_age=0)
+    assert fake.calls.count("describe_instances") == 2
+
+
+def test_stopped_instance_is_started_and_traced(lambda_env, monkeypatch):
+    fake = use_ec2(monkeypatch, FakeEC2("stopped"))
+    status, body = call()
+    assert status == 200
+    assert body["state"] == "pending" and body["message"] == "Server is starting"
+    assert fake.calls.count("start_instances") == 1
+    assert json.loads(fake.tags[index.TRACE_TAG])["id"] == body["trace_id"]
+    assert body["eta_seconds"] > 0 and not body["joinable"]
+
+
+@pytest.mark.parametrize("state", ["pending", "running"])
+def test_starting_or_running_instance_is_not_started_again(lambda_env, monkeypatch, state):
+    fake = use_ec2(monkeypatch, FakeEC2(state, "203.0.113.10"))
+    status, body = call()
+    assert status == 200 and body["state"] == state
+    assert "start_instances" not in fake.calls and "create_tags" not in fake.calls
+
+
+@pytest.mark.parametrize("state", ["stopping", "shutting-down", "terminated"])
+def test_instance_that_cant_start_is_a_conflict(lambda_env, monkeypatch, state):
+    fake = use_ec2(monkeypatch, FakeEC2(state))
+    status, body = call()
+    assert status == 409
+    assert "start_instances" not in fake.calls
+
+
+def test_running_server_that_answers_is_joinable(lambda_env, monkeypatch):
+    use_ec2(monkeypatch, FakeEC2("running", "203.0.113.10",
+                                 {index.DNS_TAG: json.dumps({"name": "mc.example.com.", "ip": "203.0.113.10"})}))
+    lambda_env.append(True)
+    status, body = call()
+    assert body["joinable"] and body["eta_seconds"] == 0
+    assert body["message"] == "Server is ready to join"
+    assert body["dns_name"] == "mc.example.com." and body["dns_ready"]
+
+
+def test_dns_record_for_an_old_ip_is_not_ready(lambda_env, monkeypatch):
+    use_ec2(monkeypatch, FakeEC2("running", "203.0.113.20", {index.DNS_TAG: json.dumps({"ip": "203.0.113.10"})}))
+    status, body = call()
+    assert not body["dns_ready"]
+
+
+def test_wait_long_polls_until_the_server_answers(lambda_env, monkeypatch):
+    fake = use_ec2(monkeypatch, FakeEC2("running", "203.0.113.10"))
+    lambda_env.extend([False, False, True])
+    status, body = call("/wait")
+    assert status == 200 and body["joinable"]
+    assert not lambda_env
+
+
+def test_wait_gives_up_before_api_gateway_does(lambda_env, monkeypatch):
+    use_ec2(monkeypatch, FakeEC2("running", "203.0.113.10"))
+    clock = [1000.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    monkeypatch.setattr(index.time, "time", lambda: clock[0])
+    monkeypatch.setattr(index.time, "sleep", sleep)
+    status, body = call("/wait")
+    assert not body["joinable"] and body["state"] == "running"
+    assert clock[0] - 1000.0 <= index.WAIT_SECONDS
+
+
+def test_wait_on_a_conflict_answers_straight_away(lambda_env, monkeypatch):
+    use_ec2(monkeypatch, FakeEC2("stopping"))
+    status, body = call("/wait")
+    assert status == 409 and not body["joinable"]
+
+
+def test_password_is_checked_before_anything_else(lambda_env, monkeypatch):
+    fake = use_ec2(monkeypatch, FakeEC2("stopped"))
+    monkeypatch.setenv("PASSWORD", "hunter2")
+    assert call("/wrong")[0] == 401
+    assert fake.calls == []
+    status, body = call("/hunter2")
+    assert status == 200 and "start_instances" in fake.calls
+
+
+def test_access_denied_is_reported(lambda_env, monkeypatch):
+    fake = use_ec2(monkeypatch, FakeEC2("stopped"))
+
+    def denied(InstanceIds):
+        raise botocore.exceptions.ClientError({"Error": {"Code": "UnauthorizedOperation"}}, "StartInstances")
+
+    fake.start_instances = denied
+    status, body = call()
+    assert status == 403
@@ -0,0 +1,112 @@
+import datetime
+
+import pytest
+
+import pregen
+
+
+class FakeCloudWatch:
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda **kwargs: self.calls.append((name, kwargs))
+
+
+class FakeGenerator:
+    # Generates a square per call, until players show up after join_after squares
+
+    def __init__(self, join_after=None):
+        self.generated = []
+        self.join_after = join_after
+
+    def players(self):
+        return 1 if self.join_after is not None and len(self.generated) >= self.join_after else 0
+
+    def generate(self, square):
+        self.generated.append(square)
+        return True
+
+
+class FakeCheckpoint:
+
+    def __init__(self, done=0):
+        self.done = done
+
+    def load(self):
+        return self.done
+
+    def save(self, done):
+        self.done = done
+
+
+@pytest.fixture(autouse=True)
+def quiet_metrics(monkeypatch):
+    monkeypatch.setattr(pregen.emf, "emit", lambda *args, **kwargs: None)
+
+
+def test_idle_alarm_is_held_off_and_reset_to_ok(monkeypatch):
+    cloudwatch = FakeCloudWatch()
+    monkeypatch.setattr(pregen.boto3, "client", lambda *args, **kwargs: cloudwatch)
+    with pregen.IdleAlarm("minecraft-idle"):
+        assert [name for name, _ in cloudwatch.calls] == ["disable_alarm_actions"]
+    assert [name for name, _ in cloudwatch.calls] == ["disable_alarm_actions", "enable_alarm_actions", "set_alarm_state"]
+    assert cloudwatch.calls[-1][1]["AlarmName"] == "minecraft-idle" and cloudwatch.calls[-1][1]["StateValue"] == "OK"
+
+
+def test_idle_alarm_is_reset_when_the_run_fails(monkeypatch):
+    cloudwatch = FakeCloudWatch()
+    monkeypatch.setattr(pregen.boto3, "client", lambda *args, **kwargs: cloudwatch)
+    with pytest.raises(ConnectionError):
+        with pregen.IdleAlarm("minecraft-idle"):
+            raise ConnectionError("server went away")
+    assert cloudwatch.calls[-1][0] == "set_alarm_state"
+
+
+def test_without_an_alarm_nothing_is_called():
+    with pregen.IdleAlarm(None) as alarm:
+        assert alarm.client is None
+
+
+def test_run_finishes_the_radius():
+    todo = pregen.squares(300)
+    checkpoint = FakeCheckpoint()
+    reason, _ = pregen.run(FakeGenerator(), checkpoint, todo, 60, "", {})
+    assert reason == "done" and checkpoint.done == len(todo)
+
+
+def test_run_carries_on_from_the_checkpoint():
+    todo = pregen.squares(300)
+    generator = FakeGenerator()
+    pregen.run(generator, FakeCheckpoint(3), todo, 60, "", {})
+    assert generator.generated == todo[3:]
+
+
+def test_run_stops_for_players():
+    checkpoint = FakeCheckpoint()
+    reason, _ = pregen.run(FakeGenerator(join_after=2), checkpoint, pregen.squares(300), 60, "", {})
+    assert reason == "playing" and checkpoint.done == 2
+
+
+def test_run_stops_at_max_minutes():
+    reason, _ = pregen.run(FakeGenerator(), FakeCheckpoint(), pregen.squares(300), -1, "", {})
+    assert reason == "out_of_time"
+
+
+def test_hold_marker(tmp_path):
+    pregen.hold(str(tmp_path), "overworld", "done")
+    assert (tmp_path / "pregen-overworld.hold").read_text() == "done\n"
+
+
+def test_squares_go_nearest_first():
+    todo = pregen.squares(1000)
+    rings = [max(abs(x), abs(z)) for x, z in todo]
+    assert todo[0] == (0, 0) and rings == sorted(rings)
+    assert len(set(todo)) == len(todo)
+
+
+@pytest.mark.parametrize("hours, hour, expected", [("", 12, True), ("2-8", 2, True), ("2-8", 8, False),
+                                                   ("22-6", 23, True), ("22-6", 3, True), ("22-6", 12, False)])
+def test_in_hours(hours, hour, expected):
+    assert pregen.in_hours(hours, datetime.datetime(2021, 8, 1, hour)) == expected
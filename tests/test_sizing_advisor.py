@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+import sizing_advisor
+
+MINUTE = 60
+START = 1609459200      # 2021-01-01
+
+
+def session(begin, minutes, cpu, players=4, mem=60, swap=0, mspt=20):
+    t = np.arange(minutes)
+    return np.column_stack([begin + t * MINUTE, np.full(minutes, cpu, float), np.full(minutes, mem, float),
+                            np.full(minutes, swap, float), np.full(minutes, 2.0), np.full(minutes, players, float),
+                            np.full(minutes, mspt, float)])
+
+
+def history_file(tmp_path, *sessions):
+    path = tmp_path / "history.csv"
+    np.savetxt(path, np.concatenate(sessions), delimiter=",", header=",".join(sizing_advisor.COLUMNS), comments="",
+               fmt="%.2f")
+    return path
+
+
+def evenings(days=30, **kwargs):
+    return [session(START + day * 86400 + 19 * 3600, 180, **kwargs) for day in range(days)]
+
+
+@pytest.fixture
+def light(tmp_path):
+    # A few friends on a t3a.small that's mostly idle
+    return sizing_advisor.read_history(history_file(tmp_path, *evenings(cpu=12)))
+
+
+@pytest.fixture
+def busy(tmp_path):
+    # Always over a t3a.small's 20% baseline, so it has been living on credits
+    return sizing_advisor.read_history(history_file(tmp_path, *evenings(cpu=55)))
+
+
+def advise(history, current="t3a.small", **kwargs):
+    return sizing_advisor.advise(history, current, 0.3, sizing_advisor.PRICES, **kwargs)
+
+
+def test_light_use_stays_on_a_small_burstable(light):
+    result = advise(light)
+    recommended = result["recommended"]["instance_type"]
+    assert recommended.startswith("t") and recommended.endswith(".small")
+    assert result["hours_per_month"] == pytest.approx(3 * 365 / 12, rel=0.1)
+
+
+def test_busy_server_leaves_burstable_types(busy):
+    result = advise(busy)
+    needed = result["needed"]
+    assert needed["average_vcpus"] == pytest.approx(1.1)
+    recommended = result["recommended"]["instance_type"]
+    # t*.large has 2 vCPUs at a 30% baseline (0.6 vCPU), not enough to run at 1.1 vCPU all the time
+    assert not sizing_advisor.fits("t3.large", needed)
+    assert not recommended.startswith("t")
+    assert sizing_advisor.fits(recommended, needed)
+
+
+@pytest.mark.parametrize("instance_type, average_vcpus, expected", [
+    ("t3.large", 0.6, True), ("t3.large", 0.61, False),         # 2 vCPU at 30%
+    ("t3a.small", 0.4, True), ("t3a.small", 0.41, False),       # 2 vCPU at 20%
+    ("t3.xlarge", 1.6, True), ("t3.xlarge", 1.61, False),       # 4 vCPU at 40%
+    ("m5.large", 2.0, True)])                                   # no baseline
+def test_burst_baselines(instance_type, average_vcpus, expected):
+    needed = {"vcpus": 1, "min_vcpus": 1, "memory_mib": 1024, "average_vcpus": average_vcpus}
+    assert sizing_advisor.fits(instance_type, needed) == expected
+
+
+def test_memory_and_vcpus_still_have_to_fit():
+    assert not sizing_advisor.fits("m5.large", {"vcpus": 2.1, "min_vcpus": 1, "memory_mib": 1024, "average_vcpus": 0})
+    assert not sizing_advisor.fits("c5.large", {"vcpus": 1, "min_vcpus": 1, "memory_mib": 4097, "average_vcpus": 0})
+
+
+def test_lag_keeps_at_least_the_current_cores(tmp_path):
+    history = sizing_advisor.read_history(history_file(tmp_path, *evenings(cpu=12, mspt=70)))
+    result = advise(history, current="m5.xlarge")
+    assert result["needed"]["min_vcpus"] == 4
+    assert sizing_advisor.instance_spec(result["recommended"]["instance_type"]).vcpus >= 4
+
+
+def test_swapping_asks_for_more_memory(tmp_path):
+    history = sizing_advisor.read_history(history_file(tmp_path, *evenings(cpu=12, mem=95, swap=20)))
+    result = advise(history)
+    assert result["needed"]["swapping"]
+    assert sizing_advisor.instance_spec(result["recommended"]["instance_type"]).memory_mib > 2048
+
+
+def test_empty_server_minutes_dont_count(tmp_path):
+    # A CPU spike nobody was online for shouldn't size the server
+    quiet = session(START, 120, cpu=10)
+    spike = session(START + 120 * MINUTE, 30, cpu=100, players=0)
+    history = sizing_advisor.read_history(history_file(tmp_path, quiet, spike))
+    assert sizing_advisor.requirement(history, "t3a.small", 0.3)["cpu_p95_percent"] == 10
+
+
+def test_sessions_split_on_gaps(tmp_path):
+    history = sizing_advisor.read_history(history_file(tmp_path, *evenings(days=3, cpu=20)))
+    stats = sizing_advisor.session_stats(history)
+    assert len(stats) == 3 and all(row["minutes"] == 180 for row in stats)
+    assert stats[0]["peak_players"] == 4 and stats[0]["cpu_percent_p95"] == 20
+
+
+def test_budget_limit(light):
+    assert advise(light, budget_limit=1)["within_budget"] is False
+    assert advise(light, budget_limit=100)["within_budget"] is True
+
+
+def test_history_is_read_in_chunks_and_sorted(tmp_path):
+    path = history_file(tmp_path, session(START + 3600, 50, cpu=30), session(START, 50, cpu=10))
+    history = sizing_advisor.read_history(path, chunk_rows=7)
+    assert len(history) == 100 and np.all(np.diff(history[:, 0]) > 0)
+
+
+def test_wrong_file_is_rejected(tmp_path):
+    path = tmp_path / "other.csv"
+    path.write_text("a,b,c\n1,2,3\n")
+    with pytest.raises(ValueError):
+        sizing_advisor.read_history(path)
+
+
+def test_generated_history_gets_advice(tmp_path):
+    sizing_advisor.generate(str(tmp_path / "history.csv"), 30, np.random.default_rng(1))
+    result = advise(sizing_advisor.read_history(tmp_path / "history.csv"))
+    assert result["recommended"] is not None
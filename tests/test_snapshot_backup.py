@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import snapshot_backup
+
+NAME = "minecraft"
+NOW = datetime(2021, 6, 1, tzinfo=timezone.utc)
+
+
+class FakeEC2:
+    # The instance with the launch template's blank world volume, and whatever snapshots are given.  Every call is
+    # recorded in order, so tests can check what happened to which volume when.
+
+    def __init__(self, found=()):
+        self.found = list(found)
+        self.volumes = {"vol-blank": {"VolumeId": "vol-blank", "VolumeType": "gp3", "Size": 8, "Iops": 3000,
+                                      "Throughput": 125, "Tags": []}}
+        self.attached = {snapshot_backup.WORLD_DEVICE: "vol-blank"}
+        self.calls = []
+
+    def describe_instances(self, InstanceIds):
+        mappings = [{"DeviceName": device, "Ebs": {"VolumeId": volume_id}} for device, volume_id in self.attached.items()]
+        return {"Reservations": [{"Instances": [{"InstanceId": InstanceIds[0], "BlockDeviceMappings": mappings,
+                                                 "Placement": {"AvailabilityZone": "us-east-1a"}}]}]}
+
+    def get_paginator(self, operation):
+        fake = self
+
+        class Paginator:
+            def paginate(self, OwnerIds, Filters):
+                def matches(snapshot, wanted):
+                    tags = {tag["Key"]: tag["Value"] for tag in snapshot.get("Tags", [])}
+                    return tags.get(wanted["Name"][len("tag:"):]) in wanted["Values"]
+                yield {"Snapshots": [snapshot for snapshot in fake.found if all(matches(snapshot, f) for f in Filters)]}
+        return Paginator()
+
+    def create_snapshot(self, VolumeId, Description, TagSpecifications):
+        snapshot_id = f"snap-{len(self.found) + 1}"
+        self.calls.append(("create_snapshot", VolumeId))
+        self.found.append({"SnapshotId": snapshot_id, "VolumeId": VolumeId, "StartTime": datetime.now(timezone.utc),
+                           "State": "pending", "VolumeSize": 8, "Tags": TagSpecifications[0]["Tags"]})
+        return {"SnapshotId": snapshot_id}
+
+    def delete_snapshot(self, SnapshotId):
+        self.calls.append(("delete_snapshot", SnapshotId))
+        self.found = [snapshot for snapshot in self.found if snapshot["SnapshotId"] != SnapshotId]
+
+    def describe_volumes(self, VolumeIds):
+        return {"Volumes": [self.volumes[volume_id] for volume_id in VolumeIds]}
+
+    def create_tags(self, Resources, Tags):
+        self.calls.append(("create_tags", Resources[0]))
+        for resource in Resources:
+            self.volumes[resource]["Tags"] += Tags
+
+    def create_volume(self, SnapshotId, AvailabilityZone, VolumeType, Size, TagSpecifications, **settings):
+        volume_id = f"vol-{SnapshotId}"
+        self.calls.append(("create_volume", SnapshotId))
+        self.volumes[volume_id] = dict(VolumeId=volume_id, VolumeType=VolumeType, Size=Size,
+                                       Tags=TagSpecifications[0]["Tags"], **settings)
+        return {"VolumeId": volume_id}
+
+    def get_waiter(self, name):
+        class Waiter:
+            def wait(self, VolumeIds):
+                pass
+        return Waiter()
+
+    def detach_volume(self, VolumeId, InstanceId):
+        self.calls.append(("detach_volume", VolumeId))
+        del self.attached[snapshot_backup.WORLD_DEVICE]
+
+    def attach_volume(self, VolumeId, InstanceId, Device):
+        self.calls.append(("attach_volume", VolumeId))
+        self.attached[Device] = VolumeId
+
+    def modify_instance_attribute(self, InstanceId, BlockDeviceMappings):
+        self.calls.append(("modify_instance_attribute", BlockDeviceMappings[0]["DeviceName"]))
+
+    def delete_volume(self, VolumeId):
+        self.calls.append(("delete_volume", VolumeId))
+        del self.volumes[VolumeId]
+
+    def enable_fast_snapshot_restores(self, AvailabilityZones, SourceSnapshotIds):
+        self.calls.append(("enable_fast_snapshot_restores", SourceSnapshotIds[0]))
+
+    def describe_fast_snapshot_restores(self, Filters):
+        return {"FastSnapshotRestores": [{"State": "enabled"}]}
+
+    def disable_fast_snapshot_restores(self, AvailabilityZones, SourceSnapshotIds):
+        self.calls.append(("disable_fast_snapshot_restores", SourceSnapshotIds[0]))
+
+    def tagged(self, volume_id):
+        return {"Key": snapshot_backup.BACKUP_TAG, "Value": NAME} in self.volumes[volume_id]["Tags"]
+
+
+class FakeConsole:
+    # An RCON console, running=False is a world that's enabled but not running so nothing listens on its port
+
+    def __init__(self, running=True):
+        self.running = running
+        self.commands = []
+        self.closed = False
+
+    def command(self, text):
+        if not self.running:
+            raise ConnectionRefusedError(111, "Connection refused")
+        self.commands.append(text)
+
+    def close(self):
+        self.closed = True
+
+
+def taken(snapshot_id, hours_ago, source=None, state="completed", size=8, start=NOW):
+    tags = [{"Key": snapshot_backup.BACKUP_TAG, "Value": NAME}]
+    if source:
+        tags.append({"Key": snapshot_backup.SOURCE_TAG, "Value": source})
+    return {"SnapshotId": snapshot_id, "VolumeId": "vol-blank", "StartTime": start - timedelta(hours=hours_ago),
+            "State": state, "VolumeSize": size, "Tags": tags}
+
+
+@pytest.fixture(autouse=True)
+def instance(monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot_backup.mc_instance, "instance_id", lambda: "i-0123456789")
+    monkeypatch.setattr(snapshot_backup, "wait_for_device", lambda device: None)
+    monkeypatch.setattr(snapshot_backup, "LOCK_FILE", str(tmp_path / "snapshot.lock"))
+
+
+@pytest.fixture
+def consoles(monkeypatch):
+    found = {"/opt/minecraft/server": FakeConsole(), "/opt/minecraft/creative": FakeConsole(running=False)}
+    monkeypatch.setattr(snapshot_backup.rcon, "from_server_dir", lambda server_dir: found[server_dir])
+    return found
+
+
+def test_no_snapshot_tags_the_blank_volume():
+    ec2 = FakeEC2()
+    assert snapshot_backup.restore(ec2, NAME) is None
+    assert ec2.tagged("vol-blank")
+    assert ec2.attached[snapshot_backup.WORLD_DEVICE] == "vol-blank"
+
+
+def test_stop_snapshot_wins_over_a_newer_lifecycle_one():
+    ec2 = FakeEC2([taken("snap-lifecycle", 1), taken("snap-stop", 5, source="stop"),
+                   taken("snap-old-stop", 30, source="stop"), taken("snap-pending", 0, source="stop", state="pending")])
+    result = snapshot_backup.restore(ec2, NAME)
+    assert result["snapshot"] == "snap-stop"
+    assert ec2.attached[snapshot_backup.WORLD_DEVICE] == "vol-snap-stop"
+
+
+def test_lifecycle_snapshot_when_there_is_no_stop_one():
+    ec2 = FakeEC2([taken("snap-older", 30), taken("snap-newer", 2), taken("snap-stop", 0, source="stop", state="error")])
+    assert snapshot_backup.restore(ec2, NAME)["snapshot"] == "snap-newer"
+
+
+def test_blank_volume_is_tagged_before_it_is_detached_and_deleted():
+    # The role can only detach and delete volumes tagged as this stack's
+    ec2 = FakeEC2([taken("snap-stop", 1, source="stop", size=20)])
+    snapshot_backup.restore(ec2, NAME)
+    names = [call[0] for call in ec2.calls]
+    assert ec2.calls[0] == ("create_tags", "vol-blank")
+    assert names.index("create_tags") < names.index("detach_volume") < names.index("attach_volume") \
+        < names.index("delete_volume")
+    assert ("delete_volume", "vol-blank") in ec2.calls and "vol-blank" not in ec2.volumes
+    restored = ec2.volumes["vol-snap-stop"]
+    assert ec2.tagged("vol-snap-stop")
+    assert (restored["VolumeType"], restored["Size"], restored["Iops"], restored["Throughput"]) == ("gp3", 20, 3000, 125)
+
+
+def test_fast_restore_is_turned_off_again():
+    ec2 = FakeEC2([taken("snap-stop", 1, source="stop")])
+    result = snapshot_backup.restore(ec2, NAME, fast_restore=True)
+    assert result["fast_restore"]
+    names = [call[0] for call in ec2.calls]
+    assert names.index("enable_fast_snapshot_restores") < names.index("create_volume") \
+        < names.index("disable_fast_snapshot_restores") < names.index("detach_volume")
+
+
+def test_snapshot_holds_saves_on_the_running_worlds(consoles):
+    ec2 = FakeEC2()
+    result = snapshot_backup.snapshot(ec2, list(consoles), NAME, 7)
+    assert result["taken"] and ("create_snapshot", "vol-blank") in ec2.calls
+    assert consoles["/opt/minecraft/server"].commands == ["save-off", "save-all flush", "save-on"]
+    # The world that isn't running doesn't stop the others being snapshotted
+    assert consoles["/opt/minecraft/creative"].closed
+    tags = {tag["Key"]: tag["Value"] for tag in ec2.found[0]["Tags"]}
+    assert tags[snapshot_backup.SOURCE_TAG] == "stop" and tags[snapshot_backup.BACKUP_TAG] == NAME
+
+
+def test_recent_snapshot_covers_the_next_world_to_stop(consoles):
+    now = datetime.now(timezone.utc)
+    ec2 = FakeEC2([taken("snap-just-now", 0, source="stop", state="pending", start=now),
+                   taken("snap-other-volume", 0, source="stop", start=now)])
+    ec2.found[1]["VolumeId"] = "vol-other"
+    result = snapshot_backup.snapshot(ec2, list(consoles), NAME, 7)
+    assert result == {"snapshot": "snap-just-now", "taken": False, "seconds": result["seconds"]}
+    assert not ec2.calls and not consoles["/opt/minecraft/server"].commands
+
+    ec2.found[0]["StartTime"] = now - timedelta(seconds=snapshot_backup.RECENT_SECONDS + 1)
+    assert snapshot_backup.snapshot(ec2, list(consoles), NAME, 7)["taken"]
+
+
+def test_prune_keeps_retain_stop_snapshots_and_leaves_lifecycle_ones(consoles):
+    ec2 = FakeEC2([taken(f"snap-stop-{age}", age, source="stop") for age in (1, 2, 3, 4)]
+                  + [taken(f"snap-lifecycle-{age}", age) for age in (1, 5, 9)])
+    result = snapshot_backup.snapshot(ec2, list(consoles), NAME, 2)
+    assert result["pruned"] == 2
+    left = {snapshot["SnapshotId"] for snapshot in ec2.found}
+    # The new one is still pending, so it doesn't count towards retain yet
+    assert left == {"snap-8", "snap-stop-1", "snap-stop-2", "snap-lifecycle-1", "snap-lifecycle-5", "snap-lifecycle-9"}
+
+
+def test_saves_are_resumed_when_the_snapshot_fails(consoles):
+    ec2 = FakeEC2()
+
+    def create_snapshot(**kwargs):
+        raise snapshot_backup.boto3.exceptions.Boto3Error("snapshot limit exceeded")
+    ec2.create_snapshot = create_snapshot
+    with pytest.raises(snapshot_backup.boto3.exceptions.Boto3Error):
+        snapshot_backup.snapshot(ec2, list(consoles), NAME, 7)
+    assert consoles["/opt/minecraft/server"].commands[-1] == "save-on"
+    assert consoles["/opt/minecraft/server"].closed
@@ -0,0 +1,129 @@
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import HTTPServer
+
+import pytest
+
+import spot_watcher
+
+
+@pytest.fixture
+def metadata(monkeypatch):
+    # spot_watcher's own stand-in for the metadata service, on a free local port.  Set interrupt_at to send a notice.
+    monkeypatch.setattr(spot_watcher.FakeMetadata, "interrupt_at", float("inf"))
+    server = HTTPServer(("127.0.0.1", 0), spot_watcher.FakeMetadata)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/latest/meta-data/"
+    server.shutdown()
+
+
+def notice_in(seconds):
+    return {"action": "stop",
+            "time": (datetime.now(timezone.utc) + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+
+def test_no_notice_until_the_instance_is_marked(metadata):
+    assert spot_watcher.interruption_notice(metadata) is None
+
+
+def test_notice_gives_two_minutes(metadata, monkeypatch):
+    monkeypatch.setattr(spot_watcher.FakeMetadata, "interrupt_at", time.time())
+    notice = spot_watcher.interruption_notice(metadata)
+    assert notice["action"] == "stop"
+    assert 100 < spot_watcher.seconds_left(spot_watcher.notice_deadline(notice)) + spot_watcher.SAFETY_SECONDS <= 120
+
+
+@pytest.fixture
+def fast_tier(monkeypatch):
+    monkeypatch.setattr(spot_watcher, "on_fast_tier", lambda server_dir: True)
+
+
+def test_watch_saves_every_world_when_the_notice_comes(metadata, monkeypatch, fast_tier):
+    monkeypatch.setattr(spot_watcher.FakeMetadata, "interrupt_at", time.time() + 0.5)
+    result = spot_watcher.watch(["/opt/minecraft/server", "/opt/minecraft/creative"], metadata_url=metadata, poll=0.1,
+                                dry_run=True)
+    assert [step for step in result if " " in step] == ["sync server", "sync creative", "backup server",
+                                                         "backup creative"]
+    assert all(result[step] for step in result if " " in step)
+    assert result["seconds_to_spare"] > 60
+
+
+def test_watch_ignores_metadata_errors(metadata, monkeypatch):
+    answers = [spot_watcher.requests.ConnectionError("metadata service restarting"), None, notice_in(120)]
+
+    def interruption_notice(url):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(spot_watcher, "interruption_notice", interruption_notice)
+    result = spot_watcher.watch(["/opt/minecraft/server"], poll=0, dry_run=True)
+    assert result["backup server"] and not answers
+
+
+def test_snapshot_backend_is_used_for_the_backup(monkeypatch, capsys):
+    monkeypatch.setenv("BACKUP_BACKEND", "snapshot")
+    spot_watcher.save_before_interruption(notice_in(120), ["/opt/minecraft/server"], dry_run=True)
+    assert "snapshot_backup.py snapshot --server-dir /opt/minecraft/server" in capsys.readouterr().out
+
+
+def test_steps_are_skipped_once_time_is_up(fast_tier):
+    result = spot_watcher.save_before_interruption(notice_in(spot_watcher.SAFETY_SECONDS - 5), ["/opt/minecraft/server"],
+                                                   dry_run=True)
+    assert not result["sync server"] and not result["backup server"]
+
+
+def test_step_that_runs_over_is_abandoned():
+    deadline = spot_watcher.notice_deadline(notice_in(spot_watcher.SAFETY_SECONDS + 2))
+    started = time.monotonic()
+    assert not spot_watcher.run_step("backup", [sys.executable, "-c", "import time; time.sleep(30)"], deadline, False)
+    assert time.monotonic() - started < 5
+
+
+def test_failed_step_is_reported():
+    deadline = spot_watcher.notice_deadline(notice_in(120))
+    assert not spot_watcher.run_step("sync", [sys.executable, "-c", "raise SystemExit(1)"], deadline, False)
+    assert spot_watcher.run_step("sync", [sys.executable, "-c", "pass"], deadline, False)
+
+
+def test_simulate():
+    result = spot_watcher.simulate(0.2, ["/opt/minecraft/server"])
+    assert result["backup server"]
+    assert result["noticed_after_seconds"] <= 1.5
+
+
+class FakeConsole:
+    def __init__(self, running=True):
+        self.running = running
+        self.commands = []
+        self.closed = False
+
+    def command(self, text):
+        if not self.running:
+            raise ConnectionRefusedError(111, "Connection refused")
+        self.commands.append(text)
+
+    def close(self):
+        self.closed = True
+
+
+def test_world_that_isnt_running_is_backed_up_from_disk(monkeypatch):
+    consoles = {"/opt/minecraft/server": FakeConsole(), "/opt/minecraft/creative": FakeConsole(running=False)}
+    monkeypatch.setattr(spot_watcher.rcon, "from_server_dir", lambda server_dir: consoles[server_dir])
+    ran = []
+    monkeypatch.setattr(spot_watcher, "run_step", lambda name, command, deadline, dry_run: ran.append(command) or True)
+    result = spot_watcher.save_before_interruption(notice_in(120), list(consoles))
+    assert result["backup server"] and result["backup creative"]
+    assert consoles["/opt/minecraft/server"].commands[1] == "save-all flush"
+    assert consoles["/opt/minecraft/creative"].closed and not consoles["/opt/minecraft/creative"].commands
+    assert len(ran) == 2
+
+
+def test_no_sync_without_a_hydrated_fast_tier(monkeypatch, tmp_path):
+    monkeypatch.setattr(spot_watcher.world_sync, "FAST_DIR", str(tmp_path))
+    assert not spot_watcher.on_fast_tier("/opt/minecraft/server")
+    result = spot_watcher.save_before_interruption(notice_in(120), ["/opt/minecraft/server"], dry_run=True)
+    assert "sync server" not in result and result["backup server"]
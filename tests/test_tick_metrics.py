@@ -0,0 +1,117 @@
+import json
+import socket
+import threading
+
+import pytest
+
+import emf
+import tick_metrics
+
+# What Paper 1.17 answers over RCON, colour codes and all
+TPS = "§6TPS from last 1m, 5m, 15m: §a*20.0, §a19.97, §a19.5"
+MSPT = ("§6Server tick times §e(§7avg§e/§7min§e/§7max§e)§6 from last 5s§7,§6 10s§7,§6 1m§e:\n"
+        "§6◴ §a12.3§7/§a4.1§7/§c61.7§7, §a11.0§7/§a4.1§7/§c61.7§7, §a10.2§7/§a3.9§7/§c75.0")
+CHUNKS = ("Chunks in world: Total: 625 Inactive: 0 Border: 104 Ticking: 441 Entity: 80\n"
+          "Chunks in world_nether: Total: 25 Inactive: 0 Border: 16 Ticking: 9 Entity: 0\n"
+          "Chunks in world_the_end: Total: 0 Inactive: 0 Border: 0 Ticking: 0 Entity: 0\n"
+          "Chunks in all listed worlds: Total: 650 Inactive: 0 Border: 120 Ticking: 450 Entity: 80")
+ENTITIES = "Test passed, count: 1234"
+UNKNOWN = "Unknown or incomplete command, see below for error"
+
+
+class Console:
+    def __init__(self, answers):
+        self.answers = answers
+
+    def command(self, text):
+        return self.answers.get(text, UNKNOWN)
+
+
+def test_parse_tps_takes_the_last_minute():
+    assert tick_metrics.parse_tps(TPS) == 20.0
+    assert tick_metrics.parse_tps("TPS from last 1m, 5m, 15m: 14.2, 18.0, 19.9") == 14.2
+    assert tick_metrics.parse_tps(UNKNOWN) is None
+
+
+def test_parse_mspt_takes_average_and_max_of_the_last_5s():
+    assert tick_metrics.parse_mspt(MSPT) == (12.3, 61.7)
+    assert tick_metrics.parse_mspt(UNKNOWN) is None
+    assert tick_metrics.parse_mspt(None) is None
+
+
+def test_parse_chunks():
+    assert tick_metrics.parse_chunks(CHUNKS) == 650
+    assert tick_metrics.parse_chunks(CHUNKS.split("\n", 1)[0]) == 625
+    assert tick_metrics.parse_chunks(UNKNOWN) is None
+
+
+def test_parse_entities():
+    assert tick_metrics.parse_entities(ENTITIES) == 1234
+    assert tick_metrics.parse_entities("Test failed") is None
+
+
+def test_collect_paper():
+    answers = {"tps": TPS, "mspt": MSPT, "paper chunkinfo *": CHUNKS,
+               "execute if entity @e": ENTITIES}
+    assert tick_metrics.collect(Console(answers)) == {"tps": (20.0, "None"), "mspt": (12.3, "Milliseconds"),
+                                                      "mspt_max": (61.7, "Milliseconds"),
+                                                      "loaded_chunks": (650, "Count"), "entities": (1234, "Count")}
+
+
+def test_collect_vanilla_only_has_entities():
+    assert tick_metrics.collect(Console({"execute if entity @e": ENTITIES})) == {"entities": (1234, "Count")}
+
+
+def test_emf_document():
+    doc = emf.document({"mspt": (12.3, "Milliseconds"), "tps": (20.0, "None")},
+                       {"InstanceId": "i-0123456789", "World": "server"}, resolution=1, timestamp=1622548800.5,
+                       dimension_sets=[["World", "InstanceId"], ["InstanceId"]], properties={"session": "abc"})
+    assert doc["_aws"] == {"Timestamp": 1622548800500, "LogGroupName": emf.LOG_GROUP,
+                           "CloudWatchMetrics": [{"Namespace": "Minecraft",
+                                                  "Dimensions": [["InstanceId", "World"], ["InstanceId"]],
+                                                  "Metrics": [{"Name": "mspt", "Unit": "Milliseconds",
+                                                               "StorageResolution": 1},
+                                                              {"Name": "tps", "Unit": "None", "StorageResolution": 1}]}]}
+    assert (doc["mspt"], doc["tps"], doc["World"], doc["session"]) == (12.3, 20.0, "server", "abc")
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    # Stands in for the cloudwatch agent's EMF listener, collects the lines sent to it
+    listener = socket.create_server(("127.0.0.1", 0))
+    lines = []
+
+    def serve():
+        connection, _ = listener.accept()
+        with connection, connection.makefile() as fp:
+            lines.extend(fp)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    monkeypatch.setattr(emf, "AGENT_ADDRESS", listener.getsockname())
+    monkeypatch.setattr(emf, "_sock", None)
+    yield lines
+    if emf._sock:
+        emf._sock.close()
+    thread.join(2)
+    listener.close()
+
+
+def test_emit_sends_one_line_per_call(agent):
+    emf.emit({"entities": (5, "Count")}, {"World": "server"})
+    emf.emit({}, {"World": "server"})
+    emf.emit({"entities": (6, "Count")}, {"World": "server"})
+    emf._sock.close()
+    emf._sock = None
+    threading.Event().wait(0.2)
+    assert [json.loads(line)["entities"] for line in agent] == [5, 6]
+
+
+def test_emit_falls_back_to_stdout_without_an_agent(monkeypatch, capsys):
+    free = socket.create_server(("127.0.0.1", 0))
+    address = free.getsockname()
+    free.close()
+    monkeypatch.setattr(emf, "AGENT_ADDRESS", address)
+    monkeypatch.setattr(emf, "_sock", None)
+    emf.emit({"entities": (5, "Count")}, {"World": "server"})
+    assert json.loads(capsys.readouterr().out)["entities"] == 5
@@ -0,0 +1,83 @@
+import os
+import stat
+
+import pytest
+
+import view_controller
+
+
+def controller(live=True, view=10):
+    return view_controller.Controller(view_controller.ladder(10), cooldown=0, view=view, live=live)
+
+
+def feed(control, mspt, players=5, samples=1, start=0):
+    changes = []
+    for n in range(samples):
+        changed = control.update(start + n * 10, mspt, players)
+        if changed:
+            changes.append(changed)
+    return changes
+
+
+def test_steps_down_when_ticks_run_long():
+    control = controller()
+    changes = feed(control, 60, samples=view_controller.DOWN_SAMPLES)
+    assert [rung.view for rung in changes] == [9]
+    assert control.rung.view == 9
+    # The average now stands for the new rung
+    assert control.smoothed == pytest.approx(60 * view_controller.relative_cost(control.rung, control.rungs[-1]))
+
+
+def test_holds_with_nobody_online():
+    control = controller()
+    assert feed(control, 80, players=0, samples=10) == []
+    assert control.rung.view == 10
+
+
+def test_without_live_commands_the_running_rung_and_average_stay_put():
+    control = controller(live=False)
+    changes = feed(control, 60, samples=20)
+    # Planned down until the expected mspt fits, but the server still runs at 10 and the average is still measured there
+    assert changes and control.rung.view == 10
+    assert control.smoothed == pytest.approx(60, rel=0.01)
+    planned = changes[-1]
+    assert control.expected(control.planned) <= control.high_mspt
+    assert planned.view < 10
+
+
+def test_without_live_commands_the_plan_climbs_back():
+    control = controller(live=False)
+    feed(control, 60, samples=20)
+    planned = control.planned
+    changes = feed(control, 10, samples=40, start=1000)
+    assert changes and control.planned > planned
+    assert control.rung.view == 10
+
+
+def test_climbs_only_when_the_next_rung_fits():
+    control = controller(view=6)
+    # Just under low_mspt, but 6 -> 7 is expected to cost more than high_mspt allows with a tight window
+    control.high_mspt = 30
+    assert feed(control, 29, samples=20) == []
+
+
+@pytest.fixture
+def properties(tmp_path):
+    path = tmp_path / "server.properties"
+    path.write_text("rcon.password=secret\nview-distance=10\nentity-broadcast-range-percentage=100\nmotd=hi\n")
+    os.chmod(path, 0o640)
+    return path
+
+
+def test_save_properties_keeps_the_mode(properties):
+    view_controller.save_properties(str(properties.parent), view_controller.Rung(7, 5, 80))
+    assert stat.S_IMODE(os.stat(properties).st_mode) == 0o640
+    assert properties.read_text() == ("rcon.password=secret\nview-distance=7\nentity-broadcast-range-percentage=80\n"
+                                      "motd=hi\n")
+
+
+def test_commands_only_for_templates_given():
+    rung = view_controller.Rung(7, 5, 80)
+    assert view_controller.commands_for(rung, {"view": "viewdistance {value}", "simulation": "", "entity": ""}) == \
+        ["viewdistance 7"]
+    assert view_controller.commands_for(rung, {"view": "", "simulation": "", "entity": ""}) == []
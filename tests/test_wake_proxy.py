@@ -0,0 +1,207 @@
+import asyncio
+import json
+import socket
+import time
+
+import pytest
+
+import mc_protocol
+import wake_proxy
+
+
+def test_varint_round_trip():
+    for value in (0, 1, 127, 128, 255, 25565, 2097151, 2 ** 31 - 1):
+        assert mc_protocol.parse_varint(mc_protocol.varint(value), 0) == (value, len(mc_protocol.varint(value)))
+    with pytest.raises(ValueError):
+        mc_protocol.parse_varint(b"\xff" * 5, 0)
+
+
+def test_handshake_round_trip():
+    framed = mc_protocol.handshake(756, "mc.example.com", 25565, 2)
+    length, offset = mc_protocol.parse_varint(framed, 0)
+    assert len(framed) - offset == length
+    assert mc_protocol.parse_handshake(framed[offset:]) == (756, 2)
+    with pytest.raises(ValueError):
+        mc_protocol.parse_handshake(mc_protocol.packet(0x01, b"")[1:])
+
+
+class FakeServer:
+    # Stands in for the real minecraft server: records what it's sent and echoes it back
+
+    def __init__(self):
+        self.received = bytearray()
+        self.server = None
+
+    async def handle(self, reader, writer):
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            self.received += data
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+
+
+class Proxy:
+    # wake_proxy's accept loop on a free local port, without the EC2 watcher
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def accept(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            sock, _ = await loop.sock_accept(self.listener)
+            loop.create_task(wake_proxy.handle(loop, sock, self.backend))
+
+    async def __aenter__(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.task = asyncio.ensure_future(self.accept())
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+        self.listener.close()
+
+
+@pytest.fixture
+def starts(monkeypatch):
+    # Every start_server call the proxy makes, answered the way the startup lambda would for a stopped instance
+    calls = []
+
+    def start_server(instance_id):
+        calls.append(instance_id)
+        return 200, "Server is starting", {"state": "pending", "public_ip": None, "launch_time": time.time()}
+
+    monkeypatch.setattr(wake_proxy, "start_server", start_server)
+    return calls
+
+
+def sleeping_backend(state="stopped"):
+    backend = wake_proxy.Backend("i-0123456789", 25565)
+    backend.instance = {"state": state, "public_ip": None, "launch_time": time.time()}
+    return backend
+
+
+async def read_packet(reader):
+    length = await mc_protocol.read_varint(reader.readexactly)
+    data = await reader.readexactly(length)
+    return mc_protocol.parse_varint(data, 0)[0], data
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+def test_status_ping_is_answered_while_asleep(starts):
+    async def ping():
+        async with Proxy(sleeping_backend()) as proxy:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+            writer.write(mc_protocol.handshake(756, "localhost", 25565, 1) + mc_protocol.packet(0x00))
+            packet_id, data = await read_packet(reader)
+            length, offset = mc_protocol.parse_varint(data, 1)
+            status = json.loads(data[offset:offset + length])
+            writer.write(mc_protocol.packet(0x01, (1234).to_bytes(8, "big")))
+            pong = await read_packet(reader)
+            writer.close()
+            return packet_id, status, pong
+
+    packet_id, status, (pong_id, pong) = run(ping())
+    assert packet_id == 0x00
+    assert status["version"]["protocol"] == 756
+    assert "asleep" in status["description"]["text"]
+    assert pong_id == 0x01 and pong[1:] == (1234).to_bytes(8, "big")
+    assert starts == []
+
+
+def test_status_shows_the_eta_while_starting(starts):
+    async def ping():
+        async with Proxy(sleeping_backend("pending")) as proxy:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+            writer.write(mc_protocol.handshake(756, "localhost", 25565, 1) + mc_protocol.packet(0x00))
+            _, data = await read_packet(reader)
+            writer.close()
+            return data
+
+    assert b"Server is starting, ETA" in run(ping())
+
+
+def test_login_wakes_the_server_once(starts):
+    async def login(proxy):
+        reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+        writer.write(mc_protocol.handshake(756, "localhost", 25565, 2) + mc_protocol.packet(0x00, mc_protocol.string("bot")))
+        packet_id, data = await read_packet(reader)
+        writer.close()
+        return packet_id, data
+
+    async def twice():
+        async with Proxy(sleeping_backend()) as proxy:
+            return await login(proxy), await login(proxy)
+
+    (packet_id, data), _ = run(twice())
+    assert packet_id == 0x00 and b"Starting the server" in data
+    # The second attempt falls inside START_COOLDOWN, so EC2 is only asked once
+    assert starts == ["i-0123456789"]
+
+
+def test_connections_pass_through_once_the_server_is_up(starts):
+    async def play():
+        async with FakeServer() as server:
+            backend = wake_proxy.Backend("i-0123456789", server.port, host="127.0.0.1")
+            backend.up = True
+            async with Proxy(backend) as proxy:
+                reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+                hello = mc_protocol.handshake(756, "localhost", 25565, 2) + mc_protocol.packet(0x00, mc_protocol.string("bot"))
+                writer.write(hello)
+                echoed = await reader.readexactly(len(hello))
+                writer.write(b"game traffic")
+                more = await reader.readexactly(len(b"game traffic"))
+                writer.close()
+                return hello, echoed, more, bytes(server.received)
+
+    hello, echoed, more, received = run(play())
+    # The backend sees the handshake the proxy already read, then everything after it
+    assert echoed == hello and more == b"game traffic"
+    assert received == hello + b"game traffic"
+    assert starts == []
+
+
+@pytest.mark.parametrize("sent", [b"", b"\x80", b"\x10\x00\x01"], ids=["nothing", "half a length", "half a packet"])
+def test_stalled_clients_are_dropped(starts, monkeypatch, sent):
+    monkeypatch.setattr(wake_proxy, "STEP_TIMEOUT", 0.2)
+
+    async def stall():
+        async with Proxy(sleeping_backend()) as proxy:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+            writer.write(sent)
+            started = time.monotonic()
+            rest = await reader.read()
+            writer.close()
+            return rest, time.monotonic() - started
+
+    rest, seconds = run(stall())
+    assert rest == b"" and seconds < 2
+    assert starts == []
+
+
+def test_oversized_handshake_is_dropped(starts):
+    async def big():
+        async with Proxy(sleeping_backend()) as proxy:
+            reader, writer = await asyncio.open_connection("127.0.0.1", proxy.port)
+            writer.write(mc_protocol.varint(1 << 20))
+            rest = await reader.read()
+            writer.close()
+            return rest
+
+    assert run(big()) == b""
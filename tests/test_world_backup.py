@@ -0,0 +1,103 @@
+import hashlib
+import os
+
+import pytest
+
+import world_backup
+
+
+class FakeStore:
+    # The chunk store, in memory
+
+    def __init__(self):
+        self.chunks = {}
+        self.manifests = []
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def put_chunk(self, digest, data):
+        self.chunks[digest] = bytes(data)
+        self.bytes_uploaded += len(data)
+
+    def get_chunk(self, digest):
+        return self.chunks[digest]
+
+    def put_manifest(self, manifest):
+        self.manifests.append(manifest)
+        return f"{len(self.manifests)}.json"
+
+    def latest_manifest(self):
+        return self.manifests[-1] if self.manifests else None
+
+
+@pytest.fixture
+def server_dir(tmp_path):
+    region = tmp_path / "world" / "region"
+    region.mkdir(parents=True)
+    (tmp_path / "world" / "level.dat").write_bytes(os.urandom(1000))
+    (region / "r.0.0.mca").write_bytes(os.urandom(3 * 4096))
+    return tmp_path
+
+
+def test_every_chunk_matches_its_digest(server_dir):
+    store = FakeStore()
+    result = world_backup.backup(store, str(server_dir), chunk_size=4096, workers=2)
+    assert result["uploaded_chunks"] == 4
+    for digest, data in store.chunks.items():
+        assert hashlib.sha256(data).hexdigest() == digest
+    assert len(store.manifests[-1]["files"]["world/region/r.0.0.mca"]["chunks"]) == 3
+
+
+def test_file_changing_between_reads_is_stored_as_read(server_dir, monkeypatch):
+    # The server rewrites the region file while it's being backed up: what's uploaded has to be what was hashed
+    path = str(server_dir / "world" / "region" / "r.0.0.mca")
+    real_open = open
+
+    def rewriting_open(name, mode="r", *args, **kwargs):
+        fp = real_open(name, mode, *args, **kwargs)
+        if name == path and "r" in mode:
+            with real_open(path, "r+b") as writer:
+                writer.write(b"\x01" * 4096)
+        return fp
+
+    monkeypatch.setattr("builtins.open", rewriting_open)
+    store = FakeStore()
+    world_backup.backup(store, str(server_dir), chunk_size=4096, workers=1)
+    for digest, data in store.chunks.items():
+        assert hashlib.sha256(data).hexdigest() == digest
+
+
+def test_unchanged_chunks_are_not_uploaded_again(server_dir):
+    store = FakeStore()
+    world_backup.backup(store, str(server_dir), chunk_size=4096, workers=2)
+    with open(server_dir / "world" / "region" / "r.0.0.mca", "r+b") as fp:
+        fp.seek(4096)
+        fp.write(os.urandom(4096))
+    result = world_backup.backup(store, str(server_dir), chunk_size=4096, workers=2)
+    assert result["uploaded_chunks"] == 1
+
+
+def test_restore_puts_the_world_back(server_dir, tmp_path_factory):
+    store = FakeStore()
+    world_backup.backup(store, str(server_dir), chunk_size=4096, workers=2)
+    target = tmp_path_factory.mktemp("restored")
+    world_backup.restore(store, str(target), workers=2)
+    for rel_path in ("world/level.dat", "world/region/r.0.0.mca"):
+        assert (target / rel_path).read_bytes() == (server_dir / rel_path).read_bytes()
+
+
+def test_streaming_restore_keeps_regions_the_server_wrote(server_dir, tmp_path_factory):
+    region = server_dir / "world" / "region"
+    (region / "r.40.40.mca").write_bytes(os.urandom(4096))
+    store = FakeStore()
+    world_backup.backup(store, str(server_dir), chunk_size=4096, workers=2)
+    target = tmp_path_factory.mktemp("restored")
+
+    def server_starts():
+        # The server generates the far region itself before the restore gets to it
+        (target / "world" / "region" / "r.40.40.mca").write_bytes(b"written by the server")
+
+    result = world_backup.restore(store, str(target), workers=2, when_ready=server_starts)
+    assert (target / "world" / "region" / "r.40.40.mca").read_bytes() == b"written by the server"
+    assert result["kept_server_files"] == 1
+    assert not list((target / "world" / "region").glob("*.restoring"))
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import world_sync
+
+
+@pytest.fixture
+def tiers(tmp_path, monkeypatch):
+    # A server directory with its world persisted on "EBS", and an empty fast tier
+    monkeypatch.setattr(world_sync, "FAST_DIR", str(tmp_path / "fast"))
+    monkeypatch.setattr(world_sync, "PERSIST_DIR", str(tmp_path / "persist"))
+    server_dir = tmp_path / "minecraft" / "server"
+    server_dir.mkdir(parents=True)
+    region = tmp_path / "persist" / "server" / "world" / "region"
+    region.mkdir(parents=True)
+    for x in range(3):
+        (region / f"r.{x}.0.mca").write_bytes(os.urandom(1024))
+    return server_dir, tmp_path / "fast" / "server", tmp_path / "persist" / "server"
+
+
+def region_files(root):
+    return sorted(os.listdir(root / "world" / "region"))
+
+
+def test_hydrate_copies_the_world_and_marks_it(tiers):
+    server_dir, fast, persist = tiers
+    assert world_sync.hydrate(str(server_dir))
+    assert region_files(fast) == region_files(persist)
+    assert os.path.islink(server_dir / "world")
+    assert world_sync.hydrated(str(server_dir))
+
+
+def test_hydrate_leaves_an_already_hydrated_fast_tier_alone(tiers):
+    server_dir, fast, persist = tiers
+    world_sync.hydrate(str(server_dir))
+    (fast / "world" / "region" / "r.9.9.mca").write_bytes(b"played since")
+    assert not world_sync.hydrate(str(server_dir))
+    assert (fast / "world" / "region" / "r.9.9.mca").exists()
+
+
+def test_failed_hydrate_leaves_no_marker(tiers, monkeypatch):
+    server_dir, fast, persist = tiers
+
+    def disk_full(source, target, rate):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(world_sync, "copy_file", disk_full)
+    with pytest.raises(OSError):
+        world_sync.hydrate(str(server_dir))
+    assert not world_sync.hydrated(str(server_dir))
+
+
+def test_sync_refuses_without_the_marker(tiers):
+    server_dir, fast, persist = tiers
+    # What a half finished hydrate leaves behind: one region made it
+    (fast / "world" / "region").mkdir(parents=True)
+    (fast / "world" / "region" / "r.0.0.mca").write_bytes(b"")
+    with pytest.raises(world_sync.NotHydrated):
+        world_sync.sync(str(server_dir), 0)
+    assert region_files(persist) == ["r.0.0.mca", "r.1.0.mca", "r.2.0.mca"]
+
+
+def test_sync_copies_changes_back(tiers):
+    server_dir, fast, persist = tiers
+    world_sync.hydrate(str(server_dir))
+    (fast / "world" / "region" / "r.3.0.mca").write_bytes(b"new region")
+    (fast / "world" / "region" / "r.0.0.mca").unlink()
+    result = world_sync.sync(str(server_dir), 0)
+    assert result["world"]["files"] == 1
+    assert region_files(persist) == ["r.1.0.mca", "r.2.0.mca", "r.3.0.mca"]
+    assert (persist / "world" / "region" / "r.3.0.mca").read_bytes() == b"new region"
@@ -0,0 +1,44 @@
+import pytest
+
+from cdk_minecraft.worlds import FIRST_PORT, RCON_PORT_OFFSET, world_settings
+
+
+def ports(settings):
+    return {world["name"]: world["port"] for world in settings}
+
+
+def test_one_world_by_default():
+    [world] = world_settings()
+    assert world["name"] == "server" and world["port"] == FIRST_PORT and world["memory_share"] == 1
+    assert world["rcon_port"] == FIRST_PORT + RCON_PORT_OFFSET
+
+
+def test_server_keeps_25565_wherever_it_is_listed():
+    settings = world_settings([{"name": "creative"}, {"name": "lobby"}, {"name": "server"}])
+    assert ports(settings) == {"creative": 25566, "lobby": 25567, "server": 25565}
+
+
+def test_explicit_ports_are_kept():
+    settings = world_settings([{"name": "server"}, {"name": "creative", "port": 25600}, {"name": "lobby"}])
+    assert ports(settings) == {"server": 25565, "creative": 25600, "lobby": 25566}
+
+
+def test_server_cant_move():
+    with pytest.raises(ValueError, match="25565"):
+        world_settings([{"name": "server", "port": 25570}, {"name": "creative"}])
+
+
+@pytest.mark.parametrize("worlds", [[{"name": "creative"}],
+                                    [{"name": "server"}, {"name": "server"}],
+                                    [{"name": "server"}, {"name": "Bad Name"}],
+                                    [{"name": "server", "memoryShare": 0.7}, {"name": "creative", "memoryShare": 0.5}],
+                                    [{"name": "server"}, {"name": "creative", "port": 25566 + RCON_PORT_OFFSET - 1},
+                                     {"name": "lobby", "port": 25575}]])
+def test_invalid_worlds(worlds):
+    with pytest.raises(ValueError):
+        world_settings(worlds)
+
+
+def test_unclaimed_memory_is_split_evenly():
+    settings = world_settings([{"name": "server"}, {"name": "creative", "memoryShare": 0.5}, {"name": "lobby"}])
+    assert [world["memory_share"] for world in settings] == [0.25, 0.5, 0.25]
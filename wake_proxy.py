@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Wake-on-connect listener for a minecraft server that shuts itself down when idle.
+#
+# Run this on a small always-on host and point players at it instead of the server.  While the server is stopped it
+# answers the server list ping itself ("asleep" / "starting, ETA 90s"), and a login attempt starts the server using
+# the same code as the startup URL (minecraft_start/index.py).  Once the server is up every connection is passed
+# straight through to it.  On Linux the passthrough uses os.splice, so the traffic never gets copied into python.
+#
+# Usage:
+#   wake_proxy.py --instance-id i-0123456789abcdef0 [--listen 0.0.0.0:25565] [--backend-port 25565]
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+from mc_protocol import packet, parse_handshake, read_varint, string, varint
+from minecraft_start.index import describe_instance, eta_seconds, start_server
+
+REFRESH_SECONDS = 5         # How often we look at EC2 and the server port
+START_COOLDOWN = 30         # Login attempts closer together than this don't ask EC2 again
+STEP_TIMEOUT = 10           # Clients get this long to send each handshake packet, length and all
+PIPE_SIZE = 65536
+
+log = logging.getLogger("wake_proxy")
+
+
+class Connection:
+    # Reads minecraft packets off a non-blocking socket.  Whatever we read past the handshake stays in the buffer, so
+    # it can be forwarded when the connection gets handed to the real server.
+
+    def __init__(self, loop, sock):
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+        self.raw = bytearray()      # every byte read so far, to replay to the backend
+
+    async def read_exactly(self, size):
+        while len(self.buffer) < size:
+            data = await self.loop.sock_recv(self.sock, 4096)
+            if not data:
+                raise ConnectionError("Client went away")
+            self.buffer += data
+            self.raw += data
+        out = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return out
+
+    async def read_packet(self):
+        # The length prefix counts too, or a client could hold the connection open by never finishing it
+        return await asyncio.wait_for(self._read_packet(), STEP_TIMEOUT)
+
+    async def _read_packet(self):
+        length = await read_varint(self.read_exactly)
+        if length > 32767:
+            raise ValueError("Packet too big for a handshake")
+        return await self.read_exactly(length)
+
+
+class Backend:
+    # What we know about the real server.  Pings are answered from this without touching EC2.
+
+    def __init__(self, instance_id, port, host=None):
+        self.instance_id = instance_id
+        self.port = port
+        self.fixed_host = host
+        self.instance = {'state': 'unknown', 'public_ip': None, 'launch_time': time.time()}
+        self.up = False
+        self.last_start = 0
+        self._status_cache = {}
+
+    @property
+    def host(self):
+        return self.fixed_host or self.instance['public_ip']
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                self.instance = await loop.run_in_executor(None, describe_instance, self.instance_id, REFRESH_SECONDS)
+                self.up = bool(self.instance['state'] == 'running' and self.host and await self.port_open())
+            except Exception:
+                log.exception("Unable to check on the server")
+                self.up = False
+            self._status_cache.clear()
+            await asyncio.sleep(REFRESH_SECONDS)
+
+    async def port_open(self):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), 2)
+            writer.close()
+            return True
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def start(self):
+        if time.time() - self.last_start < START_COOLDOWN:
+            return
+        self.last_start = time.time()
+        status_code, message, instance = await asyncio.get_running_loop().run_in_executor(None, start_server,
+                                                                                          self.instance_id)
+        log.info("Start requested by a login: %s", message)
+        self.instance = instance
+        self._status_cache.clear()
+
+    def motd(self):
+        if self.instance['state'] in ('pending', 'running'):
+            return f"Server is starting, ETA {eta_seconds(self.instance, False)}s"
+        if self.instance['state'] in ('stopping', 'shutting-down'):
+            return "Server is shutting down, try again in a minute"
+        return "Server is asleep, join to wake it up"
+
+    def status_response(self, protocol):
+        # Pings come in bursts from the server list, so the encoded reply is kept until the state or ETA second changes
+        key = (protocol, int(time.time()))
+        response = self._status_cache.get(key)
+        if response is None:
+            status = {"version": {"name": "Sleeping", "protocol": protocol},
+                      "players": {"max": 0, "online": 0},
+                      "description": {"text": self.motd()}}
+            response = packet(0x00, string(json.dumps(status)))
+            self._status_cache = {key: response}
+        return response
+
+
+async def wait_ready(loop, fd, writing):
+    future = loop.create_future()
+    add, remove = (loop.add_writer, loop.remove_writer) if writing else (loop.add_reader, loop.remove_reader)
+
+    def ready():
+        remove(fd)
+        if not future.done():
+            future.set_result(None)
+
+    add(fd, ready)
+    try:
+        await future
+    finally:
+        remove(fd)
+
+
+async def splice_pump(loop, source, target):
+    # socket -> pipe -> socket, all inside the kernel
+    read_end, write_end = os.pipe()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    try:
+        while True:
+            try:
+                pending = os.splice(source.fileno(), write_end, PIPE_SIZE, flags=flags)
+            except BlockingIOError:
+                await wait_ready(loop, source.fileno(), writing=False)
+                continue
+            if not pending:
+                break
+            while pending:
+                try:
+                    pending -= os.splice(read_end, target.fileno(), pending, flags=flags)
+                except BlockingIOError:
+                    await wait_ready(loop, target.fileno(), writing=True)
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+
+
+async def copy_pump(loop, source, target):
+    # Fallback where splice isn't available, still reuses one buffer instead of allocating per read
+    buffer = bytearray(PIPE_SIZE)
+    view = memoryview(buffer)
+    while True:
+        size = await loop.sock_recv_into(source, buffer)
+        if not size:
+            break
+        await loop.sock_sendall(target, view[:size])
+
+
+async def pump(loop, source, target):
+    try:
+        if hasattr(os, "splice"):
+            await splice_pump(loop, source, target)
+        else:
+            await copy_pump(loop, source, target)
+    except OSError:
+        pass
+    finally:
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+async def proxy(loop, connection, backend):
+    address = (await loop.getaddrinfo(backend.host, backend.port, type=socket.SOCK_STREAM))[0][4]
+    upstream = socket.socket(socket.AF_INET6 if len(address) == 4 else socket.AF_INET, socket.SOCK_STREAM)
+    upstream.setblocking(False)
+    upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        await asyncio.wait_for(loop.sock_connect(upstream, address), STEP_TIMEOUT)
+        # The server needs to see the handshake we already read
+        await loop.sock_sendall(upstream, bytes(connection.raw))
+        await asyncio.gather(pump(loop, connection.sock, upstream), pump(loop, upstream, connection.sock))
+    finally:
+        upstream.close()
+
+
+async def handle(loop, sock, backend):
+    sock.setblocking(False)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection = Connection(loop, sock)
+    try:
+        protocol, next_state = parse_handshake(await connection.read_packet())
+        if backend.up:
+            await proxy(loop, connection, backend)
+        elif next_state == 1:
+            await connection.read_packet()                                  # status request
+            await loop.sock_sendall(sock, backend.status_response(protocol))
+            ping = await connection.read_packet()                           # ping, answered with the same payload
+            await loop.sock_sendall(sock, varint(len(ping)) + ping)
+        elif next_state == 2:
+            await backend.start()
+            reason = {"text": f"Starting the server, ETA {eta_seconds(backend.instance, False)}s. "
+                              "Try again when it shows up in your server list."}
+            await loop.sock_sendall(sock, packet(0x00, string(json.dumps(reason))))
+    except (ConnectionError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError, OSError):
+        pass
+    finally:
+        sock.close()
+
+
+async def serve(listen_host, listen_port, backend):
+    loop = asyncio.get_running_loop()
+    server = socket.create_server((listen_host, listen_port), backlog=1024, reuse_port=hasattr(socket, "SO_REUSEPORT"))
+    server.setblocking(False)
+    watcher = asyncio.ensure_future(backend.watch())
+    log.info("Listening on %s:%s for %s", listen_host, listen_port, backend.instance_id)
+    try:
+        while True:
+            sock, _ = await loop.sock_accept(server)
+            loop.create_task(handle(loop, sock, backend))
+    finally:
+        watcher.cancel()
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer pings for a sleeping minecraft server and wake it on login")
+    parser.add_argument("--instance-id", default=os.environ.get("INSTANCE_ID"), required="INSTANCE_ID" not in os.environ)
+    parser.add_argument("--listen", default="0.0.0.0:25565")
+    parser.add_argument("--backend-host", help="Connect to this address instead of the instance's public IP")
+    parser.add_argument("--backend-port", type=int, default=25565)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    listen_host, listen_port = args.listen.rsplit(":", 1)
+    asyncio.run(serve(listen_host, int(listen_port), Backend(args.instance_id, args.backend_port, args.backend_host)))
+
+
+if __name__ == "__main__":
+    main()